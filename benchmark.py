@@ -0,0 +1,286 @@
+import io
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+from datetime import datetime
+from contextlib import contextmanager, redirect_stdout
+import torch
+from model import SparringCNN
+from video_info import VideoInfo, read_config
+from create_video import create_video
+from make_dataset import create_dataset
+from train import train, load_dataset
+from export_model import benchmark_variant
+from intro_cache import ffmpeg_version
+from metrics import Metrics
+from cache import atomic_write_json
+
+RESULTS_FILE = "benchmark.json"
+# A benchmark more than this much slower than before is a regression
+REGRESSION_THRESHOLD = 0.10
+FORWARD_BATCH_SIZES = (1, 8, 32, 64)
+CONFIG_ROWS = 10000
+SEGMENTS = [(2, 8), (12, 18)]
+
+
+def make_video(path, duration: int = 30, width: int = 1280, height: int = 720, fps: int = 30):
+    """
+    Generates a synthetic h264/aac test video with ffmpeg's lavfi sources,
+    with a keyframe every 2 seconds like a camera would write.
+    """
+    command = [
+        "ffmpeg",
+        "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-g", str(fps * 2),
+        "-c:a", "aac",
+        "-y", str(path)
+    ]
+    subprocess.run(command, check=True)
+
+
+@contextmanager
+def working_dir(path):
+    """
+    Runs the with block inside path, since the code being timed reads and
+    writes relative to the current directory.
+    """
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def add_stages(runs: dict[str, list[float]], prefix: str, records: list[dict]):
+    """
+    Adds the wall time of each metrics record to runs under prefix/stage.
+    """
+    for record in records:
+        runs.setdefault(f"{prefix}/{record['stage']}", []).append(record["wall_seconds"])
+
+
+def bench_create_video(video: Path, runs: dict, repeats: int):
+    """
+    Times each stage of create_video with the multipass and single pass
+    engines.
+    """
+    for engine in ("multipass", "single"):
+        info = VideoInfo("Bench Mark", "PA1", video, SEGMENTS, f"bench_{engine}")
+        for _ in range(repeats):
+            collector = Metrics()
+            scratch = Path(tempfile.mkdtemp(prefix="render_", dir="."))
+            try:
+                with collector.activate():
+                    start = perf_counter()
+                    create_video(info, str(scratch), engine=engine)
+                    runs.setdefault(f"create_video/{engine}_total", []).append(perf_counter() - start)
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+            add_stages(runs, "create_video", collector.records)
+
+
+def bench_create_dataset(video: Path, runs: dict, repeats: int):
+    """
+    Times create_dataset extracting and sorting frames, streaming and with
+    ffmpeg writing the jpegs, and relabelling them after a segment edit.
+    Leaves the last extraction in data/ for bench_train.
+    """
+    config = Path("dataset_config.csv")
+    relabelled = Path("dataset_config_relabelled.csv")
+    for path, segments in ((config, SEGMENTS), (relabelled, [(4, 10), (14, 20)])):
+        with open(path, "w") as f:
+            f.write("first,second,path,s1,e1,s2,e2\n")
+            f.write(f"Bench Mark,PA1,{video.name},{','.join(f'{a},{b}' for a, b in segments)}\n")
+
+    for streaming in (True, False):
+        mode = "streaming" if streaming else "temp_jpeg"
+        for _ in range(repeats):
+            for folder in ("data", "data_frames"):
+                shutil.rmtree(folder, ignore_errors=True)
+            with redirect_stdout(io.StringIO()):
+                start = perf_counter()
+                create_dataset(str(config), ".", streaming=streaming, metrics_path="dataset_metrics.json")
+                runs.setdefault(f"create_dataset/{mode}_total", []).append(perf_counter() - start)
+            with open("dataset_metrics.json") as f:
+                add_stages(runs, "create_dataset", json.load(f))
+            with redirect_stdout(io.StringIO()):
+                start = perf_counter()
+                create_dataset(str(relabelled), ".", streaming=streaming)
+                runs.setdefault("create_dataset/relabel", []).append(perf_counter() - start)
+                # Back to the original labels for the next run and training
+                create_dataset(str(config), ".", streaming=streaming)
+
+
+def bench_read_config(video: Path, runs: dict, repeats: int, rows: int = CONFIG_ROWS):
+    """
+    Times read_config on a config of rows rows, without and with probing.
+    Probes are cached on disk, so the probing runs after the first time
+    how long checking every row against the cache takes.
+    """
+    path = Path("big_config.csv")
+    with open(path, "w") as f:
+        f.write("first,second,path,s1,e1,s2,e2\n")
+        for i in range(rows):
+            f.write(f"Name {i},PA{i % 10},{video.name},2,8,12,18\n")
+    read_config(str(path), ".", probe=True)
+    for probe in (False, True):
+        name = f"read_config/{rows}_rows" + ("_probe" if probe else "")
+        for _ in range(repeats):
+            start = perf_counter()
+            read_config(str(path), ".", probe=probe)
+            runs.setdefault(name, []).append(perf_counter() - start)
+
+
+def bench_forward(runs: dict, repeats: int, batch_sizes=FORWARD_BATCH_SIZES):
+    """
+    Times a SparringCNN forward pass at each batch size, in seconds per batch.
+    """
+    model = SparringCNN().eval()
+    for _ in range(repeats):
+        for batch_size, ms_per_frame in benchmark_variant(model, batch_sizes).items():
+            runs.setdefault(f"forward/batch_{batch_size}", []).append(ms_per_frame * batch_size / 1000)
+
+
+def bench_train(runs: dict, repeats: int):
+    """
+    Times one training epoch on the frames bench_create_dataset left in data/.
+    """
+    for _ in range(repeats):
+        history = []
+        train(load_dataset(), 1, seed=0, verbose=False, history=history)
+        runs.setdefault("train/epoch", []).append(history[0]["train_seconds"])
+
+
+def git_commit() -> str:
+    """
+    Returns the commit the code being benchmarked is at, if it is in git.
+    """
+    result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                            cwd=Path(__file__).resolve().parent)
+    return result.stdout.strip()
+
+
+def run_benchmarks(duration: int = 30, repeats: int = 3, keep: bool = False) -> dict:
+    """
+    Runs every benchmark in a scratch directory on a synthetic video.
+
+    Parameters:
+    duration (int): length of the synthetic video in seconds (default: 30)
+    repeats (int): times each benchmark is run (default: 3)
+    keep (bool): keep the scratch directory (default: False)
+
+    Returns:
+    dict: meta data of the run, and the median, min and every run of each
+        benchmark in seconds
+    """
+    runs = dict()
+    work_dir = Path(tempfile.mkdtemp(prefix="benchmark_"))
+    try:
+        with working_dir(work_dir):
+            video = Path("synthetic.mp4").resolve()
+            make_video(video, duration)
+            benches = [
+                ("create_video", lambda: bench_create_video(video, runs, repeats)),
+                ("create_dataset", lambda: bench_create_dataset(video, runs, repeats)),
+                ("read_config", lambda: bench_read_config(video, runs, repeats)),
+                ("forward", lambda: bench_forward(runs, repeats)),
+                ("train", lambda: bench_train(runs, repeats)),
+            ]
+            for name, bench in benches:
+                print(f"Benchmarking {name}")
+                bench()
+    finally:
+        if keep:
+            print(f"Kept {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "ffmpeg": ffmpeg_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "duration": duration,
+            "repeats": repeats
+        },
+        "results": {name: {"median": median(times), "min": min(times), "runs": times}
+                    for name, times in runs.items()}
+    }
+
+
+def compare(old: dict, new: dict, threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    """
+    Prints the change of every benchmark in both runs, comparing medians.
+
+    Returns:
+    list[str]: benchmarks that got more than threshold slower
+    """
+    regressions = []
+    print(f"{'benchmark':<36}{'old s':>10}{'new s':>10}{'change':>9}")
+    for name in sorted(old["results"].keys() & new["results"].keys()):
+        before = old["results"][name]["median"]
+        after = new["results"][name]["median"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:<36}{before:>10.4f}{after:>10.4f}{change:>+9.1%}{flag}")
+    for name in sorted(old["results"].keys() ^ new["results"].keys()):
+        print(f"{name:<36} only in {'old' if name in old['results'] else 'new'} run")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark rendering, dataset extraction and training on synthetic videos.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the benchmarks and save the results")
+    run.add_argument("--out", default=RESULTS_FILE,
+                     help=f"json file to save results to (default: {RESULTS_FILE})")
+    run.add_argument("--duration", type=int, default=30,
+                     help="length of the synthetic video in seconds (default: 30)")
+    run.add_argument("--repeats", type=int, default=3,
+                     help="times each benchmark is run, the median is compared (default: 3)")
+    run.add_argument("--keep", action="store_true",
+                     help="keep the scratch directory the benchmarks ran in")
+    compare_parser = commands.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("old", help="results of the earlier run")
+    compare_parser.add_argument("new", help="results of the later run")
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                                help="fraction slower that counts as a regression "
+                                     f"(default: {REGRESSION_THRESHOLD})")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "run":
+        results = run_benchmarks(args.duration, args.repeats, args.keep)
+        atomic_write_json(args.out, results)
+        for name, result in results["results"].items():
+            print(f"{name:<36}{result['median']:>10.4f}s")
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,137 @@
+import os
+import json
+import fcntl
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+CACHE_DIR = Path(".cache")
+
+
+def file_fingerprint(path) -> dict:
+    """
+    Returns the resolved path, size and mtime of a file.
+    Used to tell whether a file changed since a value was computed from it.
+
+    Parameters:
+    path (str): path to file
+
+    Returns:
+    dict: path, size and mtime_ns of the file
+    """
+    stat = os.stat(path)
+    return {
+        "path": str(Path(path).resolve()),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns
+    }
+
+
+def atomic_write_json(path, data):
+    """
+    Writes data as json to path by writing a temporary file next to it
+    and renaming it over path, so readers never see a partial file.
+
+    Parameters:
+    path (str): path to write to
+    data: json serializable data
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Holds an exclusive lock on {path}.lock while the with block runs.
+    Works across processes, including ones on other hosts if the file
+    system supports flock.
+
+    Parameters:
+    path (str): path of the file being protected
+    """
+    lock_path = f"{path}.lock"
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def update_json(path, key: str, value):
+    """
+    Sets key to value in the json object stored at path.
+    The read-modify-write is locked and the write is atomic, so any number
+    of processes can update the file at once without losing updates.
+    """
+    with file_lock(path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = dict()
+        data[key] = value
+        atomic_write_json(path, data)
+
+
+class JsonCache():
+    """
+    On-disk cache of values computed from files.
+    Entries are keyed by the resolved path of the file and are ignored once
+    the file's size or mtime changes.
+
+    Parameters:
+    name (str): name of the cache, stored as {cache_dir}/{name}.json
+    cache_dir (str): directory of the cache file (default: .cache)
+    """
+    def __init__(self, name: str, cache_dir=CACHE_DIR):
+        self.path = Path(cache_dir) / f"{name}.json"
+        self.entries = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return dict()
+
+    def get(self, path):
+        """
+        Returns the cached value for path, or None if there is none or the
+        file changed since it was cached.
+        """
+        fingerprint = file_fingerprint(path)
+        entry = self.entries.get(fingerprint["path"])
+        if entry is None or entry["size"] != fingerprint["size"] \
+                or entry["mtime_ns"] != fingerprint["mtime_ns"]:
+            return None
+        return entry["value"]
+
+    def set(self, path, value, save: bool = True):
+        """
+        Caches value for path and saves the cache unless save is False.
+        """
+        fingerprint = file_fingerprint(path)
+        fingerprint["value"] = value
+        self.entries[fingerprint.pop("path")] = fingerprint
+        if save:
+            self.save()
+
+    def save(self):
+        # Merge with entries written by other processes since we loaded,
+        # locked so two processes saving at once can't drop each other's
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.path):
+            entries = self._load()
+            entries.update(self.entries)
+            self.entries = entries
+            atomic_write_json(self.path, self.entries)
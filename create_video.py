@@ -1,17 +1,170 @@
 import os
+import json
+import asyncio
+import tempfile
 import subprocess
+from fractions import Fraction
+from time import perf_counter
 from video_info import VideoInfo
+from keyframes import get_keyframes, read_keyframe_packets, next_keyframe, previous_keyframe, format_start_time
+from intro_cache import IntroCache
+from ffmpeg_runner import FFmpegError, run_ffmpeg, run_ffmpeg_sync, gather_all, progress_seconds
+import metrics
+
+ENGINES = ("multipass", "single")
+JOIN_MODES = ("full", "transitions")
+CUT_MODES = ("copy", "smart")
+
+# Keyframe times from ffprobe are rounded to microseconds. Seeking this far
+# past a keyframe makes sure a stream copy starts on it and not the one before.
+KEYFRAME_TOLERANCE = 0.000001
+
+# Encoders used to re-encode streams so they can be concatenated with
+# stream-copied streams of the same codec
+VIDEO_ENCODERS = {"h264": "libx264", "hevc": "libx265", "mpeg4": "mpeg4"}
+AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame", "opus": "libopus"}
+
+
+def segment_path(i: int, work_dir: str = ".") -> str:
+    """
+    Returns path of the i-th intermediate segment inside work_dir.
+    Segment 0 is the intro.
+    """
+    return os.path.join(work_dir, f"segment_{i}.mp4")
 
 
 def create_video(
         video_info: VideoInfo,
+        work_dir: str = ".",
+        progress=None,
+        engine: str = "multipass",
+        join: str = "full",
+        cut: str = "copy",
+        intro_cache: IntroCache = None
 ):
-    render_intro(video_info.first_line, video_info.second_line)
-    render_segments(video_info.path, video_info.segments)
-    join_segments(video_info.output_file_name, video_info.segments)
-    for i in range(len(video_info.segments)):
+    """
+    Renders the intro and segments of video_info and joins them together.
+    The multipass engine renders the intro and cuts every segment at once,
+    up to the ffmpeg process cap of ffmpeg_runner.
+
+    Parameters:
+    video_info (VideoInfo): video to create
+    work_dir (str): directory for intermediate segments (default: '.')
+    progress (callable): optional progress(step, total, message) callback
+        called as each stage finishes, and with how far along a long
+        encode is in the message while it runs
+    engine (str): 'multipass' renders the intro and segments to disk before
+        joining them, 'single' renders everything in one ffmpeg pass
+        (default: 'multipass')
+    join (str): how the multipass engine joins segments. 'full' re-encodes
+        every frame, 'transitions' only re-encodes the cross fades and
+        falls back to 'full' if the segments can't be stream-copied or
+        ffmpeg fails on any of its pieces
+        (default: 'full')
+    cut (str): how the multipass engine cuts segments, see render_segments
+        (default: 'copy')
+    intro_cache (IntroCache): optional cache of rendered intros used by
+        the multipass engine
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}. Expected one of {ENGINES}")
+    if join not in JOIN_MODES:
+        raise ValueError(f"Unknown join mode: {join}. Expected one of {JOIN_MODES}")
+    if cut not in CUT_MODES:
+        raise ValueError(f"Unknown cut mode: {cut}. Expected one of {CUT_MODES}")
+    total = len(video_info.segments) + 2
+
+    def report(step: int, message: str):
+        if progress is not None:
+            progress(step, total, message)
+
+    name = video_info.output_file_name
+    out_path = f"{name}.mp4"
+    # Length of the output, to show how far along an encode of it is
+    duration = 3 + sum(stop - start - 1 for start, stop in video_info.segments)
+
+    def encoding(step: int, message: str):
+        def show(fields: dict):
+            percent = min(progress_seconds(fields) * 100 / duration, 100)
+            report(step, f"{message} {percent:.0f}%")
+        return show
+
+    if engine == "single" and video_info.segments:
+        report(0, "Rendering in a single pass")
+        with metrics.stage("render_single_pass", name, [video_info.path], [out_path]):
+            render_single_pass(video_info, progress=encoding(0, "Rendering in a single pass"))
+        report(total, "Done")
+        return
+    asyncio.run(render_multipass(video_info, work_dir, report, encoding, join, cut, intro_cache))
+
+
+async def render_multipass(
+        video_info: VideoInfo,
+        work_dir: str,
+        report,
+        encoding,
+        join: str,
+        cut: str,
+        intro_cache: IntroCache
+):
+    """
+    Multipass engine of create_video.
+
+    Parameters:
+    report (callable): report(step, message) progress callback
+    encoding (callable): encoding(step, message) returns a callback for
+        the -progress blocks of the join
+    See create_video for the others
+    """
+    total = len(video_info.segments) + 2
+    name = video_info.output_file_name
+    out_path = f"{name}.mp4"
+
+    # Transitions join and smart cuts re-encode streams to match the source
+    stream_params = None
+    if join == "transitions" or cut == "smart":
+        with metrics.stage("probe_streams", name):
+            stream_params = probe_streams(str(video_info.path))
+        if stream_params.get("codec_name") not in VIDEO_ENCODERS:
+            stream_params = None
+
+    parts = [segment_path(i, work_dir) for i in range(len(video_info.segments) + 1)]
+    finished = 0
+
+    def part_done(message: str):
+        nonlocal finished
+        finished += 1
+        report(finished, message)
+
+    async def intro():
+        await render_intro(video_info.first_line, video_info.second_line, work_dir,
+                           stream_params if join == "transitions" else None, intro_cache)
+        part_done("Rendered intro")
+
+    report(0, "Rendering intro and segments")
+    # The intro and segments render at the same time, so they are one stage
+    with metrics.stage("render_parts", name, [video_info.path], parts):
+        await gather_all(
+            intro(),
+            render_segments(video_info.path, video_info.segments, work_dir,
+                            lambda i: part_done(f"Rendered segment {i}"),
+                            cut if stream_params is not None else "copy", stream_params))
+    report(total - 1, "Joining segments")
+    with metrics.stage("join_segments", name, parts, [out_path]):
+        if join == "transitions" and stream_params is not None:
+            try:
+                await join_segments_transitions(name, video_info.segments, work_dir)
+            except (ValueError, FFmpegError, subprocess.CalledProcessError):
+                # Any piece that can't be cut, rendered or probed falls back
+                await join_segments(name, video_info.segments, work_dir,
+                                    encoding(total - 1, "Joining segments"))
+        else:
+            await join_segments(name, video_info.segments, work_dir,
+                                encoding(total - 1, "Joining segments"))
+    report(total, "Done")
+    for i in range(len(video_info.segments) + 1):
         try:
-            os.remove(f"segment_{i}.mp4")
+            os.remove(segment_path(i, work_dir))
         except FileNotFoundError:
             pass
 
@@ -132,52 +285,229 @@ def make_text_intro_filter(
     filter.append("[1:a]anull[introaudio]")
 
 
-def render_intro(first_line: str, second_line: str):
+async def render_intro(
+        first_line: str,
+        second_line: str,
+        work_dir: str = ".",
+        stream_params: dict = None,
+        cache: IntroCache = None
+):
     """
     Creates intro clip with name and division.
-    Outputs video as segment_0.mp4.
+    Outputs video as segment_0.mp4 in work_dir.
 
     Parameters:
     first_line (str): first line of text
     second_line (str): second line of text
+    work_dir (str): directory to write the intro to (default: '.')
+    stream_params (dict): optional stream parameters from probe_streams.
+        When given the intro is encoded to match them so it can be
+        stream-copied next to the segments.
+    cache (IntroCache): optional cache of rendered intros. On a hit
+        ffmpeg isn't run at all.
     """
     filter = list()
     make_text_intro_filter(first_line, second_line, filter)
 
+    if stream_params is None:
+        intro = make_text_intro_video("30")
+        encode = []
+    else:
+        intro = make_text_intro_video(
+            stream_params["r_frame_rate"],
+            width=stream_params["width"],
+            height=stream_params["height"]
+        )
+        encode = encoder_args(stream_params)
+
     command = ["ffmpeg",
-               *make_text_intro_video("30"),
+               *intro,
                '-filter_complex',
-               f'"{";".join(filter)}"',
+               ";".join(filter),
                '-map', '[introvid]',
                '-map', '[introaudio]',
-               '-y',
-               'segment_0.mp4']
-    subprocess.run(' '.join(command), shell=True, capture_output=True)
-
-
-def render_segments(video_path: str, segments: list[tuple[int]]):
+               *encode,
+               '-y']
+    # The arguments hold the text, fps, resolution, colours and font size
+    if cache is not None:
+        key = cache.key(command=command)
+        if cache.get(key, segment_path(0, work_dir)):
+            return
+    command.append(segment_path(0, work_dir))
+    await run_ffmpeg(command)
+    if cache is not None:
+        cache.put(key, segment_path(0, work_dir))
+
+
+async def render_segments(
+        video_path: str,
+        segments: list[tuple[int]],
+        work_dir: str = ".",
+        on_segment=None,
+        cut: str = "copy",
+        stream_params: dict = None
+):
     """
     Cuts video into multiple segments based on the times defined in segments.
+    Every segment is cut at once, up to the ffmpeg process cap.
 
     Parameters:
     video_path (str): path to source video
     segments (list[tuple[int]]): list of 2 int tuples containing start
         and end times for segments
+    work_dir (str): directory to write segments to (default: '.')
+    on_segment (callable): optional callback called with the segment
+        number as each segment is written, in the order they finish
+    cut (str): 'copy' stream-copies from the keyframe before each start,
+        'smart' cuts on the exact start time using smart_cut
+        (default: 'copy')
+    stream_params (dict): stream parameters of the source from
+        probe_streams, needed for 'smart' (default: probed from source)
+    """
+    if cut not in CUT_MODES:
+        raise ValueError(f"Unknown cut mode: {cut}. Expected one of {CUT_MODES}")
+    if cut == "smart":
+        # Keyframe times are timestamps, but -ss seeks from the start of the file
+        offset = format_start_time(str(video_path))
+        keyframes = [keyframe - offset for keyframe in get_keyframes(str(video_path))]
+        if stream_params is None:
+            stream_params = probe_streams(str(video_path))
+
+    async def render(i: int, start: float, stop: float):
+        if cut == "smart":
+            await smart_cut(video_path, start, stop, segment_path(i, work_dir),
+                            keyframes, stream_params, work_dir, offset)
+        else:
+            await copy_cut(video_path, start, stop, segment_path(i, work_dir))
+        if on_segment is not None:
+            on_segment(i)
+
+    await gather_all(*(render(i, start, stop)
+                           for i, (start, stop) in enumerate(segments, start=1)))
+
+
+async def copy_cut(video_path: str, start: float, stop: float, out_path: str):
     """
-    for i, segment in enumerate(segments, start=1):
-        start, stop = segment
-        command = ['ffmpeg',
-                   '-hide_banner',
-                   '-ss', str(start),
-                   '-i', f'"{video_path}"',
-                   '-t', str(stop - start),
-                   '-c', 'copy',
-                   '-y',
-                   f'segment_{i}.mp4']
-        subprocess.run(' '.join(command), shell=True, capture_output=True)
+    Stream-copies start to stop of a video.
+    The cut snaps to the keyframe before start.
 
+    Parameters:
+    video_path (str): path to source video
+    start (float): start time in seconds
+    stop (float): stop time in seconds
+    out_path (str): path of output file
+    """
+    command = ['ffmpeg',
+               '-hide_banner',
+               '-ss', str(start),
+               '-i', str(video_path),
+               '-t', str(stop - start),
+               '-c', 'copy',
+               '-y',
+               out_path]
+    await run_ffmpeg(command)
+
+
+async def encode_cut(
+        video_path: str,
+        start: float,
+        stop: float,
+        out_path: str,
+        stream_params: dict,
+        offset: float = 0
+):
+    """
+    Re-encodes start to stop of a video with a frame accurate cut.
+    Frames are picked by their timestamps, so the cut holds exactly the
+    frames from start up to but not including stop, and the first of them
+    is moved to 0 so -r doesn't duplicate it to fill the gap before it.
+
+    Parameters:
+    video_path (str): path to source video
+    start (float): start time in seconds
+    stop (float): stop time in seconds
+    out_path (str): path of output file
+    stream_params (dict): stream parameters to encode with
+    offset (float): start time of the source from format_start_time
+        (default: 0)
+    """
+    # Timestamps are kept as they are in the source, -ss still counts from its start
+    trim = f"start={offset + start - KEYFRAME_TOLERANCE}:end={offset + stop - KEYFRAME_TOLERANCE}"
+    command = ['ffmpeg',
+               '-hide_banner',
+               '-copyts',
+               '-noaccurate_seek',
+               '-ss', str(max(start - 1, 0)),
+               '-i', str(video_path),
+               '-vf', f'trim={trim},setpts=PTS-STARTPTS']
+    if "sample_rate" in stream_params:
+        command += ['-af', f'atrim={trim},asetpts=PTS-STARTPTS']
+    command += [*encoder_args(stream_params),
+                '-y',
+                out_path]
+    await run_ffmpeg(command)
+
+
+async def smart_cut(
+        video_path: str,
+        start: float,
+        stop: float,
+        out_path: str,
+        keyframes: list[float],
+        stream_params: dict,
+        work_dir: str = ".",
+        offset: float = 0
+):
+    """
+    Frame accurate cut that only re-encodes from start up to the next
+    keyframe and stream-copies the rest.
 
-def join_segments(out_file_name: str, segments: list[tuple[int]]):
+    Parameters:
+    video_path (str): path to source video
+    start (float): start time in seconds
+    stop (float): stop time in seconds
+    out_path (str): path of output file
+    keyframes (list[float]): keyframe times of the source from get_keyframes,
+        less the start time of the file so they count from 0 like start
+    stream_params (dict): stream parameters of the source from probe_streams
+    work_dir (str): directory for the intermediate pieces (default: '.')
+    offset (float): start time of the source from format_start_time
+        (default: 0)
+    """
+    keyframe = next_keyframe(keyframes, start)
+    if keyframe is not None and keyframe - start < KEYFRAME_TOLERANCE:
+        await copy_cut(video_path, keyframe + KEYFRAME_TOLERANCE, stop, out_path)
+        return
+    if keyframe is None or keyframe >= stop:
+        await encode_cut(video_path, start, stop, out_path, stream_params, offset)
+        return
+
+    # Named after the output, since several cuts run at once
+    base = os.path.join(work_dir, os.path.splitext(os.path.basename(out_path))[0])
+    head = f"{base}_head.mp4"
+    tail = f"{base}_tail.mp4"
+    try:
+        # Seek just past the keyframe so rounding of its time can't snap
+        # the copy back to the keyframe before it
+        await gather_all(
+            encode_cut(video_path, start, keyframe, head, stream_params, offset),
+            copy_cut(video_path, keyframe + KEYFRAME_TOLERANCE, stop, tail))
+        await concat_copy([f"file '{concat_escape(head)}'", f"file '{concat_escape(tail)}'"],
+                          out_path, work_dir)
+    finally:
+        for path in (head, tail):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+async def join_segments(
+        out_file_name: str,
+        segments: list[tuple[int]],
+        work_dir: str = ".",
+        progress=None
+):
     """
     Joins segments produced in previous steps together with a crossfade
 
@@ -185,33 +515,445 @@ def join_segments(out_file_name: str, segments: list[tuple[int]]):
     out_file_name (str): name of output file
     segments (list[tuple[int]]): list of 2 int tuples containing start
         and end times for segments
+    work_dir (str): directory containing the segments (default: '.')
+    progress (callable): optional callback for ffmpeg's -progress blocks,
+        see run_ffmpeg
     """
     command = ["ffmpeg", "-hide_banner"]
     for i in range(0, len(segments) + 1):
-        command += ["-i", f"segment_{i}.mp4"]
+        command += ["-i", segment_path(i, work_dir)]
     command.append('-filter_complex')
     filter = list()
     for i in range(len(segments) + 1):
         filter += [f"[{i}:v]null[{i}v]", f"[{i}:a]anull[{i}a]"]
 
-    prev_offset = 0
-    segments.insert(0, (0, 3))
-    for i in range(len(segments) - 1):
-        start, stop = segments[i]
-        prev_offset = stop - start + prev_offset - 1
-        cross_fade(f"{i}v", f"{i}a", f"{i+1}v",
-                   f"{i+1}a", f"{i+1}", prev_offset, filter)
+    out = make_cross_fade_chain(segments, filter)
     command += [
-        f'"{";".join(filter)}"',
-        '-map', f'[{len(segments) - 1}v]',
-        '-map', f'[{len(segments) - 1}a]',
-        '-y', f'{out_file_name}.mp4'
+        ";".join(filter),
+        '-map', f'[{out}v]',
+        '-map', f'[{out}a]',
+        '-y', f"{out_file_name}.mp4"
+        ]
+    await run_ffmpeg(command, progress)
+
+
+def probe_streams(path: str) -> dict:
+    """
+    Reads the parameters of the first video and audio stream of a file.
+
+    Parameters:
+    path (str): path to video
+
+    Returns:
+    dict: codec_name, width, height, pix_fmt and r_frame_rate of the video
+        stream and audio_codec_name, sample_rate and channels of the audio
+        stream
+    """
+    command = ["ffprobe",
+               "-v", "error",
+               "-show_entries",
+               "stream=codec_type,codec_name,width,height,pix_fmt,r_frame_rate,sample_rate,channels",
+               "-of", "json",
+               path]
+    result = subprocess.run(command, capture_output=True, check=True)
+    params = dict()
+    for stream in json.loads(result.stdout)["streams"]:
+        if stream["codec_type"] == "video" and "width" not in params:
+            params.update(
+                codec_name=stream["codec_name"],
+                width=stream["width"],
+                height=stream["height"],
+                pix_fmt=stream["pix_fmt"],
+                r_frame_rate=stream["r_frame_rate"]
+            )
+        elif stream["codec_type"] == "audio" and "sample_rate" not in params:
+            params.update(
+                audio_codec_name=stream["codec_name"],
+                sample_rate=stream["sample_rate"],
+                channels=stream["channels"]
+            )
+    return params
+
+
+def video_times(path: str) -> tuple[float, float]:
+    """
+    Reads when the first video stream of a file starts and how long it is.
+
+    Parameters:
+    path (str): path to video
+
+    Returns:
+    tuple[float, float]: start time and duration in seconds
+    """
+    command = ["ffprobe",
+               "-v", "error",
+               "-show_entries", "stream=codec_type,start_time,duration",
+               "-of", "json",
+               path]
+    result = subprocess.run(command, capture_output=True, check=True)
+    video = next(s for s in json.loads(result.stdout)["streams"] if s["codec_type"] == "video")
+    return float(video.get("start_time") or 0), float(video["duration"])
+
+
+def encoder_args(stream_params: dict) -> list[str]:
+    """
+    Returns ffmpeg output arguments that encode streams matching stream_params.
+
+    Parameters:
+    stream_params (dict): stream parameters from probe_streams
+
+    Returns:
+    list[str]: ffmpeg output arguments
+    """
+    codec = stream_params["codec_name"]
+    if codec not in VIDEO_ENCODERS:
+        raise ValueError(f"No encoder known for video codec: {codec}")
+    command = ['-c:v', VIDEO_ENCODERS[codec],
+               '-pix_fmt', stream_params["pix_fmt"],
+               '-s', f'{stream_params["width"]}x{stream_params["height"]}',
+               '-r', stream_params["r_frame_rate"]]
+    if "sample_rate" in stream_params:
+        audio_codec = stream_params["audio_codec_name"]
+        if audio_codec not in AUDIO_ENCODERS:
+            raise ValueError(f"No encoder known for audio codec: {audio_codec}")
+        command += ['-c:a', AUDIO_ENCODERS[audio_codec],
+                    '-ar', str(stream_params["sample_rate"]),
+                    '-ac', str(stream_params["channels"])]
+    return command
+
+
+async def render_transition(
+        video_1: str,
+        video_2: str,
+        start: float,
+        offset: float,
+        end: float,
+        length: float,
+        out_path: str,
+        stream_params: dict
+):
+    """
+    Re-encodes a one second cross fade from the end of video_1 into video_2.
+    Times are timestamps in the files, like keyframe times, not seconds from
+    their first frame.
+
+    Parameters:
+    video_1 (str): path to video that fades out
+    video_2 (str): path to video that fades in
+    start (float): timestamp in video_1 to start the output from
+    offset (float): seconds after start that the cross fade begins
+    end (float): timestamp in video_2 to end the output before
+    length (float): length of the output, where video_2 reaches end, since
+        video_1 can run on under it
+    out_path (str): path of output file
+    stream_params (dict): stream parameters to encode with
+    """
+    # video_1 is padded so the output doesn't lose a frame if it ends
+    # before video_2 does, the padding is covered by video_2
+    filter = [f"[0:v]trim=start={start},tpad=stop=-1:stop_mode=clone[0v]",
+              f"[0:a]atrim=start={start},asetpts=PTS-STARTPTS[0a]",
+              f"[1:v]trim=end={end}[1v]",
+              f"[1:a]atrim=end={end},asetpts=PTS-STARTPTS[1a]"]
+    cross_fade("0v", "0a", "1v", "1a", "fade", offset, filter)
+    command = ["ffmpeg",
+               "-hide_banner",
+               "-copyts",
+               # Seek to a keyframe a bit early, trim cuts on the exact frame
+               "-noaccurate_seek",
+               '-ss', str(max(start - 1, 0)),
+               '-i', video_1,
+               '-i', video_2,
+               '-filter_complex',
+               ";".join(filter),
+               '-map', '[fadev]',
+               '-map', '[fadea]',
+               '-t', str(length),
+               *encoder_args(stream_params),
+               '-y', out_path]
+    await run_ffmpeg(command)
+
+
+async def split_at_keyframes(video_path: str, packets: list[int], out_pattern: str):
+    """
+    Stream-copies a video into pieces that start on keyframes. Every packet
+    before a keyframe in decode order goes in the piece before it, so no
+    frame is dropped or repeated where the pieces meet.
+
+    Splits are given by packet number from read_keyframe_packets, since the
+    segment muxer compares split times against timestamps it has shifted
+    by the B-frame delay or the start time of the file.
+
+    Parameters:
+    video_path (str): path to source video
+    packets (list[int]): sorted numbers of the keyframe packets to split at
+    out_pattern (str): path of the pieces with a %d for their number
+    """
+    command = ['ffmpeg',
+               '-hide_banner',
+               '-i', str(video_path),
+               '-map', '0',
+               '-c', 'copy',
+               '-f', 'segment',
+               '-segment_frames', ",".join(str(n) for n in packets),
+               '-reset_timestamps', '1',
+               '-y',
+               out_pattern]
+    await run_ffmpeg(command)
+
+
+async def join_segments_transitions(
+        out_file_name: str,
+        segments: list[tuple[int]],
+        work_dir: str = "."
+):
+    """
+    Joins segments with a crossfade, only re-encoding the transitions.
+    The body of every segment is stream-copied and the pieces are stitched
+    together with the concat demuxer. Output timing matches join_segments.
+
+    Bodies start and end on keyframes. Each transition covers a segment
+    from its last keyframe before the fade out up to the next segment's
+    first keyframe after the fade in, where the next body starts. Every
+    body and transition is rendered at once.
+
+    Parameters:
+    out_file_name (str): name of output file
+    segments (list[tuple[int]]): list of 2 int tuples containing start
+        and end times for segments
+    work_dir (str): directory containing the segments (default: '.')
+
+    Raises:
+    ValueError: if the segments can't be stream-copied together, or the
+        joined video doesn't come out as long as join_segments makes it
+    """
+    paths = [segment_path(i, work_dir) for i in range(len(segments) + 1)]
+    durations = [3] + [stop - start for start, stop in segments]
+    offsets = fade_offsets(segments)
+    last = len(paths) - 1
+
+    params = [probe_streams(path) for path in paths]
+    if any(p != params[0] for p in params):
+        raise ValueError("Segments have different stream parameters")
+
+    # Each body runs from the first keyframe after its fade in to the last
+    # keyframe before its fade out, where the next transition starts. Times
+    # are from the first frame of each part, like join_segments counts them.
+    first_frames = []
+    # Packet number of each keyframe of each part, by time from its first frame
+    keyframes = []
+    body_starts = [0]
+    body_ends = []
+    for i, path in enumerate(paths):
+        first_frame, _ = video_times(path)
+        first_frames.append(first_frame)
+        keyframes.append({time - first_frame: n for n, time in read_keyframe_packets(path)})
+        times = sorted(keyframes[i])
+        fade_out = offsets[i + 1] - offsets[i] if i < last else durations[i]
+        if i > 0:
+            keyframe = next_keyframe(times, 1)
+            if keyframe is None or keyframe >= fade_out:
+                raise ValueError(f"Segment {i} has no keyframe after its fade in")
+            body_starts.append(keyframe)
+        if i < last:
+            body_ends.append(max(previous_keyframe(times, fade_out) or 0, body_starts[i]))
+
+    lines = []
+    pieces = []
+    renders = []
+    for i, path in enumerate(paths):
+        splits = [body_starts[i]] if i > 0 else []
+        if i < last and body_ends[i] > body_starts[i]:
+            splits.append(body_ends[i])
+        if i == last or body_ends[i] > body_starts[i]:
+            pattern = os.path.join(work_dir, f"body_{i}_%d.mp4")
+            pieces += [pattern % n for n in range(len(splits) + 1)]
+            renders.append(split_at_keyframes(path, [keyframes[i][t] for t in splits], pattern))
+            # Before the first split is the fade in, which the transition covers
+            body = pattern % (1 if i > 0 else 0)
+            lines.append(f"file '{concat_escape(body)}'")
+        if i < last:
+            transition = os.path.join(work_dir, f"transition_{i}.mp4")
+            pieces.append(transition)
+            fade_at = offsets[i + 1] - offsets[i] - body_ends[i]
+            renders.append(render_transition(
+                path, paths[i + 1],
+                body_ends[i] + first_frames[i], fade_at,
+                body_starts[i + 1] + first_frames[i + 1], fade_at + body_starts[i + 1],
+                transition, params[0]))
+            lines.append(f"file '{concat_escape(transition)}'")
+
+    out_path = f"{out_file_name}.mp4"
+    try:
+        await gather_all(*renders)
+        await concat_copy(lines, out_path, work_dir)
+        # join_segments ends when the last segment does, and the last body
+        # holds every frame of it after its fade in
+        expected = offsets[last] + body_starts[last] + video_times(body)[1]
+    finally:
+        for piece in pieces:
+            try:
+                os.remove(piece)
+            except FileNotFoundError:
+                pass
+
+    length = video_times(out_path)[1]
+    if abs(length - expected) > 1 / Fraction(params[0]["r_frame_rate"]):
+        os.remove(out_path)
+        raise ValueError(f"Joined video is {length:.3f}s long, expected {expected:.3f}s")
+
+
+async def concat_copy(lines: list[str], out_path: str, work_dir: str = "."):
+    """
+    Stitches files together with the concat demuxer without re-encoding.
+
+    Parameters:
+    lines (list[str]): lines of the concat list
+    out_path (str): path of output file
+    work_dir (str): directory to write the concat list to (default: '.')
+    """
+    # Unique name, since several concats can run at once
+    fd, concat_list = tempfile.mkstemp(prefix="concat_", suffix=".txt", dir=work_dir)
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    command = ["ffmpeg",
+               "-hide_banner",
+               "-f", "concat",
+               "-safe", "0",
+               "-i", concat_list,
+               "-c", "copy",
+               "-y", out_path]
+    try:
+        await run_ffmpeg(command)
+    finally:
+        os.remove(concat_list)
+
+
+def concat_escape(path: str) -> str:
+    """
+    Returns absolute path escaped for a single quoted concat demuxer entry.
+    """
+    return os.path.abspath(path).replace("'", "'\\''")
+
+
+def fade_offsets(segments: list[tuple[int]]) -> list[float]:
+    """
+    Returns the time in the joined video where the 3 second intro and each
+    segment start. Every segment starts one second before the one before
+    it ends, when the cross fade into it begins.
+
+    Parameters:
+    segments (list[tuple[int]]): list of 2 int tuples containing start
+        and end times for segments
+
+    Returns:
+    list[float]: start time of the intro and of every segment
+    """
+    offsets = [0]
+    for start, stop in [(0, 3)] + list(segments)[:-1]:
+        offsets.append(stop - start + offsets[-1] - 1)
+    return offsets
+
+
+def make_cross_fade_chain(segments: list[tuple[int]], filter: list[str]) -> str:
+    """
+    Chains cross fades between the intro and every segment.
+    Expects streams named [0v]/[0a] for the 3 second intro and
+    [{i}v]/[{i}a] for segment i.
+
+    Parameters:
+    segments (list[tuple[int]]): list of 2 int tuples containing start
+        and end times for segments
+    filter (list): list of complex filters
+
+    Modifies:
+    filter: adds cross fade filters to filter
+
+    Returns:
+    str: name of the final output streams ({name}v and {name}a)
+    """
+    offsets = fade_offsets(segments)
+    for i in range(len(segments)):
+        cross_fade(f"{i}v", f"{i}a", f"{i+1}v",
+                   f"{i+1}a", f"{i+1}", offsets[i + 1], filter)
+    return f"{len(segments)}"
+
+
+def render_single_pass(video_info: VideoInfo, fps: str = "30", progress=None):
+    """
+    Renders the intro, cuts the segments and cross fades them in a single
+    ffmpeg pass straight from the source video, without intermediate files.
+
+    Parameters:
+    video_info (VideoInfo): video to create
+    fps (str): fps of the intro (default: '30')
+    progress (callable): optional callback for ffmpeg's -progress blocks,
+        see run_ffmpeg
+    """
+    segments = video_info.segments
+    n = len(segments)
+    # Skip decoding before the first segment and after the last one
+    first_start = min(start for start, _ in segments)
+    last_stop = max(stop for _, stop in segments)
+
+    filter = list()
+    make_text_intro_filter(video_info.first_line, video_info.second_line, filter)
+    filter += ["[introvid]null[0v]", "[introaudio]anull[0a]"]
+
+    # Source is input 2, after the intro video and audio
+    filter.append(f"[2:v]split={n}" + "".join(f"[src{i}v]" for i in range(1, n + 1)))
+    filter.append(f"[2:a]asplit={n}" + "".join(f"[src{i}a]" for i in range(1, n + 1)))
+    for i, (start, stop) in enumerate(segments, start=1):
+        start, stop = start - first_start, stop - first_start
+        filter += [
+            f"[src{i}v]trim=start={start}:end={stop},setpts=PTS-STARTPTS[{i}v]",
+            f"[src{i}a]atrim=start={start}:end={stop},asetpts=PTS-STARTPTS[{i}a]"
         ]
-    subprocess.run(' '.join(command), shell=True, capture_output=True)
+    out = make_cross_fade_chain(segments, filter)
+
+    command = ["ffmpeg",
+               "-hide_banner",
+               *make_text_intro_video(fps),
+               '-ss', str(first_start),
+               '-t', str(last_stop - first_start),
+               '-i', str(video_info.path),
+               '-filter_complex',
+               ";".join(filter),
+               '-map', f'[{out}v]',
+               '-map', f'[{out}a]',
+               '-y', f"{video_info.output_file_name}.mp4"]
+    run_ffmpeg_sync(command, progress)
+
+
+def compare_engines(video_info: VideoInfo, work_dir: str = ".") -> dict[str, float]:
+    """
+    Renders video_info with every engine and times each one.
+    Outputs are written as {output_file_name}_{engine}.mp4.
+
+    Parameters:
+    video_info (VideoInfo): video to create
+    work_dir (str): directory for intermediate segments (default: '.')
+
+    Returns:
+    dict[str, float]: wall time in seconds for each engine
+    """
+    timings = dict()
+    for engine in ENGINES:
+        info = VideoInfo(
+            video_info.first_line,
+            video_info.second_line,
+            video_info.path,
+            video_info.segments,
+            f"{video_info.output_file_name}_{engine}"
+        )
+        start = perf_counter()
+        create_video(info, work_dir, engine=engine)
+        timings[engine] = perf_counter() - start
+    return timings
 
 
 if __name__ == '__main__':
     segments = [(27, 95), (106, 112)]
     video_path = "nishant.MP4"
     info = VideoInfo("Nishant Dash", "PA1", video_path, segments)
-    create_video(info)
+    for engine, seconds in compare_engines(info).items():
+        print(f"{engine}: {seconds:.2f}s")
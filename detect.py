@@ -0,0 +1,535 @@
+import argparse
+from time import perf_counter
+import numpy as np
+import torch
+from export_model import load_variant, load_fastest_variant, EXPORT_DIR
+from frame_source import iter_frames
+from video_info import probe_video
+from packed_dataset import INCLUDE
+from proxy_cache import ProxyCache
+from keyframes import get_keyframes, previous_keyframe, format_start_time
+
+SCANS = ("dense", "coarse")
+
+
+def score_batch(model, frames: np.ndarray) -> np.ndarray:
+    """
+    Returns the probability that each frame is sparring.
+
+    Parameters:
+    model (SparringCNN): model to run
+    frames (np.ndarray): (N, H, W, 3) uint8 RGB frames
+
+    Returns:
+    np.ndarray: (N,) float32 probabilities
+    """
+    # Same normalization as train.transforms
+    x = torch.from_numpy(frames).permute(0, 3, 1, 2).float()
+    x = x.div_(255).sub_(0.5).div_(0.5)
+    with torch.inference_mode():
+        return torch.softmax(model(x), dim=1)[:, INCLUDE].numpy()
+
+
+def frame_scores(
+        video_path: str,
+        model,
+        batch_size: int = 64,
+        decode_threads: int = 0,
+        width: int = None,
+        height: int = None
+) -> np.ndarray:
+    """
+    Streams every frame of a video through the model in batches.
+
+    Parameters:
+    video_path (str): path to video
+    model (SparringCNN): model to run
+    batch_size (int): frames per forward pass (default: 64)
+    decode_threads (int): ffmpeg decode threads, 0 picks automatically
+        (default: 0)
+    width (int): width frames are scaled to (default: model.input_size)
+    height (int): height frames are scaled to (default: model.input_size)
+
+    Returns:
+    np.ndarray: probability that each frame is sparring, index 0 is frame 1
+    """
+    if width is None or height is None:
+        width, height = model.input_size
+    frames = iter_frames(video_path, width, height, "rgb24", decode_threads)
+    return score_frames((frame for _, frame in frames), model, batch_size)
+
+
+def score_frames(frames, model, batch_size: int = 64) -> np.ndarray:
+    """
+    Scores frames from an iterable in batches copied into one preallocated
+    array.
+
+    Parameters:
+    frames (iterable): (H, W, 3) uint8 RGB frames
+    model (SparringCNN): model to run
+    batch_size (int): frames per forward pass (default: 64)
+
+    Returns:
+    np.ndarray: probability that each frame is sparring
+    """
+    batch = None
+    scores = []
+    n = 0
+    for frame in frames:
+        if batch is None:
+            batch = np.empty((batch_size, *frame.shape), dtype=np.uint8)
+        batch[n] = frame
+        n += 1
+        if n == batch_size:
+            scores.append(score_batch(model, batch))
+            n = 0
+    if n:
+        scores.append(score_batch(model, batch[:n]))
+    if not scores:
+        return np.empty(0, dtype=np.float32)
+    return np.concatenate(scores)
+
+
+def smooth(scores: np.ndarray, window: int) -> np.ndarray:
+    """
+    Centered moving average of scores over window frames.
+    """
+    if window <= 1 or len(scores) == 0:
+        return scores
+    kernel = np.ones(window) / window
+    padded = np.pad(scores, (window // 2, window - 1 - window // 2), mode="edge")
+    return np.convolve(padded, kernel, mode="valid")
+
+
+def scores_to_segments(
+        scores: np.ndarray,
+        fps: float,
+        threshold: float = 0.5,
+        smooth_seconds: float = 1.0,
+        min_seconds: float = 2.0,
+        merge_seconds: float = 1.0
+) -> list[tuple[int]]:
+    """
+    Turns per-frame scores into (start, stop) segments in whole seconds,
+    the form VideoInfo and create_video take.
+
+    Parameters:
+    scores (np.ndarray): probability that each frame is sparring
+    fps (float): fps of the video
+    threshold (float): smoothed score a frame needs to be sparring (default: 0.5)
+    smooth_seconds (float): moving average window (default: 1.0)
+    min_seconds (float): shortest segment kept (default: 2.0)
+    merge_seconds (float): segments closer than this are merged (default: 1.0)
+
+    Returns:
+    list[tuple[int]]: list of 2 int tuples containing start and end times
+    """
+    mask = smooth(scores, max(1, round(smooth_seconds * fps))) >= threshold
+    return mask_to_segments(mask, fps, min_seconds, merge_seconds)
+
+
+def mask_to_segments(
+        mask: np.ndarray,
+        fps: float,
+        min_seconds: float = 2.0,
+        merge_seconds: float = 1.0
+) -> list[tuple[int]]:
+    """
+    Turns a per-frame sparring mask into (start, stop) segments in whole
+    seconds. See scores_to_segments.
+    """
+    # Frames where the mask turns on and off
+    edges = np.diff(np.concatenate(([False], mask, [False])).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+
+    runs = []
+    for start, stop in zip(starts, stops):
+        if runs and (start - runs[-1][1]) / fps < merge_seconds:
+            runs[-1][1] = stop
+        else:
+            runs.append([start, stop])
+
+    segments = []
+    for start, stop in runs:
+        if (stop - start) / fps >= min_seconds:
+            # Frame numbers start at 1, matching make_dataset's labels
+            segments.append((round((start + 1) / fps), round(stop / fps)))
+    return segments
+
+
+def detect_segments(
+        video_path: str,
+        model,
+        batch_size: int = 64,
+        decode_threads: int = 0,
+        threshold: float = 0.5
+) -> list[tuple[int]]:
+    """
+    Finds the sparring segments of a video.
+
+    Parameters:
+    video_path (str): path to video
+    model (SparringCNN): model to run
+    batch_size (int): frames per forward pass (default: 64)
+    decode_threads (int): ffmpeg decode threads (default: 0)
+    threshold (float): smoothed score a frame needs to be sparring (default: 0.5)
+
+    Returns:
+    list[tuple[int]]: list of 2 int tuples containing start and end times
+    """
+    fps = probe_video(video_path).fps
+    scores = frame_scores(video_path, model, batch_size, decode_threads)
+    return scores_to_segments(scores, fps, threshold)
+
+
+class ScanStats():
+    """
+    Counts the work done by a scan.
+    """
+    def __init__(self):
+        self.frames_decoded = 0
+        self.frames_scored = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return f"{self.frames_decoded} frames decoded, {self.frames_scored} scored, {self.seconds:.1f}s"
+
+
+def coarse_samples(
+        video_path: str,
+        model,
+        interval: float = 1.0,
+        sample_frames: int = 5,
+        batch_size: int = 64,
+        decode_threads: int = 0,
+        keyframes: list[float] = None,
+        stats: ScanStats = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Seeks to samples roughly interval seconds apart and averages the scores
+    of sample_frames frames from each, so one odd frame can't flip a
+    sample. When keyframes are at most interval apart the samples start on
+    keyframes, which are decoded without decoding any frame before them.
+    When seeking would decode more frames than the video has, the video is
+    decoded once instead and only the sampled frames are scored.
+
+    Parameters:
+    keyframes (list[float]): keyframe times counted from the start of the
+        file (default: read from video_path)
+    See scan_segments for the others
+
+    Returns:
+    tuple[np.ndarray, np.ndarray]: frame numbers (from 1) of the middle
+        frame of each sample and the sample's mean score
+    """
+    probe = probe_video(video_path)
+    fps = probe.fps
+    width, height = model.input_size
+    if keyframes is None:
+        offset = format_start_time(str(video_path))
+        keyframes = [keyframe - offset for keyframe in get_keyframes(video_path)]
+    if len(keyframes) > 1 and np.diff(keyframes).max() <= interval:
+        # Keep only keyframes at least interval apart
+        times = [keyframes[0]]
+        for keyframe in keyframes[1:]:
+            if keyframe - times[-1] >= interval:
+                times.append(keyframe)
+    else:
+        times = list(np.arange(0, probe.duration, interval))
+
+    # ffmpeg decodes from the keyframe before each seek
+    preroll = [max(round((time - (previous_keyframe(keyframes, time) or 0)) * fps), 0)
+               for time in times]
+    if sum(preroll) + len(times) * sample_frames < probe.frame_count:
+        starts = [round(time * fps) + 1 for time in times]
+        lengths = []
+
+        def sample():
+            for time in times:
+                # Seek a quarter frame early so rounding can't skip the frame
+                frames = iter_frames(video_path, width, height, "rgb24", decode_threads,
+                                     input_args=["-ss", f"{max(time - 0.25 / fps, 0):.6f}"],
+                                     output_args=["-frames:v", str(sample_frames)])
+                lengths.append(0)
+                for _, frame in frames:
+                    lengths[-1] += 1
+                    yield frame
+
+        scores = score_frames(sample(), model, batch_size)
+        decoded = sum(preroll) + len(scores)
+    else:
+        # Keyframes are too far apart for seeking to pay off, decode the
+        # video once and only scale and score the sampled frames
+        step = max(round(interval * fps), sample_frames)
+        frames = iter_frames(video_path, width, height, "rgb24", decode_threads,
+                             output_args=["-vf", f"select=lt(mod(n\\,{step})\\,{sample_frames})",
+                                          "-vsync", "passthrough"])
+        scores = score_frames((frame for _, frame in frames), model, batch_size)
+        starts = list(range(1, probe.frame_count + 1, step))
+        lengths = [min(sample_frames, len(scores) - i) for i in range(0, len(scores), sample_frames)]
+        decoded = probe.frame_count
+    if stats is not None:
+        stats.frames_decoded += decoded
+        stats.frames_scored += len(scores)
+
+    frame_numbers = []
+    means = []
+    first = 0
+    for start, n in zip(starts, lengths):
+        if n:
+            frame_numbers.append(min(start + n // 2, probe.frame_count))
+            means.append(scores[first:first + n].mean())
+        first += n
+    return np.array(frame_numbers, dtype=int), np.array(means, dtype=np.float32)
+
+
+def refine_boundary(
+        video_path: str,
+        model,
+        fps: float,
+        frame_a: int,
+        frame_b: int,
+        label_b: bool,
+        threshold: float = 0.5,
+        window: int = 1,
+        frame_count: int = None,
+        keyframes: list[float] = None,
+        stats: ScanStats = None
+) -> int:
+    """
+    Binary searches for the first frame after frame_a with label_b,
+    seeking to and scoring the window frames around one frame per step.
+    A frame's label is its smoothed score against threshold, as in
+    scores_to_segments.
+
+    Parameters:
+    video_path (str): path to video
+    model (SparringCNN): model to run
+    fps (float): fps of the video
+    frame_a (int): frame number (from 1) without label_b
+    frame_b (int): later frame number with label_b
+    label_b (bool): whether frame_b is sparring
+    threshold (float): smoothed score a frame needs to be sparring (default: 0.5)
+    window (int): frames in the moving average (default: 1)
+    frame_count (int): frames in the video, windows are cut short there
+    keyframes (list[float]): keyframe times counted from the start of the file,
+        used to count decoded frames
+    stats (ScanStats): optional counters to add to
+
+    Returns:
+    int: first frame number with label_b
+    """
+    # Scores of the frames decoded so far, later windows overlap earlier ones
+    scored = dict()
+
+    def label(frame_number: int) -> bool:
+        first = frame_number - window // 2
+        last = frame_number + window - 1 - window // 2
+        lo = max(first, 1)
+        hi = min(last, frame_count) if frame_count else last
+        missing = [n for n in range(lo, hi + 1) if n not in scored]
+        if missing:
+            # Seek a quarter frame early so rounding can't skip the frame
+            time = (missing[0] - 1.25) / fps
+            frames = iter_frames(video_path, *model.input_size, "rgb24",
+                                 input_args=["-ss", f"{max(time, 0):.6f}"],
+                                 output_args=["-frames:v", str(missing[-1] - missing[0] + 1)])
+            scores = score_frames((frame for _, frame in frames), model)
+            scored.update(zip(range(missing[0], missing[0] + len(scores)), scores))
+            if stats is not None:
+                stats.frames_scored += len(scores)
+                keyframe = previous_keyframe(keyframes or [], time) or 0
+                stats.frames_decoded += round((time - keyframe) * fps) + len(scores)
+        numbers = [n for n in range(lo, hi + 1) if n in scored]
+        if not numbers:
+            return label_b
+        # Frames past either end repeat the edge frame like smooth does
+        numbers = np.clip(np.arange(first, last + 1), numbers[0], numbers[-1])
+        return bool(np.mean([scored[n] for n in numbers]) >= threshold)
+
+    lo, hi = frame_a, frame_b
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if label(mid) == label_b:
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+
+def scan_segments(
+        video_path: str,
+        model,
+        interval: float = 1.0,
+        threshold: float = 0.5,
+        batch_size: int = 64,
+        decode_threads: int = 0,
+        stats: ScanStats = None,
+        smooth_seconds: float = 1.0,
+        sample_frames: int = 5
+) -> list[tuple[int]]:
+    """
+    Finds the sparring segments of a video coarse to fine: a few frames
+    about interval seconds apart are scored first, then only the gaps
+    where the label changes are binary searched down to the exact frame.
+
+    The binary search labels frames by their score smoothed over
+    smooth_seconds, like detect_segments, so the boundaries it finds are
+    the dense scan's. The samples only average sample_frames frames to
+    stay sparse, so a sample can disagree with the dense scan when the
+    smoothed score is near threshold, and a segment or gap shorter than
+    interval can fall between samples. compare_scans measures how far the
+    two scans end up apart.
+
+    Parameters:
+    video_path (str): path to video
+    model (SparringCNN): model to run
+    interval (float): seconds between coarse samples (default: 1.0)
+    threshold (float): smoothed score a frame needs to be sparring (default: 0.5)
+    batch_size (int): frames per forward pass of the coarse pass (default: 64)
+    decode_threads (int): ffmpeg decode threads (default: 0)
+    stats (ScanStats): optional counters to add to
+    smooth_seconds (float): moving average window (default: 1.0)
+    sample_frames (int): frames averaged at each coarse sample (default: 5)
+
+    Returns:
+    list[tuple[int]]: list of 2 int tuples containing start and end times
+    """
+    start = perf_counter()
+    probe = probe_video(video_path)
+    fps = probe.fps
+    window = max(1, round(smooth_seconds * fps))
+    # Counted from the start of the file like the -ss seeks
+    offset = format_start_time(str(video_path))
+    keyframes = [keyframe - offset for keyframe in get_keyframes(video_path)]
+    frame_numbers, scores = coarse_samples(video_path, model, interval, sample_frames,
+                                           batch_size, decode_threads, keyframes, stats)
+    mask = np.zeros(probe.frame_count, dtype=bool)
+    if len(frame_numbers) == 0:
+        return []
+    labels = scores >= threshold
+
+    # Frames before the first sample take its label
+    mask[:frame_numbers[0] - 1] = labels[0]
+    for i in range(len(frame_numbers)):
+        frame_a = frame_numbers[i]
+        frame_b = frame_numbers[i + 1] if i + 1 < len(frame_numbers) else probe.frame_count + 1
+        if i + 1 < len(frame_numbers) and labels[i] != labels[i + 1]:
+            boundary = refine_boundary(video_path, model, fps, frame_a, frame_b,
+                                       labels[i + 1], threshold, window,
+                                       probe.frame_count, keyframes, stats)
+            mask[frame_a - 1:boundary - 1] = labels[i]
+            mask[boundary - 1:frame_b - 1] = labels[i + 1]
+        else:
+            mask[frame_a - 1:frame_b - 1] = labels[i]
+    if stats is not None:
+        stats.seconds += perf_counter() - start
+    return mask_to_segments(mask, fps)
+
+
+def segments_match(a: list[tuple[int]], b: list[tuple[int]], tolerance: float = 1) -> bool:
+    """
+    Returns True if a and b have the same number of segments and every
+    start and stop is within tolerance seconds of its counterpart.
+    """
+    if len(a) != len(b):
+        return False
+    return all(abs(x[0] - y[0]) <= tolerance and abs(x[1] - y[1]) <= tolerance
+               for x, y in zip(a, b))
+
+
+def compare_scans(
+        video_path: str,
+        model,
+        interval: float = 1.0,
+        threshold: float = 0.5,
+        tolerance: float = 1,
+        batch_size: int = 64,
+        decode_threads: int = 0
+) -> dict:
+    """
+    Runs a dense and a coarse to fine scan of a video and compares their
+    segments, frames decoded and wall time.
+
+    Returns:
+    dict: segments and ScanStats of each scan, and whether they match
+    """
+    dense = ScanStats()
+    start = perf_counter()
+    dense_segments = detect_segments(video_path, model, batch_size, decode_threads, threshold)
+    dense.seconds = perf_counter() - start
+    dense.frames_decoded = dense.frames_scored = probe_video(video_path).frame_count
+
+    coarse = ScanStats()
+    coarse_segments = scan_segments(video_path, model, interval, threshold,
+                                    batch_size, decode_threads, coarse)
+    return {
+        "dense": (dense_segments, dense),
+        "coarse": (coarse_segments, coarse),
+        "match": segments_match(dense_segments, coarse_segments, tolerance)
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Find sparring segments in a video with SparringCNN.")
+    parser.add_argument("video", help="path to video")
+    parser.add_argument("--model", default="model.pth",
+                        help="model weights saved by train.py (default: model.pth)")
+    parser.add_argument("--variant", default="fp32",
+                        help="inference variant from export_model.py, or auto for the fastest "
+                             "one that agreed with fp32 (default: fp32)")
+    parser.add_argument("--export-dir", default=str(EXPORT_DIR),
+                        help=f"folder of exported variants (default: {EXPORT_DIR})")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="frames per forward pass (default: 64)")
+    parser.add_argument("--decode-threads", type=int, default=0,
+                        help="ffmpeg decode threads, 0 picks automatically (default: 0)")
+    parser.add_argument("--torch-threads", type=int, default=None,
+                        help="threads used by torch for inference (default: torch's default)")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="smoothed score a frame needs to be sparring (default: 0.5)")
+    parser.add_argument("--scan", choices=SCANS, default="dense",
+                        help="score every frame, or sample sparsely and refine transitions (default: dense)")
+    parser.add_argument("--interval", type=float, default=1.0,
+                        help="seconds between samples of the coarse scan (default: 1.0)")
+    parser.add_argument("--compare", action="store_true",
+                        help="run both scans and compare their segments, frames decoded and time")
+    parser.add_argument("--proxy", action="store_true",
+                        help="decode from the cached 320x180 proxy of the video, making it if needed")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.torch_threads is not None:
+        torch.set_num_threads(args.torch_threads)
+    if args.variant == "auto":
+        model = load_fastest_variant(args.export_dir, args.model, args.batch_size)
+        print(f"Using {model.name}")
+    else:
+        model = load_variant(args.variant, args.export_dir, args.model)
+    if args.proxy:
+        args.video = ProxyCache().get(args.video)
+    if args.compare:
+        result = compare_scans(args.video, model, args.interval, args.threshold,
+                               batch_size=args.batch_size, decode_threads=args.decode_threads)
+        for scan in SCANS:
+            segments, stats = result[scan]
+            print(f"{scan}: {segments} ({stats})")
+        print(f"Match: {result['match']}")
+        exit(0)
+
+    start = perf_counter()
+    if args.scan == "coarse":
+        segments = scan_segments(args.video, model, args.interval, args.threshold,
+                                 args.batch_size, args.decode_threads)
+    else:
+        segments = detect_segments(args.video, model, args.batch_size,
+                                   args.decode_threads, args.threshold)
+    elapsed = perf_counter() - start
+    duration = probe_video(args.video).duration
+    print(f"Segments: {segments}")
+    # Times in the layout of a config.csv row
+    print(",".join(f"{start},{stop}" for start, stop in segments))
+    print(f"Took {elapsed:.1f}s, {duration / elapsed:.1f}x real time")
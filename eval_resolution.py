@@ -0,0 +1,90 @@
+import argparse
+from pathlib import Path
+import torch
+from torch.utils.data import DataLoader
+from model import RESOLUTIONS, DEFAULT_RESOLUTION
+from train import load_dataset, split_dataset, train
+from export_model import load_model, benchmark_variant
+
+# Split seed shared by every resolution so they are validated on the same frames
+SEED = 0
+
+
+def model_path_for(resolution: str) -> Path:
+    """
+    Returns where the model trained at resolution is saved. These are kept
+    apart from model.pth, which wasn't trained on the seeded split.
+    """
+    return Path(f"model_{resolution}.pth")
+
+
+def evaluate(model, data, batch_size: int = 64) -> float:
+    """
+    Returns the fraction of frames in data model classifies correctly.
+    """
+    model.eval()
+    correct = 0
+    with torch.inference_mode():
+        for images, labels in DataLoader(data, batch_size=batch_size):
+            correct += int((model(images).argmax(1) == labels).sum())
+    return correct / len(data)
+
+
+def eval_resolutions(
+        resolutions=tuple(RESOLUTIONS),
+        packed: bool = False,
+        retrain: bool = False,
+        num_epochs: int = 1,
+        batch_size: int = 64
+) -> dict[str, tuple[float, float]]:
+    """
+    Measures validation accuracy and inference latency of SparringCNN at each
+    resolution. Models missing from model_path_for are trained first.
+
+    Parameters:
+    resolutions (list[str]): keys of model.RESOLUTIONS
+    packed (bool): use the packed dataset instead of jpegs (default: False)
+    retrain (bool): train every resolution even if it has a model (default: False)
+    num_epochs (int): epochs to train missing models for (default: 1)
+    batch_size (int): batch size latency is measured at (default: 64)
+
+    Returns:
+    dict[str, tuple[float, float]]: accuracy and ms/frame of each resolution
+    """
+    results = dict()
+    for resolution in resolutions:
+        input_size = RESOLUTIONS[resolution]
+        resize = None if resolution == DEFAULT_RESOLUTION else input_size
+        data = load_dataset(packed, resize)
+        path = model_path_for(resolution)
+        if retrain or not path.exists():
+            model = train(data, num_epochs, input_size=input_size, seed=SEED)
+            torch.save(model.to("cpu").state_dict(), path)
+        model = load_model(path)
+        _, val_set = split_dataset(data, SEED)
+        accuracy = evaluate(model, val_set, batch_size)
+        width, height = input_size
+        ms_per_frame = benchmark_variant(model, (batch_size,), height=height, width=width)[batch_size]
+        results[resolution] = (accuracy, ms_per_frame)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare SparringCNN accuracy and speed at each input resolution.")
+    parser.add_argument("--resolutions", nargs="+", choices=RESOLUTIONS, default=list(RESOLUTIONS),
+                        help="resolutions to compare (default: all)")
+    parser.add_argument("--packed", action="store_true",
+                        help="use the packed dataset instead of jpegs")
+    parser.add_argument("--retrain", action="store_true",
+                        help="train every resolution even if it already has a model")
+    parser.add_argument("--epochs", type=int, default=1,
+                        help="epochs to train missing models for (default: 1)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = eval_resolutions(args.resolutions, args.packed, args.retrain, args.epochs)
+    print(f"{'resolution':<12}{'accuracy':>10}{'ms/frame':>10}{'frames/sec':>12}")
+    for resolution, (accuracy, ms_per_frame) in results.items():
+        print(f"{resolution:<12}{accuracy:>10.4f}{ms_per_frame:>10.3f}{1000 / ms_per_frame:>12.0f}")
@@ -0,0 +1,371 @@
+import copy
+import json
+import argparse
+from time import perf_counter
+from pathlib import Path
+import torch
+import torch.nn as nn
+from torch.ao import quantization
+from model import SparringCNN, input_size_of
+from cache import atomic_write_json, file_fingerprint
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+EXPORT_DIR = Path("exported")
+RESULTS_FILE = "variants.json"
+
+# File each variant is exported to, fp32 is loaded straight from model.pth
+VARIANT_FILES = {
+    "fp32": None,
+    "torchscript": "sparring_cnn_ts.pt",
+    "dynamic_int8": "sparring_cnn_dynamic_int8.pt",
+    "static_int8": "sparring_cnn_static_int8.pt",
+    "onnx": "sparring_cnn.onnx"
+}
+VARIANTS = tuple(VARIANT_FILES)
+# Suffix of variants that are fed channels_last input
+CHANNELS_LAST = "+cl"
+BATCH_SIZES = (1, 8, 32, 64)
+# Fraction of held-out frames a variant must classify like fp32 to be used
+MIN_AGREEMENT = 0.99
+
+
+def load_model(model_path: str = "model.pth") -> SparringCNN:
+    """
+    Loads a SparringCNN saved by train.py for inference on the CPU, at the
+    input size it was trained at.
+    """
+    state_dict = torch.load(model_path, map_location="cpu")
+    model = SparringCNN(input_size_of(state_dict))
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model
+
+
+class Variant():
+    """
+    Gives every exported model the interface of SparringCNN: a normalized
+    (N, 3, H, W) float tensor in, (N, 2) logits out.
+
+    Parameters:
+    name (str): variant name, ending in +cl for channels_last input
+    model (callable): loaded model
+    input_size (tuple[int, int]): (width, height) the model takes
+    """
+    def __init__(self, name: str, model, input_size: tuple[int, int]):
+        self.name = name
+        self.model = model
+        self.input_size = input_size
+        self.channels_last = name.endswith(CHANNELS_LAST)
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return self.model(x)
+
+    def eval(self):
+        return self
+
+
+class OnnxModel():
+    """
+    Runs an exported ONNX model with onnxruntime on torch tensors.
+    """
+    def __init__(self, path):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(str(path), options,
+                                                    providers=["CPUExecutionProvider"])
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        logits = self.session.run(None, {"frames": x.contiguous().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def available_variants(channels_last: bool = False) -> list[str]:
+    """
+    Returns the variants that can be built here. ONNX needs onnxruntime,
+    channels_last copies are added for the torch variants if asked for.
+    """
+    names = [name for name in VARIANTS if name != "onnx" or onnxruntime is not None]
+    if channels_last:
+        names += [name + CHANNELS_LAST for name in names if name != "onnx"]
+    return names
+
+
+def export_torchscript(model: SparringCNN, example: torch.Tensor, path):
+    """
+    Traces model and saves it frozen, so weights are folded into the graph.
+    """
+    with torch.inference_mode():
+        traced = torch.jit.freeze(torch.jit.trace(model, example))
+    torch.jit.save(traced, str(path))
+
+
+def export_dynamic_int8(model: SparringCNN, example: torch.Tensor, path):
+    """
+    Quantizes the weights of the fully connected layers to int8, activations
+    are quantized on the fly. The convolutions stay fp32.
+    """
+    quantized = quantization.quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+    with torch.inference_mode():
+        traced = torch.jit.trace(quantized, example)
+    torch.jit.save(traced, str(path))
+
+
+def export_static_int8(model: SparringCNN, calibration: torch.Tensor, path, batch_size: int = 32):
+    """
+    Quantizes weights and activations of every layer to int8 with the fbgemm
+    backend, using calibration frames to pick the activation ranges.
+    """
+    torch.backends.quantized.engine = "fbgemm"
+    wrapped = quantization.QuantWrapper(copy.deepcopy(model))
+    wrapped.eval()
+    wrapped.qconfig = quantization.get_default_qconfig("fbgemm")
+    quantization.prepare(wrapped, inplace=True)
+    with torch.inference_mode():
+        for batch in torch.split(calibration, batch_size):
+            wrapped(batch)
+    quantization.convert(wrapped, inplace=True)
+    with torch.inference_mode():
+        traced = torch.jit.trace(wrapped, calibration[:1])
+    torch.jit.save(traced, str(path))
+
+
+def export_onnx(model: SparringCNN, example: torch.Tensor, path):
+    """
+    Exports model to ONNX with a dynamic batch dimension.
+    """
+    torch.onnx.export(model, (example,), str(path), input_names=["frames"],
+                      output_names=["logits"], dynamic_axes={"frames": {0: "batch"}})
+
+
+def export_variants(
+        model_path: str = "model.pth",
+        calibration: torch.Tensor = None,
+        export_dir=EXPORT_DIR
+):
+    """
+    Exports every variant that can be built here from a trained model.
+
+    Parameters:
+    model_path (str): state dict saved by train.py (default: 'model.pth')
+    calibration (torch.Tensor): normalized frames for static quantization.
+        Static quantization is skipped without them
+    export_dir (str): folder to write variants to (default: 'exported')
+    """
+    export_dir = Path(export_dir)
+    export_dir.mkdir(parents=True, exist_ok=True)
+    model = load_model(model_path)
+    width, height = model.input_size
+    example = torch.zeros(1, 3, height, width)
+
+    export_torchscript(model, example, export_dir / VARIANT_FILES["torchscript"])
+    export_dynamic_int8(model, example, export_dir / VARIANT_FILES["dynamic_int8"])
+    if calibration is not None:
+        export_static_int8(model, calibration, export_dir / VARIANT_FILES["static_int8"])
+    if onnxruntime is not None:
+        export_onnx(model, example, export_dir / VARIANT_FILES["onnx"])
+
+
+def load_variant(name: str, export_dir=EXPORT_DIR, model_path: str = "model.pth") -> Variant:
+    """
+    Loads an exported variant by name, see VARIANTS. Names ending in +cl
+    load the same model and feed it channels_last input.
+    """
+    base = name.removesuffix(CHANNELS_LAST)
+    if base not in VARIANT_FILES:
+        raise ValueError(f"Unknown variant {name}, expected one of {', '.join(VARIANTS)}")
+    fp32 = load_model(model_path)
+    if base == "fp32":
+        model = fp32
+        if name.endswith(CHANNELS_LAST):
+            model = model.to(memory_format=torch.channels_last)
+    elif base == "onnx":
+        if onnxruntime is None:
+            raise ImportError("onnxruntime is needed to run the onnx variant")
+        model = OnnxModel(Path(export_dir) / VARIANT_FILES[base])
+    else:
+        if base == "static_int8":
+            torch.backends.quantized.engine = "fbgemm"
+        model = torch.jit.load(str(Path(export_dir) / VARIANT_FILES[base]), map_location="cpu")
+        model.eval()
+    return Variant(name, model, fp32.input_size)
+
+
+def held_out_frames(
+        n: int = 256,
+        packed: bool = False,
+        seed: int = 0,
+        input_size: tuple[int, int] = None
+) -> torch.Tensor:
+    """
+    Returns n normalized frames drawn at random from the validation set
+    split_dataset makes with seed, to calibrate and check variants on
+    frames the model wasn't trained on. seed and packed have to be the
+    ones the model was trained with.
+    """
+    # Imported here so loading a variant doesn't need torchvision
+    from train import load_dataset, split_dataset
+    _, data = split_dataset(load_dataset(packed, input_size), seed)
+    generator = torch.Generator().manual_seed(seed)
+    indices = torch.randperm(len(data), generator=generator)[:n]
+    return torch.stack([data[int(i)][0] for i in indices])
+
+
+def check_agreement(reference, variant, frames: torch.Tensor, batch_size: int = 64) -> tuple[float, float]:
+    """
+    Compares a variant to the fp32 model on frames.
+
+    Returns:
+    tuple[float, float]: fraction of frames given the same class, and the
+        largest difference in sparring probability
+    """
+    same = 0
+    max_diff = 0.0
+    with torch.inference_mode():
+        for batch in torch.split(frames, batch_size):
+            expected = torch.softmax(reference(batch), dim=1)
+            actual = torch.softmax(variant(batch), dim=1)
+            same += int((expected.argmax(1) == actual.argmax(1)).sum())
+            max_diff = max(max_diff, float((expected - actual).abs().max()))
+    return same / len(frames), max_diff
+
+
+def benchmark_variant(
+        variant,
+        batch_sizes=BATCH_SIZES,
+        repeats: int = 10,
+        height: int = 180,
+        width: int = 320
+) -> dict[int, float]:
+    """
+    Measures the latency of a variant at each batch size.
+
+    Returns:
+    dict[int, float]: milliseconds per frame at each batch size
+    """
+    results = dict()
+    with torch.inference_mode():
+        for batch_size in batch_sizes:
+            x = torch.randn(batch_size, 3, height, width)
+            variant(x)
+            start = perf_counter()
+            for _ in range(repeats):
+                variant(x)
+            results[batch_size] = (perf_counter() - start) * 1000 / (repeats * batch_size)
+    return results
+
+
+def evaluate_variants(
+        frames: torch.Tensor,
+        export_dir=EXPORT_DIR,
+        model_path: str = "model.pth",
+        channels_last: bool = False,
+        batch_sizes=BATCH_SIZES
+) -> dict:
+    """
+    Checks and benchmarks every exported variant and saves the results to
+    {export_dir}/variants.json for load_fastest_variant.
+
+    Returns:
+    dict: results that were saved
+    """
+    export_dir = Path(export_dir)
+    height, width = frames.shape[2:]
+    reference = load_model(model_path)
+    variants = dict()
+    for name in available_variants(channels_last):
+        base = name.removesuffix(CHANNELS_LAST)
+        if VARIANT_FILES[base] is not None and not (export_dir / VARIANT_FILES[base]).exists():
+            continue
+        variant = load_variant(name, export_dir, model_path)
+        agreement, max_diff = check_agreement(reference, variant, frames)
+        variants[name] = {
+            "agreement": agreement,
+            "max_prob_diff": max_diff,
+            "passed": agreement >= MIN_AGREEMENT,
+            "ms_per_frame": benchmark_variant(variant, batch_sizes, height=height, width=width)
+        }
+    results = {
+        "model": file_fingerprint(model_path),
+        "torch_threads": torch.get_num_threads(),
+        "variants": variants
+    }
+    atomic_write_json(export_dir / RESULTS_FILE, results)
+    return results
+
+
+def load_fastest_variant(
+        export_dir=EXPORT_DIR,
+        model_path: str = "model.pth",
+        batch_size: int = 64
+) -> Variant:
+    """
+    Loads the variant with the lowest ms/frame at the benchmarked batch size
+    closest to batch_size, out of those that agreed with fp32. Falls back to
+    fp32 if the variants haven't been evaluated for the current model.
+    """
+    try:
+        with open(Path(export_dir) / RESULTS_FILE) as f:
+            results = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return load_variant("fp32", export_dir, model_path)
+    if results["model"] != file_fingerprint(model_path):
+        return load_variant("fp32", export_dir, model_path)
+
+    def ms_per_frame(name: str) -> float:
+        timings = {int(k): v for k, v in results["variants"][name]["ms_per_frame"].items()}
+        closest = min(timings, key=lambda size: abs(size - batch_size))
+        return timings[closest]
+
+    passed = [name for name, result in results["variants"].items()
+              if result["passed"] and name in available_variants(True)]
+    if not passed:
+        return load_variant("fp32", export_dir, model_path)
+    return load_variant(min(passed, key=ms_per_frame), export_dir, model_path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export CPU inference variants of a trained SparringCNN and benchmark them.")
+    parser.add_argument("--model", default="model.pth",
+                        help="trained model to export (default: model.pth)")
+    parser.add_argument("--export-dir", default=str(EXPORT_DIR),
+                        help=f"folder to write variants to (default: {EXPORT_DIR})")
+    parser.add_argument("--packed", action="store_true",
+                        help="draw held-out frames from the packed dataset instead of jpegs")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the train/validation split the model was trained on, "
+                             "held-out frames come from its validation set (default: 0)")
+    parser.add_argument("--samples", type=int, default=256,
+                        help="held-out frames used to calibrate and check variants (default: 256)")
+    parser.add_argument("--channels-last", action="store_true",
+                        help="also benchmark the torch variants with channels_last input")
+    parser.add_argument("--torch-threads", type=int, default=None,
+                        help="torch intra-op threads (default: torch's choice)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.torch_threads is not None:
+        torch.set_num_threads(args.torch_threads)
+    if onnxruntime is None:
+        print("onnxruntime is not installed, skipping the onnx variant")
+    input_size = load_model(args.model).input_size
+    frames = held_out_frames(args.samples, args.packed, args.seed, input_size)
+    export_variants(args.model, frames, args.export_dir)
+    results = evaluate_variants(frames, args.export_dir, args.model, args.channels_last)
+
+    header = f"{'variant':<20}{'agree':>8}" + "".join(f"{'bs ' + str(b):>10}" for b in BATCH_SIZES)
+    print(header)
+    for name, result in results["variants"].items():
+        timings = "".join(f"{result['ms_per_frame'][b]:>8.2f}ms" for b in BATCH_SIZES)
+        flag = "" if result["passed"] else "  (failed check)"
+        print(f"{name:<20}{result['agreement']:>8.3f}{timings}{flag}")
+    fastest = load_fastest_variant(args.export_dir, args.model)
+    print(f"Fastest variant: {fastest.name} "
+          f"({1000 / results['variants'][fastest.name]['ms_per_frame'][64]:.0f} frames/sec at batch size 64)")
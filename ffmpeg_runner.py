@@ -0,0 +1,143 @@
+import os
+import asyncio
+import weakref
+import metrics
+
+# Default cap on ffmpeg processes one process runs at once
+MAX_PROCESSES = os.cpu_count() or 1
+# Lines of stderr shown when an ffmpeg command fails
+STDERR_TAIL_LINES = 5
+
+_max_processes = MAX_PROCESSES
+# One semaphore per event loop, since asyncio primitives can't be shared
+# between loops
+_semaphores = weakref.WeakKeyDictionary()
+
+
+class FFmpegError(Exception):
+    """
+    Raised when an ffmpeg command exits with a non-zero return code.
+
+    Parameters:
+    command (list[str]): command that was run
+    returncode (int): return code of the command
+    stderr (str): captured standard error of the command
+    """
+    def __init__(self, command: list[str], returncode: int, stderr: str):
+        super().__init__(command, returncode, stderr)
+        self.command = command
+        self.returncode = returncode
+        self.stderr = stderr
+
+    @property
+    def tail(self) -> str:
+        """
+        Last lines of stderr, where ffmpeg says what went wrong.
+        """
+        return "\n".join(self.stderr.strip().splitlines()[-STDERR_TAIL_LINES:])
+
+    def __str__(self):
+        return f"ffmpeg exited with code {self.returncode}: {self.tail}"
+
+
+def set_max_processes(n: int):
+    """
+    Sets how many ffmpeg processes this process runs at once. Call it
+    before any commands are running.
+    """
+    if n < 1:
+        raise ValueError(f"max processes must be at least 1, not {n}")
+    global _max_processes
+    _max_processes = n
+    _semaphores.clear()
+
+
+def _semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(_max_processes)
+    return _semaphores[loop]
+
+
+def progress_seconds(fields: dict) -> float:
+    """
+    Returns how many seconds of output an ffmpeg -progress block says have
+    been written, 0 if it doesn't say.
+    """
+    try:
+        return int(fields.get("out_time_us", 0)) / 1e6
+    except ValueError:
+        return 0.0
+
+
+async def run_ffmpeg(command: list[str], progress=None):
+    """
+    Runs an ffmpeg command without a shell, waiting while the process cap
+    is reached, and raises FFmpegError if it fails. If the awaiting task is
+    cancelled the process is killed.
+
+    The command writes -progress stats. Each block is passed to progress
+    as it arrives, and the last one is added to the running metrics stage.
+
+    Parameters:
+    command (list[str]): ffmpeg command split into arguments
+    progress (callable): optional callback called with a dict of the
+        fields of each -progress block, like out_time_us and frame
+    """
+    command = [command[0], "-progress", "pipe:1", "-nostats", *command[1:]]
+    async with _semaphore():
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE)
+        stderr_task = asyncio.create_task(proc.stderr.read())
+        try:
+            lines = []
+            block = dict()
+            async for line in proc.stdout:
+                line = line.decode("utf-8", errors="replace")
+                lines.append(line)
+                key, _, value = line.strip().partition("=")
+                block[key] = value
+                # Every block ends with progress=continue or progress=end
+                if key == "progress":
+                    if progress is not None:
+                        progress(block)
+                    block = dict()
+            stderr = (await stderr_task).decode("utf-8", errors="replace")
+            await proc.wait()
+        except BaseException:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            stderr_task.cancel()
+            raise
+    if proc.returncode != 0:
+        raise FFmpegError(command, proc.returncode, stderr)
+    metrics.add_ffmpeg(metrics.parse_progress("".join(lines)))
+
+
+async def gather_all(*aws) -> list:
+    """
+    Runs awaitables at once like asyncio.gather, but waits for every one
+    of them to finish before raising the first error, so a failed step
+    never leaves the others' ffmpeg processes behind or cancels one while
+    it is starting.
+
+    Returns:
+    list: results of aws in order
+    """
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+def run_ffmpeg_sync(command: list[str], progress=None):
+    """
+    Runs an ffmpeg command to completion from synchronous code, see
+    run_ffmpeg.
+    """
+    asyncio.run(run_ffmpeg(command, progress))
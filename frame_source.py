@@ -0,0 +1,483 @@
+import queue
+import argparse
+import threading
+import tracemalloc
+import subprocess
+from time import perf_counter
+from abc import ABC, abstractmethod
+import cv2
+import numpy as np
+from video_info import probe_video
+
+# Channels of each pixel format FrameSource can output
+PIX_FMT_CHANNELS = {"bgr24": 3, "rgb24": 3, "gray": 1}
+
+
+def iter_frames(
+        path: str,
+        width: int = 320,
+        height: int = 180,
+        pix_fmt: str = "bgr24",
+        threads: int = 0,
+        input_args: list[str] = None,
+        output_args: list[str] = None
+):
+    """
+    Decodes a video with ffmpeg and yields its frames as they arrive
+    through a rawvideo pipe, without writing anything to disk.
+
+    Parameters:
+    path (str): path to video
+    width (int): width to scale frames to (default: 320)
+    height (int): height to scale frames to (default: 180)
+    pix_fmt (str): 3 channel pixel format of frames (default: 'bgr24')
+    threads (int): ffmpeg decode threads, 0 picks automatically (default: 0)
+    input_args (list[str]): extra ffmpeg arguments for the input, like a
+        seek (default: None)
+    output_args (list[str]): extra ffmpeg arguments for the output, like a
+        frame limit (default: None)
+
+    Yields:
+    tuple[int, np.ndarray]: frame number starting at 1 like ffmpeg's image
+        sequence numbering, and a (height, width, 3) uint8 array
+    """
+    frame_size = width * height * 3
+    command = [
+        "ffmpeg",
+        "-loglevel", "error",
+        "-nostats",
+        "-threads", str(threads),
+        *(input_args or []),
+        "-i", str(path),
+        *(output_args or []),
+        "-s", f"{width}x{height}",
+        "-f", "rawvideo",
+        "-pix_fmt", pix_fmt,
+        "-"
+    ]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    frame_number = 0
+    try:
+        while True:
+            buffer = proc.stdout.read(frame_size)
+            if len(buffer) < frame_size:
+                break
+            frame_number += 1
+            yield frame_number, np.frombuffer(buffer, np.uint8).reshape(height, width, 3)
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        stderr = proc.stderr.read().decode("utf-8", errors="replace")
+        proc.stderr.close()
+        proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {path}: {stderr.strip()}")
+
+
+def read_frame_at(
+        path: str,
+        time: float,
+        width: int = 320,
+        height: int = 180,
+        pix_fmt: str = "bgr24"
+) -> np.ndarray:
+    """
+    Decodes the first frame at or after time with an accurate seek.
+    ffmpeg decodes from the keyframe before time up to the frame.
+
+    Parameters:
+    path (str): path to video
+    time (float): time in seconds
+
+    Returns:
+    np.ndarray: (height, width, 3) uint8 frame, or None past the end
+    """
+    frames = iter_frames(path, width, height, pix_fmt,
+                         input_args=["-ss", f"{max(time, 0):.6f}"],
+                         output_args=["-frames:v", "1"])
+    try:
+        for _, frame in frames:
+            return frame.copy()
+        return None
+    finally:
+        frames.close()
+
+
+class FrameSource(ABC):
+    """
+    Reads the frames of a video into uint8 NumPy arrays, scaled to
+    width x height and converted to pix_fmt, with a backend per decoder.
+
+    Frames are decoded on a background thread into a preallocated ring of
+    batch buffers, so decoding overlaps with whatever the caller does with
+    the previous batch and no array is allocated per frame. Frame numbers
+    start at 1 like iter_frames. A source reads one stream at a time, so
+    finish or close a batches or frames loop before starting another.
+
+    Parameters:
+    path (str): path to video
+    width (int): width to scale frames to (default: 320)
+    height (int): height to scale frames to (default: 180)
+    pix_fmt (str): pixel format of frames, a key of PIX_FMT_CHANNELS
+        (default: 'bgr24')
+    """
+    def __init__(self, path: str, width: int = 320, height: int = 180, pix_fmt: str = "bgr24"):
+        if pix_fmt not in PIX_FMT_CHANNELS:
+            raise ValueError(f"pix_fmt must be one of {', '.join(PIX_FMT_CHANNELS)}, not {pix_fmt}")
+        self.path = str(path)
+        self.width = width
+        self.height = height
+        self.pix_fmt = pix_fmt
+        probe = probe_video(path)
+        self.fps = probe.fps
+        self.frame_count = probe.frame_count
+        self.source_size = (probe.width, probe.height)
+
+    @property
+    def frame_shape(self) -> tuple[int, int, int]:
+        return (self.height, self.width, PIX_FMT_CHANNELS[self.pix_fmt])
+
+    @abstractmethod
+    def open(self, start: int, stride: int):
+        """
+        Starts decoding at frame start, keeping every stride-th frame.
+        """
+
+    @abstractmethod
+    def read_into(self, out: np.ndarray) -> bool:
+        """
+        Decodes the next kept frame into out, a C contiguous array of
+        frame_shape.
+
+        Returns:
+        bool: False past the last frame
+        """
+
+    @abstractmethod
+    def close(self):
+        """
+        Stops decoding and frees the decoder.
+        """
+
+    def batches(self, batch_size: int = 32, start: int = 1, stride: int = 1, buffers: int = 3):
+        """
+        Yields batches of frames decoded on a background thread.
+
+        Parameters:
+        batch_size (int): frames per batch, the last one may be shorter
+            (default: 32)
+        start (int): frame number to seek to (default: 1)
+        stride (int): keep every stride-th frame from start (default: 1)
+        buffers (int): batch buffers in the ring, one is read by the caller
+            while the others are decoded into (default: 3)
+
+        Yields:
+        tuple[range, np.ndarray]: frame numbers of the batch, and a
+            (n, height, width, channels) view into the ring that is only
+            valid until the next batch is asked for, copy it to keep it
+        """
+        ring = np.empty((buffers, batch_size, *self.frame_shape), np.uint8)
+        free = queue.Queue()
+        for slot in range(buffers):
+            free.put(slot)
+        filled = queue.Queue()
+        stopped = threading.Event()
+
+        def decode():
+            try:
+                self.open(start, stride)
+                try:
+                    number = start
+                    while not stopped.is_set():
+                        slot = free.get()
+                        if slot is None:
+                            break
+                        count = 0
+                        while count < batch_size and self.read_into(ring[slot, count]):
+                            count += 1
+                        if count:
+                            filled.put((slot, count, number))
+                            number += count * stride
+                        if count < batch_size:
+                            break
+                finally:
+                    self.close()
+            except Exception as error:
+                filled.put(error)
+            else:
+                filled.put(None)
+
+        thread = threading.Thread(target=decode, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = filled.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                slot, count, number = item
+                yield range(number, number + count * stride, stride), ring[slot, :count]
+                free.put(slot)
+        finally:
+            stopped.set()
+            free.put(None)
+            thread.join()
+
+    def frames(self, start: int = 1, stride: int = 1, batch_size: int = 16):
+        """
+        Yields frames one at a time, decoded in batches, see batches.
+
+        Yields:
+        tuple[int, np.ndarray]: frame number, and a (height, width, channels)
+            view that is only valid until the next batch is decoded
+        """
+        for numbers, batch in self.batches(batch_size, start, stride):
+            yield from zip(numbers, batch)
+
+    def read_at(self, frame_number: int) -> np.ndarray:
+        """
+        Seeks to and decodes a single frame.
+
+        Returns:
+        np.ndarray: (height, width, channels) uint8 frame, or None past the end
+        """
+        frame = np.empty(self.frame_shape, np.uint8)
+        self.open(frame_number, 1)
+        try:
+            return frame if self.read_into(frame) else None
+        finally:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FFmpegFrameSource(FrameSource):
+    """
+    FrameSource decoding through an ffmpeg rawvideo pipe. Scaling, pixel
+    format conversion and skipping frames for a stride all happen inside
+    ffmpeg, and frames are read from the pipe straight into the ring.
+
+    Parameters:
+    threads (int): ffmpeg decode threads, 0 picks automatically (default: 0)
+    See FrameSource for the others
+    """
+    def __init__(self, path: str, width: int = 320, height: int = 180, pix_fmt: str = "bgr24", threads: int = 0):
+        super().__init__(path, width, height, pix_fmt)
+        self.threads = threads
+        self.proc = None
+        self.finished = False
+
+    def open(self, start: int, stride: int):
+        self.close()
+        filters = [f"select=not(mod(n\\,{stride}))"] if stride > 1 else []
+        filters.append(f"scale={self.width}:{self.height}")
+        # Seek half a frame early so rounding can't skip the start frame
+        seek = ["-ss", f"{(start - 1.5) / self.fps:.6f}"] if start > 1 else []
+        command = [
+            "ffmpeg",
+            "-loglevel", "error",
+            "-nostats",
+            "-threads", str(self.threads),
+            *seek,
+            "-i", self.path,
+            "-vf", ",".join(filters),
+            "-fps_mode", "passthrough",
+            "-f", "rawvideo",
+            "-pix_fmt", self.pix_fmt,
+            "-"
+        ]
+        self.proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+        self.finished = False
+
+    def read_into(self, out: np.ndarray) -> bool:
+        view = memoryview(out).cast("B")
+        filled = 0
+        while filled < len(view):
+            n = self.proc.stdout.readinto(view[filled:])
+            if not n:
+                self.finished = True
+                return False
+            filled += n
+        return True
+
+    def close(self):
+        proc = self.proc
+        if proc is None:
+            return
+        self.proc = None
+        proc.stdout.close()
+        if not self.finished:
+            proc.kill()
+        stderr = proc.stderr.read().decode("utf-8", errors="replace")
+        proc.stderr.close()
+        proc.wait()
+        if self.finished and proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {self.path}: {stderr.strip()}")
+
+
+class CV2FrameSource(FrameSource):
+    """
+    FrameSource decoding with cv2.VideoCapture. Frames are decoded into a
+    reused full size buffer, then scaled and converted into the ring with
+    cv2. Frames skipped for a stride are grabbed but not converted.
+    """
+    def __init__(self, path: str, width: int = 320, height: int = 180, pix_fmt: str = "bgr24"):
+        super().__init__(path, width, height, pix_fmt)
+        self.capture = None
+        self.decoded = None
+        self.scaled = None
+
+    def open(self, start: int, stride: int):
+        self.close()
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            self.capture = None
+            raise RuntimeError(f"OpenCV failed to open {self.path}")
+        if start > 1:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, start - 1)
+        self.stride = stride
+        self.skip = 0
+
+    def read_into(self, out: np.ndarray) -> bool:
+        for _ in range(self.skip):
+            if not self.capture.grab():
+                return False
+        self.skip = self.stride - 1
+        ok, self.decoded = self.capture.read(self.decoded)
+        if not ok:
+            return False
+        frame = self.decoded
+        if frame.shape[:2] != (self.height, self.width):
+            target = out if self.pix_fmt == "bgr24" else self.scaled
+            frame = cv2.resize(frame, (self.width, self.height), dst=target, interpolation=cv2.INTER_AREA)
+            if self.pix_fmt == "bgr24":
+                return True
+            self.scaled = frame
+        if self.pix_fmt == "bgr24":
+            np.copyto(out, frame)
+        elif self.pix_fmt == "rgb24":
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=out)
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=out.reshape(self.height, self.width))
+        return True
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+BACKENDS = {"ffmpeg": FFmpegFrameSource, "cv2": CV2FrameSource}
+
+
+def open_source(path: str, backend: str = "ffmpeg", **kwargs) -> FrameSource:
+    """
+    Returns a FrameSource of path using backend, a key of BACKENDS.
+    """
+    return BACKENDS[backend](path, **kwargs)
+
+
+def measure(steps, trace: bool = False) -> tuple[int, float, float]:
+    """
+    Runs a read loop and measures it.
+
+    Parameters:
+    steps (iterable): yields the number of frames read by each step
+    trace (bool): trace allocations with tracemalloc, which slows reading
+        down, so time and trace in separate runs (default: False)
+
+    Returns:
+    tuple[int, float, float]: frames read, seconds taken, and bytes
+        allocated per frame after the first step, which sets up buffers.
+        Allocations are the growth of tracemalloc's peak over each step,
+        so they only cover Python and NumPy memory, not memory allocated
+        inside ffmpeg or OpenCV
+    """
+    steps = iter(steps)
+    if trace:
+        tracemalloc.start()
+    try:
+        start = perf_counter()
+        frames = next(steps, 0)
+        allocated = 0
+        traced_frames = 0
+        while True:
+            if trace:
+                tracemalloc.reset_peak()
+                current, _ = tracemalloc.get_traced_memory()
+            count = next(steps, None)
+            if count is None:
+                break
+            frames += count
+            if trace:
+                allocated += tracemalloc.get_traced_memory()[1] - current
+                traced_frames += count
+        seconds = perf_counter() - start
+    finally:
+        if trace:
+            tracemalloc.stop()
+    return frames, seconds, allocated / traced_frames if traced_frames else 0.0
+
+
+def benchmark(
+        path: str,
+        width: int = 320,
+        height: int = 180,
+        pix_fmt: str = "bgr24",
+        batch_size: int = 32,
+        stride: int = 1
+) -> dict[str, tuple[float, float]]:
+    """
+    Measures frames/sec and bytes allocated per frame of reading path with
+    each backend, and with iter_frames for comparison when pix_fmt has
+    three channels.
+
+    Returns:
+    dict[str, tuple[float, float]]: frames/sec and bytes/frame of each
+    """
+    def runs(name):
+        if name == "iter_frames":
+            return (1 for number, _ in iter_frames(path, width, height, pix_fmt)
+                    if (number - 1) % stride == 0)
+        source = open_source(path, name, width=width, height=height, pix_fmt=pix_fmt)
+        return (len(numbers) for numbers, _ in source.batches(batch_size, stride=stride))
+
+    names = list(BACKENDS)
+    if PIX_FMT_CHANNELS[pix_fmt] == 3:
+        names.append("iter_frames")
+    results = dict()
+    for name in names:
+        frames, seconds, _ = measure(runs(name))
+        _, _, bytes_per_frame = measure(runs(name), trace=True)
+        results[name] = (frames / seconds, bytes_per_frame)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark reading a video with each frame source backend.")
+    parser.add_argument("video", help="video to read")
+    parser.add_argument("--width", type=int, default=320,
+                        help="width to scale frames to (default: 320)")
+    parser.add_argument("--height", type=int, default=180,
+                        help="height to scale frames to (default: 180)")
+    parser.add_argument("--pix-fmt", choices=PIX_FMT_CHANNELS, default="bgr24",
+                        help="pixel format of frames (default: bgr24)")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="frames per batch (default: 32)")
+    parser.add_argument("--stride", type=int, default=1,
+                        help="read every stride-th frame (default: 1)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = benchmark(args.video, args.width, args.height, args.pix_fmt, args.batch_size, args.stride)
+    print(f"{'backend':<14}{'frames/sec':>12}{'KiB alloc/frame':>17}")
+    for name, (fps, bytes_per_frame) in results.items():
+        print(f"{name:<14}{fps:>12.0f}{bytes_per_frame / 1024:>17.2f}")
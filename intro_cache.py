@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from pathlib import Path
+from functools import lru_cache
+from cache import CACHE_DIR
+
+
+@lru_cache(maxsize=1)
+def ffmpeg_version() -> str:
+    """
+    Returns the first line of `ffmpeg -version`.
+    """
+    result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else ""
+
+
+class IntroCache():
+    """
+    Content addressed on-disk cache of rendered intro clips.
+    Clips are keyed by a hash of everything that affects how they look and
+    the ffmpeg version, and the least recently used clips are evicted once
+    the cache grows past max_bytes.
+
+    Parameters:
+    directory (str): directory to store clips in (default: .cache/intros)
+    max_bytes (int): size limit of the cache in bytes (default: 1 GiB)
+    """
+    def __init__(self, directory=CACHE_DIR / "intros", max_bytes: int = 1024 ** 3):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, **params) -> str:
+        """
+        Returns the cache key of an intro rendered with params.
+        """
+        params["ffmpeg_version"] = ffmpeg_version()
+        text = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.mp4"
+
+    def get(self, key: str, out_path: str) -> bool:
+        """
+        Copies the cached clip for key to out_path.
+
+        Returns:
+        bool: True if the clip was cached
+        """
+        path = self._path(key)
+        try:
+            # Mark as recently used
+            os.utime(path)
+            shutil.copyfile(path, out_path)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def put(self, key: str, clip_path: str):
+        """
+        Adds a rendered clip to the cache and evicts old clips if needed.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(clip_path, temp_path)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used clips until the cache fits in max_bytes.
+        """
+        clips = []
+        for path in self.directory.glob("*.mp4"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            clips.append((stat.st_mtime, stat.st_size, path))
+        clips.sort()
+        total = sum(size for _, size, _ in clips)
+        for _, size, path in clips:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits * 100 / lookups if lookups else 0
+        return f"Intro cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
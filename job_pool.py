@@ -0,0 +1,123 @@
+import os
+import multiprocessing
+from time import monotonic
+from queue import Empty
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from progress_bar import NestedProgressBar, ProgressBar, MIN_INTERVAL
+
+
+class JobReporter():
+    """
+    Picklable progress callback handed to each job.
+    Sends (pid, job index, value, total, message) tuples to the parent process,
+    at most one every min_interval seconds unless the message changes or the
+    value reaches total, so jobs can report as often as they like.
+    """
+    def __init__(self, queue, index: int, min_interval: float = MIN_INTERVAL):
+        self.queue = queue
+        self.index = index
+        self.min_interval = min_interval
+        self.last_put = None
+        self.last_message = None
+
+    def __call__(self, value: int, total: int, message: str = ""):
+        now = monotonic()
+        if value < total and message == self.last_message and self.last_put is not None \
+                and now - self.last_put < self.min_interval:
+            return
+        self.last_put = now
+        self.last_message = message
+        self.queue.put((os.getpid(), self.index, value, total, message))
+
+
+class JobResult():
+    def __init__(self, index: int, label: str, result=None, error: Exception = None):
+        self.index = index
+        self.label = label
+        self.result = result
+        self.error = error
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+
+def _run_job(func, job, index: int, queue):
+    return func(job, JobReporter(queue, index))
+
+
+def run_jobs(
+        func,
+        jobs: list,
+        n_workers: int,
+        labels: list[str] = None,
+        on_result=None
+) -> list[JobResult]:
+    """
+    Runs func(job, report) for every job in a pool of worker processes.
+    Shows one progress bar for the whole batch and one per active worker.
+
+    Parameters:
+    func (callable): picklable function taking a job and a JobReporter
+    jobs (list): picklable job arguments
+    n_workers (int): number of worker processes
+    labels (list[str]): names used for jobs in progress bars and results
+        (default: str of each job)
+    on_result (callable): optional callback called in this process with
+        each JobResult as soon as its job finishes
+
+    Returns:
+    list[JobResult]: one result per job in the order of jobs
+    """
+    if labels is None:
+        labels = [str(job) for job in jobs]
+    results = [None] * len(jobs)
+    if not jobs:
+        return results
+
+    bars = NestedProgressBar([ProgressBar(len(jobs))])
+    bars[0].update_message(f"Running {len(jobs)} jobs on {n_workers} workers")
+    worker_bars = dict()
+
+    def drain(queue):
+        while True:
+            try:
+                pid, index, value, total, message = queue.get_nowait()
+            except Empty:
+                return
+            if pid not in worker_bars:
+                worker_bars[pid] = len(bars)
+                bars.append(ProgressBar(max(total, 1)))
+            bar = bars[worker_bars[pid]]
+            if bar.n_jobs != max(total, 1) or value < bar.n_completed:
+                bar = ProgressBar(max(total, 1))
+                bars[worker_bars[pid]] = bar
+            bar.set_value(value)
+            bar.update_message(f"{labels[index]}: {message}")
+
+    with multiprocessing.Manager() as manager:
+        queue = manager.Queue()
+        with ProcessPoolExecutor(n_workers) as pool:
+            futures = {
+                pool.submit(_run_job, func, job, i, queue): i
+                for i, job in enumerate(jobs)
+            }
+            pending = set(futures)
+            bars.print()
+            while pending:
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                drain(queue)
+                for future in done:
+                    i = futures[future]
+                    try:
+                        results[i] = JobResult(i, labels[i], result=future.result())
+                    except Exception as e:
+                        results[i] = JobResult(i, labels[i], error=e)
+                    if on_result is not None:
+                        on_result(results[i])
+                    bars[0].increment()
+                bars.print()
+            drain(queue)
+        bars.print()
+        bars.finish()
+    return results
@@ -0,0 +1,267 @@
+import os
+import json
+import socket
+import sqlite3
+import threading
+import traceback
+from time import time
+from contextlib import closing
+
+QUEUE_FILE = "jobs.sqlite"
+STATES = ("pending", "running", "done", "failed")
+# Seconds a claimed job is held for without a heartbeat before another
+# worker may take it over
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    queue TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    error TEXT,
+    updated REAL NOT NULL,
+    UNIQUE (queue, key)
+)
+"""
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Job():
+    def __init__(self, id: int, key: str, payload: dict, attempts: int):
+        self.id = id
+        self.key = key
+        self.payload = payload
+        self.attempts = attempts
+
+
+class JobQueue():
+    """
+    Durable job table in a SQLite file that any number of worker processes,
+    on this host or others sharing the file, can pull jobs from.
+
+    Every job is pending, running, done or failed. A worker claims a
+    pending job by taking a lease on it, which it renews while the job runs.
+    If the worker dies its lease expires and the job is handed out again.
+    Jobs that fail are retried until they have been attempted max_attempts
+    times, and the last error of each job is kept.
+
+    The file uses SQLite's default rollback journal rather than WAL, since
+    WAL needs shared memory that network file systems don't provide.
+
+    Parameters:
+    path (str): path of the SQLite file (default: jobs.sqlite)
+    lease_seconds (float): length of a lease (default: 300)
+    max_attempts (int): attempts before a job is failed for good (default: 3)
+    """
+    def __init__(
+            self,
+            path: str = QUEUE_FILE,
+            lease_seconds: float = LEASE_SECONDS,
+            max_attempts: int = MAX_ATTEMPTS
+    ):
+        self.path = str(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker = worker_name()
+        with closing(self._connect()) as db:
+            db.execute(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit, transactions are started explicitly where needed
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def add(self, queue: str, key: str, payload: dict, reset: bool = False, reset_done: bool = False):
+        """
+        Adds a job to queue. A job already in the queue under key is left
+        alone if its payload is the same, unless reset is True, and reset
+        to pending otherwise. reset_done=True also resets a job that is
+        done, for when its output is known to be out of date, but leaves
+        a running job alone.
+        """
+        text = json.dumps(payload, sort_keys=True)
+        with closing(self._connect()) as db:
+            db.execute(
+                "INSERT INTO jobs (queue, key, payload, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (queue, key) DO UPDATE SET payload = excluded.payload, "
+                "state = 'pending', attempts = 0, worker = NULL, lease_expires = NULL, "
+                "error = NULL, updated = excluded.updated "
+                "WHERE payload != excluded.payload OR ? OR (? AND state = 'done')",
+                (queue, key, text, time(), reset, reset_done))
+
+    def claim(self, queue: str) -> Job:
+        """
+        Leases the oldest pending job of queue, or a running one whose lease
+        expired.
+
+        Returns:
+        Job: claimed job, or None if there is nothing left to run
+        """
+        now = time()
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose last attempt died with the lease held
+                db.execute(
+                    "UPDATE jobs SET state = 'failed', worker = NULL, updated = ?, "
+                    "error = COALESCE(error, 'lease expired') WHERE queue = ? AND state = 'running' "
+                    "AND lease_expires < ? AND attempts >= ?",
+                    (now, queue, now, self.max_attempts))
+                row = db.execute(
+                    "SELECT id, key, payload, attempts FROM jobs WHERE queue = ? AND "
+                    "(state = 'pending' OR (state = 'running' AND lease_expires < ?)) "
+                    "ORDER BY id LIMIT 1",
+                    (queue, now)).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE jobs SET state = 'running', worker = ?, lease_expires = ?, "
+                        "attempts = attempts + 1, updated = ? WHERE id = ?",
+                        (self.worker, now + self.lease_seconds, now, row[0]))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        id, key, payload, attempts = row
+        return Job(id, key, json.loads(payload), attempts + 1)
+
+    def renew(self, job: Job) -> bool:
+        """
+        Extends the lease on job.
+
+        Returns:
+        bool: False if the lease was lost to another worker
+        """
+        with closing(self._connect()) as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (time() + self.lease_seconds, job.id, self.worker))
+        return cursor.rowcount == 1
+
+    def complete(self, job: Job):
+        """
+        Marks job as done.
+        """
+        self._finish(job, "done", None)
+
+    def fail(self, job: Job, error: str):
+        """
+        Records error for job and puts it back in the queue, or fails it for
+        good once it has been attempted max_attempts times.
+        """
+        state = "pending" if job.attempts < self.max_attempts else "failed"
+        self._finish(job, state, error)
+
+    def _finish(self, job: Job, state: str, error: str):
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE jobs SET state = ?, error = ?, worker = NULL, lease_expires = NULL, "
+                "updated = ? WHERE id = ? AND worker = ?",
+                (state, error, time(), job.id, self.worker))
+
+    def retry_failed(self, queue: str) -> int:
+        """
+        Puts every failed job of queue back in the queue with no attempts.
+
+        Returns:
+        int: number of jobs put back
+        """
+        with closing(self._connect()) as db:
+            cursor = db.execute(
+                "UPDATE jobs SET state = 'pending', attempts = 0, updated = ? "
+                "WHERE queue = ? AND state = 'failed'",
+                (time(), queue))
+        return cursor.rowcount
+
+    def counts(self, queue: str) -> dict[str, int]:
+        """
+        Returns the number of jobs of queue in each state.
+        """
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT state, COUNT(*) FROM jobs WHERE queue = ? GROUP BY state",
+                              (queue,)).fetchall()
+        counts = {state: 0 for state in STATES}
+        counts.update(rows)
+        return counts
+
+    def errors(self, queue: str) -> list[tuple[str, str, int, str]]:
+        """
+        Returns the key, state, attempts and last error of every job of
+        queue that has an error.
+        """
+        with closing(self._connect()) as db:
+            return db.execute(
+                "SELECT key, state, attempts, error FROM jobs WHERE queue = ? AND error IS NOT NULL "
+                "ORDER BY id", (queue,)).fetchall()
+
+    def status(self, queue: str) -> str:
+        counts = self.counts(queue)
+        return f"Queue {queue}: " + ", ".join(f"{counts[state]} {state}" for state in STATES)
+
+
+class LeaseKeeper():
+    """
+    Renews the lease on a job from a background thread while the with
+    block runs, so jobs can take longer than one lease.
+    """
+    def __init__(self, queue: JobQueue, job: Job):
+        self.queue = queue
+        self.job = job
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.queue.lease_seconds / 3):
+            if not self.queue.renew(self.job):
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def work(job_queue: JobQueue, queue: str, func, on_claim=None) -> tuple[int, int]:
+    """
+    Claims and runs jobs of queue until none are left.
+    func is called with each job's payload, an exception marks the attempt
+    as failed and stores its traceback.
+
+    Parameters:
+    job_queue (JobQueue): queue to pull from
+    queue (str): name of the queue
+    func (callable): called with the payload of each job
+    on_claim (callable): optional callback called with each job as it is
+        claimed
+
+    Returns:
+    tuple[int, int]: number of jobs done and attempts failed by this worker
+    """
+    done = failed = 0
+    while True:
+        job = job_queue.claim(queue)
+        if job is None:
+            return done, failed
+        if on_claim is not None:
+            on_claim(job)
+        try:
+            with LeaseKeeper(job_queue, job):
+                func(job.payload)
+        except Exception:
+            job_queue.fail(job, traceback.format_exc())
+            failed += 1
+        else:
+            job_queue.complete(job)
+            done += 1
@@ -0,0 +1,106 @@
+import json
+import subprocess
+from bisect import bisect_left, bisect_right
+from cache import JsonCache
+
+_cache = None
+
+
+def read_keyframe_packets(path: str) -> list[tuple[int, float]]:
+    """
+    Reads every keyframe packet of the first video stream with ffprobe.
+    Only packet headers are read, nothing is decoded.
+
+    Parameters:
+    path (str): path to video
+
+    Returns:
+    list[tuple[int, float]]: number of each keyframe packet in decode
+        order, counting every packet of the stream, and its time in seconds
+    """
+    command = ["ffprobe",
+               "-v", "error",
+               "-select_streams", "v:0",
+               "-show_entries", "packet=pts_time,flags",
+               "-of", "csv=p=0",
+               str(path)]
+    result = subprocess.run(command, capture_output=True, check=True, text=True)
+    keyframes = []
+    for i, line in enumerate(result.stdout.splitlines()):
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append((i, float(pts_time)))
+    return keyframes
+
+
+def read_keyframes(path: str) -> list[float]:
+    """
+    Reads the times of every keyframe in the first video stream with ffprobe.
+
+    Parameters:
+    path (str): path to video
+
+    Returns:
+    list[float]: sorted keyframe times in seconds
+    """
+    return sorted(time for _, time in read_keyframe_packets(path))
+
+
+def get_keyframes(path: str, use_cache: bool = True) -> list[float]:
+    """
+    Returns the keyframe index of a video.
+    The index is cached on disk and keyed by path, size and mtime.
+
+    Parameters:
+    path (str): path to video
+    use_cache (bool): read and write the on-disk cache (default: True)
+
+    Returns:
+    list[float]: sorted keyframe times in seconds
+    """
+    global _cache
+    if not use_cache:
+        return read_keyframes(path)
+    if _cache is None:
+        _cache = JsonCache("keyframes")
+    keyframes = _cache.get(path)
+    if keyframes is None:
+        keyframes = read_keyframes(path)
+        _cache.set(path, keyframes)
+    return keyframes
+
+
+def next_keyframe(keyframes: list[float], time: float) -> float:
+    """
+    Returns the first keyframe at or after time, or None if there is none.
+    """
+    i = bisect_left(keyframes, time)
+    return keyframes[i] if i < len(keyframes) else None
+
+
+def previous_keyframe(keyframes: list[float], time: float) -> float:
+    """
+    Returns the last keyframe at or before time, or None if there is none.
+    """
+    i = bisect_right(keyframes, time)
+    return keyframes[i - 1] if i > 0 else None
+
+
+def format_start_time(path: str) -> float:
+    """
+    Reads the start time of a file, the time input -ss seeks are counted
+    from. Camcorder MTS/TS files often don't start at 0.
+
+    Parameters:
+    path (str): path to video
+
+    Returns:
+    float: start time in seconds
+    """
+    command = ["ffprobe",
+               "-v", "error",
+               "-show_entries", "format=start_time",
+               "-of", "json",
+               path]
+    result = subprocess.run(command, capture_output=True, check=True)
+    return float(json.loads(result.stdout)["format"].get("start_time") or 0)
@@ -1,13 +1,238 @@
-from video_info import read_config
-from create_video import create_video
+import os
+import shutil
+import argparse
+import tempfile
+from functools import partial
+from contextlib import nullcontext
+from video_info import read_config, VideoInfo
+from create_video import create_video, ENGINES, JOIN_MODES, CUT_MODES
 from progress_bar import ProgressBar
+from job_pool import run_jobs
+from intro_cache import IntroCache
+from manifest import BuildManifest, input_fingerprint
+import metrics
+from metrics import Metrics
+from job_queue import JobQueue, work
+import ffmpeg_runner
+
+RENDER_QUEUE = "render"
+
+
+def render_job(
+        video_info: VideoInfo,
+        report=None,
+        scratch_root: str = ".render_work",
+        engine: str = "multipass",
+        join: str = "full",
+        cut: str = "copy",
+        intro_cache: IntroCache = None,
+        collect_metrics: bool = False,
+        ffmpeg_processes: int = None
+):
+    """
+    Creates a single video inside its own scratch directory.
+    The scratch directory is always removed and a partial output is
+    removed if rendering fails.
+
+    Parameters:
+    video_info (VideoInfo): video to create
+    report (callable): optional progress(step, total, message) callback
+    scratch_root (str): directory scratch directories are created in
+    engine (str): render engine passed to create_video
+    join (str): join mode passed to create_video
+    cut (str): cut mode passed to create_video
+    intro_cache (IntroCache): optional cache of rendered intros
+    collect_metrics (bool): time each stage, see metrics (default: False)
+    ffmpeg_processes (int): most ffmpeg processes to run at once for this
+        video (default: None, ffmpeg_runner's default)
+
+    Returns:
+    tuple[int, int, list[dict]]: intro cache hits and misses of intro_cache,
+        and the metrics records of the video
+    """
+    if ffmpeg_processes is not None:
+        ffmpeg_runner.set_max_processes(ffmpeg_processes)
+    os.makedirs(scratch_root, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=f"{video_info.output_file_name}_", dir=scratch_root)
+    collector = Metrics()
+    try:
+        with collector.activate() if collect_metrics else nullcontext():
+            with metrics.stage("total", video_info.output_file_name):
+                create_video(video_info, work_dir, report, engine, join, cut, intro_cache)
+    except BaseException:
+        try:
+            os.remove(f"{video_info.output_file_name}.mp4")
+        except FileNotFoundError:
+            pass
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if intro_cache is None:
+        return (0, 0, collector.records)
+    return (intro_cache.hits, intro_cache.misses, collector.records)
+
+
+def queue_worker(
+        index: int,
+        report=None,
+        queue_path: str = None,
+        job=render_job,
+        verbose: bool = False
+) -> dict:
+    """
+    Renders videos from the render queue of a JobQueue until it is empty,
+    recording each one in the build manifest.
+
+    Parameters:
+    index (int): worker number, only used to tell workers apart
+    report (callable): optional progress(step, total, message) callback
+    queue_path (str): path of the JobQueue file
+    job (callable): render_job with its settings bound
+    verbose (bool): print each video as it is claimed (default: False)
+
+    Returns:
+    dict: number of videos done and attempts failed, intro cache hits and
+        misses, and metrics records
+    """
+    job_queue = JobQueue(queue_path)
+    manifest = BuildManifest()
+    result = {"done": 0, "failed": 0, "hits": 0, "misses": 0, "records": []}
+
+    def render(payload: dict):
+        video_info = VideoInfo.from_dict(payload["video"])
+        hits, misses, records = job(video_info, report)
+        manifest.record(video_info.output_file_name, payload["fingerprint"])
+        result.update(hits=hits, misses=misses)
+        result["records"].extend(records)
+
+    def claimed(claimed_job):
+        if verbose:
+            print(f"Creating: {claimed_job.key}.mp4 (attempt {claimed_job.attempts})")
+
+    result["done"], result["failed"] = work(job_queue, RENDER_QUEUE, render, claimed)
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create videos listed in a config file.")
+    parser.add_argument("config", nargs="?", default="config.csv",
+                        help="path to config file (default: config.csv)")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of videos to render at once (default: 1)")
+    parser.add_argument("--engine", choices=ENGINES, default="multipass",
+                        help="render engine (default: multipass)")
+    parser.add_argument("--join", choices=JOIN_MODES, default="full",
+                        help="how the multipass engine joins segments (default: full)")
+    parser.add_argument("--cut", choices=CUT_MODES, default="copy",
+                        help="how the multipass engine cuts segments (default: copy)")
+    parser.add_argument("--ffmpeg-procs", type=int, default=ffmpeg_runner.MAX_PROCESSES,
+                        help="most ffmpeg processes to run at once, shared between jobs "
+                             f"(default: {ffmpeg_runner.MAX_PROCESSES}, the number of CPUs)")
+    parser.add_argument("--intro-cache-size", type=int, default=1024,
+                        help="size limit of the intro cache in MiB, 0 disables it (default: 1024)")
+    parser.add_argument("--probe", action="store_true",
+                        help="probe every video in parallel and check its segments before rendering")
+    parser.add_argument("--force", action="store_true",
+                        help="render every video even if its inputs haven't changed")
+    parser.add_argument("--metrics", default=None,
+                        help="time each stage of each video, write the records to this .json or "
+                             ".csv file and print a summary")
+    parser.add_argument("--queue", default=None,
+                        help="add the config's videos to this SQLite job queue and render from it. "
+                             "Any number of workers on hosts sharing the file can pull from it")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="put videos that failed every attempt back in the queue")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    config = read_config()
-    bar = ProgressBar(len(config))
-    for c in config:
-        bar.print(f"Creating: {c.output_file_name}.mp4")
-        create_video(c)
-        bar.increment()
-    bar.print()
+    args = parse_args()
+    config = read_config(args.config, probe=args.probe)
+
+    # Skip outputs whose inputs haven't changed since they were last built
+    manifest = BuildManifest()
+    settings = {"engine": args.engine, "join": args.join, "cut": args.cut}
+    fingerprints = {c.output_file_name: input_fingerprint(c, settings) for c in config}
+    if not args.force:
+        skipped = len(config)
+        config = [c for c in config
+                  if not manifest.is_current(c.output_file_name, fingerprints[c.output_file_name])]
+        skipped -= len(config)
+        if skipped:
+            print(f"Skipping {skipped} up to date videos")
+    if args.queue is not None:
+        job_queue = JobQueue(args.queue)
+        if args.retry_failed:
+            job_queue.retry_failed(RENDER_QUEUE)
+        # Every video left in config is out of date, even one whose job is
+        # done with the same payload, e.g. because its output was deleted
+        for c in config:
+            job_queue.add(RENDER_QUEUE, c.output_file_name,
+                          {"video": c.to_dict(), "fingerprint": fingerprints[c.output_file_name]},
+                          reset=args.force, reset_done=True)
+    elif not config:
+        exit(0)
+
+    labels = [f"{c.output_file_name}.mp4" for c in config]
+    intro_cache = None
+    if args.intro_cache_size > 0:
+        intro_cache = IntroCache(max_bytes=args.intro_cache_size * 1024 ** 2)
+    job = partial(render_job, engine=args.engine, join=args.join, cut=args.cut,
+                  intro_cache=intro_cache, collect_metrics=args.metrics is not None,
+                  ffmpeg_processes=max(1, args.ffmpeg_procs // args.jobs))
+    collected = Metrics()
+    failures = []
+    if args.queue is not None:
+        worker = partial(queue_worker, queue_path=args.queue, job=job)
+        if args.jobs > 1:
+            labels = [f"Worker {i}" for i in range(args.jobs)]
+            results = [r.result for r in run_jobs(worker, list(range(args.jobs)), args.jobs, labels)
+                       if not r.failed]
+        else:
+            results = [worker(0, verbose=True)]
+        if intro_cache is not None:
+            intro_cache.hits = sum(r["hits"] for r in results)
+            intro_cache.misses = sum(r["misses"] for r in results)
+        for r in results:
+            collected.extend(r["records"])
+        print(job_queue.status(RENDER_QUEUE))
+        for key, state, attempts, error in job_queue.errors(RENDER_QUEUE):
+            if state == "failed":
+                # Last line of the traceback
+                failures.append((f"{key}.mp4 after {attempts} attempts", error.strip().splitlines()[-1]))
+    elif args.jobs > 1:
+        def record(result):
+            if not result.failed:
+                name = config[result.index].output_file_name
+                manifest.record(name, fingerprints[name])
+        results = run_jobs(job, config, args.jobs, labels, record)
+        failures = [(r.label, r.error) for r in results if r.failed]
+        # Every job gets its own copy of intro_cache, so sum their counters
+        if intro_cache is not None:
+            intro_cache.hits = sum(r.result[0] for r in results if not r.failed)
+            intro_cache.misses = sum(r.result[1] for r in results if not r.failed)
+        for r in results:
+            if not r.failed:
+                collected.extend(r.result[2])
+    else:
+        bar = ProgressBar(len(config))
+        for label, c in zip(labels, config):
+            bar.update_message(f"Creating: {label}")
+            bar.print()
+            try:
+                collected.extend(job(c)[2])
+                manifest.record(c.output_file_name, fingerprints[c.output_file_name])
+            except Exception as e:
+                failures.append((label, e))
+            bar.increment()
+        bar.print()
+
+    if intro_cache is not None:
+        print(intro_cache.stats())
+    if args.metrics is not None:
+        collected.save(args.metrics)
+        print(collected.summary())
+    for label, error in failures:
+        print(f"Failed: {label}: {error}")
+    if failures:
+        exit(1)
@@ -1,100 +1,669 @@
 import io
+import os
 import re
 import json
+import argparse
+import shutil
 import subprocess
+from contextlib import nullcontext
+from bisect import bisect_right
+from functools import partial
 from pathlib import Path
+import cv2
+import numpy as np
 from progress_bar import NestedProgressBar, ProgressBar
-from video_info import read_config, get_fps, get_frame_count
+from video_info import read_config, get_fps, get_frame_count, VideoInfo
+from frame_source import iter_frames
+from packed_dataset import PackedWriter, open_packed, write_labels, INCLUDE, EXCLUDE
+from cache import file_fingerprint, update_json
+from job_pool import run_jobs
+from proxy_cache import ProxyCache
+import metrics
+from metrics import Metrics, parse_progress
+from job_queue import JobQueue, work
 
+DATASET_QUEUE = "dataset"
+# Extracted jpegs, one folder per video. data/include and data/exclude
+# hold hard links to them, so labels can change without decoding again
+FRAMES_PATH = Path("data_frames")
 
-def create_dataset(config_file: str, parent_path=None):
-    temp_data_folder = Path("temp_data")
-    temp_data_folder.mkdir(exist_ok=True)
 
+def create_dataset(
+        config_file: str,
+        parent_path=None,
+        streaming: bool = True,
+        packed: bool = False,
+        jobs: int = 1,
+        proxy: ProxyCache = None,
+        metrics_path: str = None,
+        queue_path: str = None,
+        sample_rate: float = None,
+        dedup_threshold: float = 0
+):
+    """
+    Extracts every frame of the videos in config_file at 320x180 and sorts
+    them into data/include and data/exclude by whether they are inside one
+    of the video's segments.
+
+    Frames are stored once per video, in data_frames or as a packed folder,
+    and the history file records the fingerprint of each video's source,
+    the filter settings and the segments its frames were labelled with.
+    Only videos whose source or filter settings changed, or that are new,
+    are decoded again. Videos whose
+    segments changed are just relabelled, see label_frames.
+
+    Parameters:
+    config_file (str): path to config file
+    parent_path (str): folder video paths are relative to (default: cwd)
+    streaming (bool): decode frames through an ffmpeg pipe and write them
+        from Python. Otherwise ffmpeg writes the jpegs itself
+        (default: True)
+    packed (bool): write one packed folder per video to data_packed
+        instead of jpegs, see packed_dataset. Implies streaming
+        (default: False)
+    jobs (int): number of videos to extract at once in worker processes
+        (default: 1)
+    proxy (ProxyCache): decode frames from proxies in this cache, making
+        them first if needed, instead of from the sources (default: None)
+    metrics_path (str): time each stage of each video, write the records
+        to this .json or .csv file and print a summary (default: None)
+    queue_path (str): add the videos to this JobQueue file and extract
+        videos from it until it is empty, so several workers sharing the
+        file can build one dataset (default: None)
+    sample_rate (float): keep at most this many frames per second of video,
+        see FrameFilter. Implies streaming (default: None, every frame)
+    dedup_threshold (float): drop frames that differ from the last kept
+        frame by less than this, see FrameFilter. Implies streaming
+        (default: 0, keep every frame)
+    """
+    filtering = sample_rate is not None or dedup_threshold > 0
+    filter_settings = filter_settings_of(sample_rate, dedup_threshold)
     parent_folder = Path("data")
     if not parent_folder.exists():
         parent_folder.mkdir()
 
     history_file = parent_folder / ".history.json"
-    history = dict()
-    if history_file.exists():
+    try:
         with open(history_file) as f:
             history = json.load(f)
-    else:
-        history_file.touch()
+    except (FileNotFoundError, json.JSONDecodeError):
+        # Missing, or just created empty by another worker
+        history = dict()
 
-    include_folder = parent_folder / "include"
-    exclude_folder = parent_folder / "exclude"
+    config = read_config(config_file, parent_path, probe=True)
+    pending = []
+    relabel = []
+    for i, video in enumerate(config):
+        name = video_key(i, video)
+        entry = history.get(name)
+        if entry is None and history.get(str(video.path)) == "completed":
+            # Extracted before histories had fingerprints, trust its frames
+            # but relabel them in case the segments changed since
+            entry = {"fingerprint": file_fingerprint(video.path), "segments": None, "packed": packed}
+        if (entry is None or entry["fingerprint"] != file_fingerprint(video.path)
+                or entry["packed"] != packed
+                # Histories from before filtering have every frame
+                or entry.get("filter", filter_settings_of()) != filter_settings):
+            pending.append((i, video))
+        elif entry["segments"] != frame_segments_of(video):
+            relabel.append((i, video, entry))
+    if relabel:
+        relabel_videos(relabel, history_file, packed)
+    extract = partial(extract_video, history_file=history_file,
+                      streaming=streaming or packed or filtering, packed=packed, proxy=proxy,
+                      collect_metrics=metrics_path is not None, sample_rate=sample_rate,
+                      dedup_threshold=dedup_threshold)
+    collected = Metrics()
+    frames = [0, 0]
 
-    config = read_config(config_file, parent_path)
-    bars = NestedProgressBar([ProgressBar(len(config))])
+    def collect(result: tuple[int, int, list[dict]]):
+        decoded, kept, records = result
+        frames[0] += decoded
+        frames[1] += kept
+        collected.extend(records)
 
-    for i, video in enumerate(config):
-        if str(video.path) in history:
-            bars[0].increment()
-            bars.print()
-            continue
-        # Create Folders
-        data_include_folder = include_folder / f"{video.output_file_name}_{i}"
-        data_exclude_folder = exclude_folder / f"{video.output_file_name}_{i}"
+    if queue_path is not None:
+        job_queue = JobQueue(queue_path)
+        # Every pending video is out of date, so a job done before is run again
+        for i, video in pending:
+            job_queue.add(DATASET_QUEUE, f"{i}:{video.path}",
+                          {"index": i, "video": video.to_dict(),
+                           "fingerprint": file_fingerprint(video.path), "packed": packed,
+                           "filter": filter_settings},
+                          reset_done=True)
+        worker = partial(queue_worker, queue_path=queue_path, extract=extract)
+        if jobs > 1:
+            results = run_jobs(worker, list(range(jobs)), jobs, [f"Worker {n}" for n in range(jobs)])
+            for result in results:
+                if result.failed:
+                    print(f"Failed: {result.label}: {result.error}")
+                else:
+                    collect(result.result)
+        else:
+            collect(worker(0, verbose=True))
+        print(job_queue.status(DATASET_QUEUE))
+        for key, state, attempts, error in job_queue.errors(DATASET_QUEUE):
+            if state == "failed":
+                print(f"Failed: {key} after {attempts} attempts: {error.strip().splitlines()[-1]}")
+        report_frames(*frames, filtering)
+        report_metrics(collected, metrics_path)
+        return
 
-        data_include_folder.mkdir(parents=True, exist_ok=True)
-        data_exclude_folder.mkdir(parents=True, exist_ok=True)
+    if jobs > 1:
+        labels = [video.path.name for _, video in pending]
+        results = run_jobs(extract, pending, jobs, labels)
+        for result in results:
+            if result.failed:
+                print(f"Failed: {result.label}: {result.error}")
+            else:
+                collect(result.result)
+        report_frames(*frames, filtering)
+        report_metrics(collected, metrics_path)
+        return
+
+    bars = NestedProgressBar([ProgressBar(len(config))])
+    bars[0].set_value(len(config) - len(pending))
 
-        # Extract Frames
-        extract_frames_text = f"Extracting Frames of {video.path.name}"
-        frame_count = get_frame_count(str(video.path))
+    def report(value: int, total: int, message: str = ""):
         if len(bars) != 2:
-            bars.append(ProgressBar(frame_count))
-        else:
-            bars[1] = ProgressBar(frame_count)
-        bars[1].update_message(extract_frames_text)
-        bars.print()
-        command = [
-            "ffmpeg",
-            "-loglevel", "error",
-            "-progress", "-",
-            "-nostats",
-            "-i", str(video.path),
-            "-s", "320x180",
-            f"temp_data/{video.output_file_name}_%06d.jpg"
-        ]
-        proc = subprocess.Popen(command, stdout=subprocess.PIPE)
-        for line in io.TextIOWrapper(proc.stdout, encoding="utf-8"):
-            if 'frame=' in line:
-                progress = int(line.strip()[6:])
-                bars[1].set_value(progress)
-                bars.print()
+            bars.append(ProgressBar(total))
+        elif bars[1].n_jobs != total:
+            bars[1] = ProgressBar(total)
+        bars[1].set_value(value)
+        bars[1].update_message(message)
         bars.print()
 
-        # Get frames
-        p = temp_data_folder.glob("**/*")
-        files = [x for x in p if x.is_file()]
-
-        fps = get_fps(str(video.path))
-        frame_segments = [(round(x * fps), round(y * fps))
-                          for x, y in video.segments]
-
-        # Move Frames
-        for file in files:
-            frame_number = int(re.findall(r'\d{6}', file.name)[0])
-            include = False
-            for segment in frame_segments:
-                if segment[0] <= frame_number and frame_number <= segment[1]:
-                    file.rename(data_include_folder / file.name)
-                    include = True
-                    break
-            if not include:
-                file.rename(data_exclude_folder / file.name)
+    for job in pending:
+        collect(extract(job, report))
         bars[0].increment()
-        history[str(video.path)] = "completed"
-        with open(history_file, "w") as f:
-            json.dump(history, f)
     bars.print()
     bars.finish()
+    if proxy is not None:
+        print(proxy.stats())
+    report_frames(*frames, filtering)
+    report_metrics(collected, metrics_path)
+
+
+def queue_worker(index: int, report=None, queue_path: str = None, extract=None,
+                 verbose: bool = False) -> list[dict]:
+    """
+    Extracts videos from the dataset queue of a JobQueue until it is empty.
+
+    Parameters:
+    index (int): worker number, only used to tell workers apart
+    report (callable): progress(value, total, message) callback, printed
+        as plain lines if not given
+    queue_path (str): path of the JobQueue file
+    extract (callable): extract_video with its settings bound
+    verbose (bool): print each video as it is claimed (default: False)
+
+    Returns:
+    tuple[int, int, list[dict]]: frames decoded and kept, and metrics
+        records of the videos extracted
+    """
+    if report is None:
+        bar = None
+
+        def report(value: int, total: int, message: str = ""):
+            nonlocal bar
+            if bar is None or bar.n_jobs != total or bar.message != message:
+                bar = ProgressBar(total)
+                bar.update_message(message)
+            bar.set_value(value)
+            bar.print()
+
+    frames = [0, 0]
+    records = []
+
+    def run(payload: dict):
+        video = VideoInfo.from_dict(payload["video"])
+        decoded, kept, video_records = extract((payload["index"], video), report)
+        frames[0] += decoded
+        frames[1] += kept
+        records.extend(video_records)
+
+    def claimed(job):
+        if verbose:
+            print(f"Extracting: {job.key} (attempt {job.attempts})")
+
+    work(JobQueue(queue_path), DATASET_QUEUE, run, claimed)
+    return frames[0], frames[1], records
+
+
+def report_frames(decoded: int, kept: int, filtering: bool):
+    """
+    Prints how many decoded frames were kept, if frames were filtered.
+    """
+    if filtering and decoded:
+        print(f"Kept {kept} of {decoded} frames, dropped {(decoded - kept) * 100 / decoded:.1f}%")
+
+
+def report_metrics(collected: Metrics, metrics_path: str = None):
+    """
+    Saves collected to metrics_path and prints its summary, if a path is given.
+    """
+    if metrics_path is None:
+        return
+    collected.save(metrics_path)
+    print(collected.summary())
+
+
+def extract_video(
+        job: tuple[int, VideoInfo],
+        report,
+        history_file: Path,
+        streaming: bool = True,
+        packed: bool = False,
+        proxy: ProxyCache = None,
+        collect_metrics: bool = False,
+        sample_rate: float = None,
+        dedup_threshold: float = 0
+) -> tuple[int, int, list[dict]]:
+    """
+    Extracts and labels the frames of one video, then records it in the
+    history file. Safe to run for several videos at once in different
+    processes.
+
+    Parameters:
+    job (tuple[int, VideoInfo]): row number and video
+    report (callable): progress(value, total, message) callback
+    history_file (Path): json file of extracted videos, see create_dataset
+    streaming (bool): see create_dataset (default: True)
+    packed (bool): see create_dataset (default: False)
+    proxy (ProxyCache): see create_dataset (default: None)
+    collect_metrics (bool): time each stage, see metrics (default: False)
+    sample_rate (float): see create_dataset (default: None)
+    dedup_threshold (float): see create_dataset (default: 0)
+
+    Returns:
+    tuple[int, int, list[dict]]: frames decoded and kept, and metrics
+        records of the video's stages
+    """
+    collector = Metrics()
+    with collector.activate() if collect_metrics else nullcontext():
+        decoded, kept = _extract_video(job, report, history_file, streaming, packed, proxy,
+                                       sample_rate, dedup_threshold)
+    return decoded, kept, collector.records
+
+
+def _extract_video(
+        job: tuple[int, VideoInfo],
+        report,
+        history_file: Path,
+        streaming: bool,
+        packed: bool,
+        proxy: ProxyCache,
+        sample_rate: float,
+        dedup_threshold: float
+) -> tuple[int, int]:
+    i, video = job
+    name = video_key(i, video)
+    # Taken first, so a source changed while extracting is extracted again
+    fingerprint = file_fingerprint(video.path)
+    frames_folder = FRAMES_PATH / name
+    if not packed:
+        shutil.rmtree(frames_folder, ignore_errors=True)
+        frames_folder.mkdir(parents=True)
+
+    frame_count = get_frame_count(str(video.path))
+    source = video.path
+    if proxy is not None:
+        proxy_text = f"Making Proxy of {video.path.name}"
+        report(0, frame_count, proxy_text)
+        with metrics.stage("make_proxy", video.path.name, [video.path]) as record:
+            source = proxy.get(video.path, lambda n: report(n, frame_count, proxy_text))
+            record["bytes_out"] = metrics.file_size(source)
+
+    # Extract Frames
+    extract_frames_text = f"Extracting Frames of {video.path.name}"
+    report(0, frame_count, extract_frames_text)
+
+    def progress(frame_number: int):
+        report(frame_number, frame_count, extract_frames_text)
+
+    fps = get_fps(str(video.path))
+    frame_segments = frame_segments_of(video)
+
+    frame_filter = FrameFilter(fps, sample_rate, dedup_threshold)
+    if packed:
+        packed_folder = Path("data_packed") / name
+        with metrics.stage("stream_frames", video.path.name, [source], [packed_folder]):
+            with PackedWriter(packed_folder) as writer:
+                stream_frames(video, frame_segments, frames_folder, progress,
+                              writer, source, frame_filter)
+    else:
+        if streaming:
+            with metrics.stage("stream_frames", video.path.name, [source], [frames_folder]):
+                stream_frames(video, frame_segments, frames_folder, progress,
+                              source=source, frame_filter=frame_filter)
+        else:
+            with metrics.stage("extract_frames", video.path.name, [source], [frames_folder]):
+                extract_frames(video, frames_folder, progress, source)
+        with metrics.stage("sort_frames", video.path.name):
+            label_frames(name, frame_segments, packed)
+    report(frame_count, frame_count, extract_frames_text)
+    update_json(history_file, name, {"path": str(video.path), "fingerprint": fingerprint,
+                                     "segments": frame_segments, "packed": packed,
+                                     "filter": filter_settings_of(sample_rate, dedup_threshold)})
+    if frame_filter.decoded == 0:
+        # Every frame was kept by ffmpeg
+        return frame_count, frame_count
+    return frame_filter.decoded, frame_filter.kept
+
+
+def video_key(i: int, video: VideoInfo) -> str:
+    """
+    Returns the name the frames of row i of the config are stored under.
+    """
+    return f"{video.output_file_name}_{i}"
+
+
+def filter_settings_of(sample_rate: float = None, dedup_threshold: float = 0) -> dict:
+    """
+    Returns the FrameFilter settings a video's frames were kept with, as
+    stored in its history entry.
+    """
+    return {"sample_rate": sample_rate, "dedup_threshold": dedup_threshold}
+
+
+def frame_segments_of(video: VideoInfo) -> list[list[int]]:
+    """
+    Returns the inclusive [start, stop] frame numbers of video's segments.
+    """
+    fps = get_fps(str(video.path))
+    return [[round(x * fps), round(y * fps)] for x, y in video.segments]
+
+
+def relabel_videos(jobs: list[tuple[int, VideoInfo, dict]], history_file: Path, packed: bool):
+    """
+    Relabels the stored frames of videos whose segments changed and
+    records their new segments in the history file.
+
+    Parameters:
+    jobs (list[tuple[int, VideoInfo, dict]]): row number, video and
+        history entry of each video
+    history_file (Path): json file of extracted videos, see create_dataset
+    packed (bool): frames are stored packed, see create_dataset
+    """
+    bar = ProgressBar(len(jobs))
+    bar.update_message("Relabelling frames")
+    for i, video, entry in jobs:
+        frame_segments = frame_segments_of(video)
+        label_frames(video_key(i, video), frame_segments, packed)
+        update_json(history_file, video_key(i, video),
+                    {**entry, "path": str(video.path), "segments": frame_segments})
+        bar.increment()
+        bar.print()
+    print()
+    print(f"Relabelled {len(jobs)} videos whose segments changed")
+
+
+def label_frames(name: str, frame_segments: list[list[int]], packed: bool):
+    """
+    Labels the stored frames of a video from frame_segments, without
+    decoding anything.
+
+    Packed folders get their labels rewritten. Jpegs in data_frames are
+    hard linked into data/include and data/exclude, replacing the links
+    made before, and jpegs of videos extracted before data_frames existed
+    are moved there first.
+
+    Parameters:
+    name (str): name the frames are stored under, see video_key
+    frame_segments (list[list[int]]): inclusive [start, stop] frame
+        numbers of frames to include
+    packed (bool): frames are stored packed, see create_dataset
+    """
+    if packed:
+        folder = Path("data_packed") / name
+        _, _, frame_indices = open_packed(folder)
+        write_labels(folder, SegmentLookup(frame_segments).labels(frame_indices))
+        return
+
+    frames_folder = FRAMES_PATH / name
+    include_folder = Path("data") / "include" / name
+    exclude_folder = Path("data") / "exclude" / name
+    if not frames_folder.exists():
+        frames_folder.mkdir(parents=True)
+        for folder in (include_folder, exclude_folder):
+            for file in folder.glob("*.jpg"):
+                file.replace(frames_folder / file.name)
+    for folder in (include_folder, exclude_folder):
+        shutil.rmtree(folder, ignore_errors=True)
+        folder.mkdir(parents=True)
+    link_frames(frames_folder, frame_segments, include_folder, exclude_folder)
+
+
+class SegmentLookup():
+    """
+    Sorted interval lookup of whether a frame is inside any segment.
+
+    Parameters:
+    frame_segments (list[tuple[int]]): inclusive (start, stop) frame numbers
+    """
+    def __init__(self, frame_segments: list[tuple[int]]):
+        # Merge overlapping segments so the intervals are disjoint
+        merged = []
+        for start, stop in sorted(frame_segments):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([start, stop])
+        self.starts = [start for start, _ in merged]
+        self.stops = [stop for _, stop in merged]
+
+    def __contains__(self, frame_number: int) -> bool:
+        i = bisect_right(self.starts, frame_number) - 1
+        return i >= 0 and frame_number <= self.stops[i]
+
+    def labels(self, frame_numbers: np.ndarray) -> np.ndarray:
+        """
+        Returns the INCLUDE or EXCLUDE label of every frame number at once.
+        """
+        frame_numbers = np.asarray(frame_numbers)
+        i = np.searchsorted(self.starts, frame_numbers, side="right") - 1
+        # i is -1 before the first segment, which picks the -1 stop
+        stops = np.array(self.stops + [-1])
+        inside = (i >= 0) & (frame_numbers <= stops[i])
+        return np.where(inside, INCLUDE, EXCLUDE).astype(np.uint8)
+
+
+class FrameFilter():
+    """
+    Decides which decoded frames to keep.
+
+    Frames are first subsampled to at most sample_rate frames per second.
+    Then a frame is dropped if the mean absolute difference between
+    block-averaged grayscale thumbnails of it and of the last kept frame,
+    scaled to 0-1, is below threshold. The first frame after the label
+    changes is always kept, so segment boundaries are never dropped.
+
+    Parameters:
+    fps (float): fps of the video
+    sample_rate (float): frames per second to keep at most (default: None,
+        every frame)
+    threshold (float): smallest difference from the last kept frame a
+        frame needs to be kept (default: 0, keep every frame)
+    block (int): side of the square blocks averaged into one thumbnail
+        pixel (default: 10)
+    """
+    def __init__(self, fps: float, sample_rate: float = None, threshold: float = 0, block: int = 10):
+        self.fps = fps
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.block = block
+        self.decoded = 0
+        self.kept = 0
+        self.last_bucket = None
+        self.last_label = None
+        self.last_thumbnail = None
+
+    def thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Returns the mean of each block x block square of a (H, W, 3) frame.
+        """
+        b = self.block
+        height = frame.shape[0] // b * b
+        width = frame.shape[1] // b * b
+        blocks = frame[:height, :width].reshape(height // b, b, width // b, b, 3)
+        return blocks.mean(axis=(1, 3, 4), dtype=np.float32)
+
+    def keep(self, frame_number: int, frame: np.ndarray, label: bool) -> bool:
+        """
+        Returns True if the frame should be kept.
+        """
+        self.decoded += 1
+        new_label = label != self.last_label
+        if self.sample_rate is not None:
+            bucket = int((frame_number - 1) * self.sample_rate / self.fps)
+            if bucket == self.last_bucket and not new_label:
+                return False
+            self.last_bucket = bucket
+        if self.threshold > 0:
+            thumbnail = self.thumbnail(frame)
+            if not new_label and self.last_thumbnail is not None:
+                difference = np.abs(thumbnail - self.last_thumbnail).mean() / 255
+                if difference < self.threshold:
+                    return False
+            self.last_thumbnail = thumbnail
+        self.last_label = label
+        self.kept += 1
+        return True
+
+
+def stream_frames(
+        video: VideoInfo,
+        frame_segments: list[tuple[int]],
+        frames_folder: Path,
+        progress,
+        writer: PackedWriter = None,
+        source: Path = None,
+        frame_filter: FrameFilter = None
+):
+    """
+    Decodes frames from an ffmpeg pipe and writes each one as it arrives
+    to frames_folder as a jpeg, or labelled to writer.
+
+    Parameters:
+    video (VideoInfo): video to extract
+    frame_segments (list[tuple[int]]): inclusive (start, stop) frame numbers
+        of frames to include
+    frames_folder (Path): folder to write jpegs to
+    progress (callable): called with the number of frames extracted so far
+    writer (PackedWriter): optional packed writer to append frames to
+        instead of writing jpegs
+    source (Path): file to decode instead of video.path, like its proxy
+    frame_filter (FrameFilter): optional filter deciding which frames to keep
+    """
+    lookup = SegmentLookup(frame_segments)
+    pix_fmt = "bgr24" if writer is None else "rgb24"
+    for frame_number, frame in iter_frames(source or video.path, pix_fmt=pix_fmt):
+        include = frame_number in lookup
+        if frame_filter is not None and not frame_filter.keep(frame_number, frame, include):
+            progress(frame_number)
+            continue
+        if writer is not None:
+            writer.append(frame, INCLUDE if include else EXCLUDE, frame_number)
+        else:
+            cv2.imwrite(str(frames_folder / f"{video.output_file_name}_{frame_number:06d}.jpg"), frame)
+        progress(frame_number)
+
+
+def extract_frames(video: VideoInfo, frames_folder: Path, progress, source: Path = None):
+    """
+    Has ffmpeg write every frame of video to frames_folder as a jpeg.
+    Raises RuntimeError if ffmpeg fails, so a partial extraction is never
+    recorded as done.
+
+    Parameters:
+    video (VideoInfo): video to extract
+    frames_folder (Path): folder to write frames to
+    progress (callable): called with the number of frames extracted so far
+    source (Path): file to decode instead of video.path, like its proxy
+    """
+    command = [
+        "ffmpeg",
+        "-loglevel", "error",
+        "-progress", "-",
+        "-nostats",
+        "-i", str(source or video.path),
+        "-s", "320x180",
+        f"{frames_folder}/{video.output_file_name}_%06d.jpg"
+    ]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    lines = []
+    for line in io.TextIOWrapper(proc.stdout, encoding="utf-8"):
+        lines.append(line)
+        if 'frame=' in line:
+            progress(int(line.strip()[6:]))
+    stderr = proc.stderr.read().decode("utf-8", errors="replace")
+    proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to extract frames from {source or video.path}: {stderr.strip()}")
+    metrics.add_ffmpeg(parse_progress("".join(lines)))
+
+
+def link_frames(
+        frames_folder: Path,
+        frame_segments: list[tuple[int]],
+        include_folder: Path,
+        exclude_folder: Path
+):
+    """
+    Hard links the jpegs in frames_folder into their include or exclude
+    folder, copying them on file systems without hard links.
+
+    Parameters:
+    frames_folder (Path): folder frames were written to
+    frame_segments (list[tuple[int]]): inclusive (start, stop) frame numbers
+        of frames to include
+    include_folder (Path): folder for frames inside a segment
+    exclude_folder (Path): folder for frames outside every segment
+    """
+    lookup = SegmentLookup(frame_segments)
+    for file in frames_folder.glob("*.jpg"):
+        frame_number = int(re.findall(r'\d{6}', file.name)[-1])
+        target = (include_folder if frame_number in lookup else exclude_folder) / file.name
+        try:
+            os.link(file, target)
+        except OSError:
+            shutil.copy2(file, target)
+
 
-    temp_data_folder.rmdir()
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract labelled frames from videos in a config file.")
+    parser.add_argument("config", nargs="?", default="dataset_config.csv",
+                        help="path to config file (default: dataset_config.csv)")
+    parser.add_argument("parent_path", nargs="?", default="/media/nishant/Hard Drive/TKD Videos",
+                        help="folder video paths in the config are relative to")
+    parser.add_argument("--temp-jpeg", action="store_true",
+                        help="have ffmpeg write the jpegs instead of streaming frames through Python")
+    parser.add_argument("--packed", action="store_true",
+                        help="write one packed memory-mappable folder per video to data_packed")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of videos to extract at once (default: 1)")
+    parser.add_argument("--proxy", action="store_true",
+                        help="decode from cached 320x180 proxies, made once per source")
+    parser.add_argument("--proxy-cache-size", type=float, default=50,
+                        help="disk budget of the proxy cache in GiB (default: 50)")
+    parser.add_argument("--metrics", default=None,
+                        help="time each stage of each video, write the records to this .json or "
+                             ".csv file and print a summary")
+    parser.add_argument("--sample-rate", type=float, default=None,
+                        help="keep at most this many frames per second of video (default: every frame)")
+    parser.add_argument("--dedup-threshold", type=float, default=0,
+                        help="drop frames whose downsampled mean difference from the last kept frame "
+                             "is below this, on a 0-1 scale, e.g. 0.01 (default: 0, keep all)")
+    parser.add_argument("--queue", default=None,
+                        help="add the videos to this SQLite job queue and extract from it. "
+                             "Any number of workers on hosts sharing the file can pull from it")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    create_dataset("dataset_config.csv", "/media/nishant/Hard Drive/TKD Videos")
+    args = parse_args()
+    proxy = ProxyCache(max_bytes=int(args.proxy_cache_size * 1024 ** 3)) if args.proxy else None
+    create_dataset(args.config, args.parent_path, streaming=not args.temp_jpeg,
+                   packed=args.packed, jobs=args.jobs, proxy=proxy, metrics_path=args.metrics,
+                   queue_path=args.queue, sample_rate=args.sample_rate,
+                   dedup_threshold=args.dedup_threshold)
@@ -0,0 +1,64 @@
+import json
+import hashlib
+from pathlib import Path
+from video_info import VideoInfo
+from cache import file_fingerprint, update_json
+
+MANIFEST_FILE = ".build_manifest.json"
+
+
+def input_fingerprint(video_info: VideoInfo, settings: dict) -> str:
+    """
+    Returns a hash of everything an output of create_video depends on:
+    the source file's path, size and mtime, the segments, the intro text
+    and the render settings.
+
+    Parameters:
+    video_info (VideoInfo): video to fingerprint
+    settings (dict): render settings that change the output
+
+    Returns:
+    str: sha256 hex digest
+    """
+    data = {
+        "source": file_fingerprint(video_info.path),
+        "segments": [list(segment) for segment in video_info.segments],
+        "first_line": video_info.first_line,
+        "second_line": video_info.second_line,
+        "settings": settings
+    }
+    text = json.dumps(data, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BuildManifest():
+    """
+    Records the input fingerprint of every output created, so unchanged
+    outputs can be skipped when rebuilding.
+
+    Parameters:
+    path (str): path of the manifest file (default: .build_manifest.json)
+    """
+    def __init__(self, path: str = MANIFEST_FILE):
+        self.path = Path(path)
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = dict()
+
+    def is_current(self, output_file_name: str, fingerprint: str) -> bool:
+        """
+        Returns True if output_file_name.mp4 exists and was built from
+        inputs with the same fingerprint.
+        """
+        return self.entries.get(output_file_name) == fingerprint \
+            and Path(f"{output_file_name}.mp4").is_file()
+
+    def record(self, output_file_name: str, fingerprint: str):
+        """
+        Records that output_file_name was built and saves the manifest.
+        Safe to call from several processes sharing the manifest.
+        """
+        self.entries[output_file_name] = fingerprint
+        update_json(self.path, output_file_name, fingerprint)
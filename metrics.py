@@ -0,0 +1,179 @@
+import csv
+import resource
+from time import perf_counter, process_time
+from pathlib import Path
+from contextlib import contextmanager
+from cache import atomic_write_json
+
+# Fields of the last ffmpeg -progress block kept for each stage
+FFMPEG_FIELDS = ("frame", "fps", "speed", "out_time", "total_size")
+COLUMNS = ("video", "stage", "wall_seconds", "cpu_seconds", "child_cpu_seconds",
+           "bytes_in", "bytes_out", "ffmpeg_runs", *FFMPEG_FIELDS)
+
+_active = None
+
+
+def children_cpu_time() -> float:
+    """
+    Returns the user + system CPU time of every finished child process.
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def file_size(path) -> int:
+    """
+    Returns the size of a file, or of every file in a folder, in bytes.
+    """
+    path = Path(path)
+    try:
+        if path.is_dir():
+            return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def parse_progress(text: str) -> dict:
+    """
+    Parses the key=value lines ffmpeg writes with -progress and returns the
+    last value of each field in FFMPEG_FIELDS.
+    """
+    fields = dict()
+    for line in text.splitlines():
+        key, _, value = line.strip().partition("=")
+        if key in FFMPEG_FIELDS and value not in ("", "N/A"):
+            fields[key] = value
+    if "speed" in fields:
+        fields["speed"] = fields["speed"].rstrip("x").strip()
+    return fields
+
+
+class Metrics():
+    """
+    Records wall and CPU time, bytes read and written, and ffmpeg progress
+    stats of each stage of each video.
+
+    Stages are timed with the stage context manager. While a Metrics is
+    active, see activate, ffmpeg commands run through run_ffmpeg add their
+    -progress stats to the innermost running stage.
+    """
+    def __init__(self):
+        self.records = []
+        self.running = []
+
+    @contextmanager
+    def stage(self, stage: str, video: str = "", inputs=(), outputs=()):
+        """
+        Times the with block as one stage of video. inputs and outputs are
+        file paths whose sizes are counted as bytes read and written.
+
+        Yields:
+        dict: record of the stage, extra fields can be added to it
+        """
+        record = {"video": str(video), "stage": stage, "ffmpeg_runs": 0,
+                  "bytes_in": sum(file_size(path) for path in inputs)}
+        self.running.append(record)
+        wall = perf_counter()
+        cpu = process_time()
+        child_cpu = children_cpu_time()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = perf_counter() - wall
+            record["cpu_seconds"] = process_time() - cpu
+            record["child_cpu_seconds"] = children_cpu_time() - child_cpu
+            record["bytes_out"] = sum(file_size(path) for path in outputs)
+            self.running.remove(record)
+            self.records.append(record)
+
+    def add_ffmpeg(self, progress: dict):
+        """
+        Adds the parsed -progress stats of one ffmpeg run to the innermost
+        running stage.
+        """
+        if not self.running:
+            return
+        record = self.running[-1]
+        record["ffmpeg_runs"] += 1
+        record.update(progress)
+
+    def extend(self, records: list[dict]):
+        """
+        Adds records collected by another Metrics, like one in a worker
+        process.
+        """
+        self.records.extend(records)
+
+    @contextmanager
+    def activate(self):
+        """
+        Makes this the Metrics that stage and add_ffmpeg report to while the
+        with block runs.
+        """
+        global _active
+        previous = _active
+        _active = self
+        try:
+            yield self
+        finally:
+            _active = previous
+
+    def save(self, path):
+        """
+        Writes every record to path, as json if it ends in .json and as
+        csv otherwise.
+        """
+        path = Path(path)
+        if path.suffix == ".json":
+            atomic_write_json(path, self.records)
+            return
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def summary(self) -> str:
+        """
+        Returns a table of the total and slowest wall time, CPU time and
+        bytes written of each stage.
+        """
+        stages = dict()
+        for record in self.records:
+            stages.setdefault(record["stage"], []).append(record)
+        lines = [f"{'stage':<20}{'runs':>6}{'wall s':>10}{'max s':>10}{'cpu s':>10}{'child cpu s':>13}{'MiB out':>10}"]
+        for stage, records in stages.items():
+            wall = [r["wall_seconds"] for r in records]
+            cpu = sum(r["cpu_seconds"] for r in records)
+            child_cpu = sum(r["child_cpu_seconds"] for r in records)
+            mib = sum(r["bytes_out"] for r in records) / 1024 ** 2
+            lines.append(f"{stage:<20}{len(records):>6}{sum(wall):>10.2f}{max(wall):>10.2f}"
+                         f"{cpu:>10.2f}{child_cpu:>13.2f}{mib:>10.1f}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def stage(stage_name: str, video: str = "", inputs=(), outputs=()):
+    """
+    Times a stage with the active Metrics, or does nothing if none is active.
+    """
+    if _active is None:
+        yield dict()
+        return
+    with _active.stage(stage_name, video, inputs, outputs) as record:
+        yield record
+
+
+def collecting() -> bool:
+    """
+    Returns True if a Metrics is active.
+    """
+    return _active is not None
+
+
+def add_ffmpeg(progress: dict):
+    """
+    Adds ffmpeg -progress stats to the active Metrics, if any.
+    """
+    if _active is not None:
+        _active.add_ffmpeg(progress)
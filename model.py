@@ -1,25 +1,61 @@
 import torch
 import torch.nn as nn
 
+# Input sizes SparringCNN is trained and run at, as (width, height)
+RESOLUTIONS = {
+    "320x180": (320, 180),
+    "240x135": (240, 135),
+    "160x90": (160, 90)
+}
+DEFAULT_RESOLUTION = "320x180"
+
+
+def fc1_features(input_size: tuple[int, int]) -> int:
+    """
+    Returns the number of features going into fc1 for (width, height) input.
+    """
+    width, height = input_size
+    return 32 * (width // 5 // 2 // 2) * (height // 5 // 2 // 2)
+
 
 class SparringCNN(nn.Module):
-    def __init__(self):
+    """
+    Classifies frames as sparring or not.
+
+    Parameters:
+    input_size (tuple[int, int]): (width, height) of frames, only fc1
+        depends on it. The default matches models trained before input
+        sizes could be changed (default: (320, 180))
+    """
+    def __init__(self, input_size: tuple[int, int] = RESOLUTIONS[DEFAULT_RESOLUTION]):
         super().__init__()
+        self.input_size = tuple(input_size)
         self.relu = nn.ReLU()
         self.pool2 = nn.MaxPool2d(kernel_size=2, stride=2)
         self.pool5 = nn.MaxPool2d(kernel_size=5, stride=5)
         self.conv1 = nn.Conv2d(3, 16, kernel_size=5, stride=1, padding=2)
         self.conv2 = nn.Conv2d(16, 64, kernel_size=5, stride=1, padding=2)
         self.conv3 = nn.Conv2d(64, 32, kernel_size=5, stride=1, padding=2)
-        self.fc1 = nn.Linear(32 * 16 * 9, 64)
+        self.fc1 = nn.Linear(fc1_features(self.input_size), 64)
         self.fc2 = nn.Linear(64, 2)
 
     def forward(self, x):
-        N, C, H, W = x.shape
         x = self.pool5(self.relu(self.conv1(x)))
         x = self.pool2(self.relu(self.conv2(x)))
         x = self.pool2(self.relu(self.conv3(x)))
-        x = torch.reshape(x, (N, 32 * 16 * 9))
+        x = torch.flatten(x, 1)
         x = self.relu(self.fc1(x))
         x = self.fc2(x)
         return x
+
+
+def input_size_of(state_dict: dict) -> tuple[int, int]:
+    """
+    Returns the (width, height) a saved SparringCNN was trained at, found by
+    matching the size of its fc1 weights against RESOLUTIONS.
+    """
+    features = state_dict["fc1.weight"].shape[1]
+    for input_size in RESOLUTIONS.values():
+        if fc1_features(input_size) == features:
+            return input_size
+    raise ValueError(f"fc1 takes {features} features, which matches none of {', '.join(RESOLUTIONS)}")
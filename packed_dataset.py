@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import tempfile
+from pathlib import Path
+import cv2
+import numpy as np
+
+FRAMES_FILE = "frames.u8"
+LABELS_FILE = "labels.npy"
+INDICES_FILE = "frame_indices.npy"
+META_FILE = "meta.json"
+
+# Label values match the ImageFolder class indices of data/exclude and data/include
+EXCLUDE = 0
+INCLUDE = 1
+
+
+class PackedWriter():
+    """
+    Writes the frames of one video to a packed dataset folder.
+
+    A packed folder holds every frame as one raw uint8 array of shape
+    (N, height, width, 3) in RGB order, which can be memory-mapped, and
+    the label and source frame number of each frame next to it.
+
+    Parameters:
+    folder (str): folder to write to
+    height (int): frame height (default: 180)
+    width (int): frame width (default: 320)
+    """
+    def __init__(self, folder, height: int = 180, width: int = 320):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.height = height
+        self.width = width
+        self.labels = []
+        self.frame_indices = []
+        self.file = open(self.folder / FRAMES_FILE, "wb")
+
+    def append(self, frame: np.ndarray, label: int, frame_number: int):
+        """
+        Appends a (height, width, 3) uint8 RGB frame.
+        """
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError(f"Expected frame of shape {(self.height, self.width, 3)}, got {frame.shape}")
+        self.file.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        self.labels.append(label)
+        self.frame_indices.append(frame_number)
+
+    def close(self):
+        self.file.close()
+        np.save(self.folder / LABELS_FILE, np.array(self.labels, dtype=np.uint8))
+        np.save(self.folder / INDICES_FILE, np.array(self.frame_indices, dtype=np.int64))
+        meta = {"count": len(self.labels), "height": self.height, "width": self.width, "channels": 3}
+        with open(self.folder / META_FILE, "w") as f:
+            json.dump(meta, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_packed(folder, mode: str = "c") -> tuple[np.memmap, np.ndarray, np.ndarray]:
+    """
+    Memory-maps a packed dataset folder written by PackedWriter.
+
+    Parameters:
+    folder (str): packed folder
+    mode (str): np.memmap mode. The default copy-on-write mode gives
+        writable arrays without ever changing the file (default: 'c')
+
+    Returns:
+    tuple: frames of shape (N, height, width, 3), labels and frame numbers
+    """
+    folder = Path(folder)
+    with open(folder / META_FILE) as f:
+        meta = json.load(f)
+    shape = (meta["count"], meta["height"], meta["width"], meta["channels"])
+    if meta["count"] == 0:
+        frames = np.empty(shape, dtype=np.uint8)
+    else:
+        frames = np.memmap(folder / FRAMES_FILE, dtype=np.uint8, mode=mode, shape=shape)
+    labels = np.load(folder / LABELS_FILE)
+    frame_indices = np.load(folder / INDICES_FILE)
+    return frames, labels, frame_indices
+
+
+def write_labels(folder, labels: np.ndarray):
+    """
+    Replaces the labels of a packed folder, leaving its frames alone. The
+    new labels are written next to the old ones and renamed over them, so
+    readers never see a partial file.
+    """
+    folder = Path(folder)
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix=".npy")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.asarray(labels, dtype=np.uint8))
+        os.replace(temp_path, folder / LABELS_FILE)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def packed_folders(packed_path) -> list[Path]:
+    """
+    Returns every packed folder directly inside packed_path.
+    """
+    return sorted(p.parent for p in Path(packed_path).glob(f"*/{META_FILE}"))
+
+
+def convert_image_folder(data_path="data", packed_path="data_packed"):
+    """
+    Converts data/include/{video} and data/exclude/{video} jpeg folders
+    made by make_dataset into one packed folder per video.
+
+    Parameters:
+    data_path (str): folder containing include and exclude (default: 'data')
+    packed_path (str): folder to write packed folders to (default: 'data_packed')
+    """
+    data_path = Path(data_path)
+    videos = dict()
+    for label, class_name in ((EXCLUDE, "exclude"), (INCLUDE, "include")):
+        for file in (data_path / class_name).glob("*/*.jpg"):
+            frame_number = int(re.findall(r'\d{6}', file.name)[-1])
+            videos.setdefault(file.parent.name, []).append((frame_number, label, file))
+
+    for name, frames in videos.items():
+        frames.sort()
+        first = cv2.imread(str(frames[0][2]))
+        height, width = first.shape[:2]
+        with PackedWriter(Path(packed_path) / name, height, width) as writer:
+            for frame_number, label, file in frames:
+                frame = cv2.cvtColor(cv2.imread(str(file)), cv2.COLOR_BGR2RGB)
+                writer.append(frame, label, frame_number)
+
+
+if __name__ == "__main__":
+    convert_image_folder()
@@ -1,4 +1,5 @@
-from time import time
+import sys
+from time import monotonic
 from datetime import timedelta
 from collections import deque
 from collections.abc import MutableSequence
@@ -32,80 +33,163 @@ BRIGHT_BLUE_BG = "104"
 BRIGHT_WHITE_FG = "97"
 BRIGHT_WHITE_BG = "107"
 
+# Seconds between redraws on a terminal, and between plain lines when
+# stdout is piped to a file
+MIN_INTERVAL = 0.1
+PLAIN_INTERVAL = 10
+# ETA rate is taken over this many (time, n_completed) samples, kept at
+# least RATE_SAMPLE_INTERVAL seconds apart
+RATE_WINDOW = 20
+RATE_SAMPLE_INTERVAL = 0.5
+
+
+def is_tty() -> bool:
+    return sys.stdout.isatty()
+
 
 class ProgressBar():
-    def __init__(self, n_jobs: int, bar_width: int = 40, color: bool = True):
+    """
+    Single line progress bar with a percentage and ETA.
+
+    Redraws are rate limited to one every min_interval seconds, except for
+    the one that completes the bar. When stdout isn't a terminal, plain
+    lines without escape codes are printed instead.
+
+    Parameters:
+    n_jobs (int): number of jobs
+    bar_width (int): width of the bar in characters (default: 40)
+    color (bool): color the bar, only on a terminal (default: True)
+    min_interval (float): seconds between redraws (default: MIN_INTERVAL
+        on a terminal, PLAIN_INTERVAL otherwise)
+    """
+    def __init__(self, n_jobs: int, bar_width: int = 40, color: bool = True, min_interval: float = None):
         self.n_jobs = n_jobs
         self.bar_width = bar_width
-        self.color = color
+        self.tty = is_tty()
+        self.color = color and self.tty
+        if min_interval is None:
+            min_interval = MIN_INTERVAL if self.tty else PLAIN_INTERVAL
+        self.min_interval = min_interval
+        self.last_print = None
         self.n_completed = 0
         self.completed = False
         self.message = ""
-        self.times = deque()
+        self.times = deque(maxlen=RATE_WINDOW)
 
-    def _bar_text(self):
+    def _eta(self) -> str:
+        if len(self.times) < 2:
+            return ""
+        (start, n_start), (end, n_end) = self.times[0], self.times[-1]
+        if n_end <= n_start or end <= start:
+            return ""
+        rate = (n_end - n_start) / (end - start)
+        remaining = (self.n_jobs - self.n_completed) / rate
+        return f" eta: {timedelta(seconds=round(remaining))}"
+
+    def _text(self) -> str:
         message = self.message
         percentage = self.n_completed * 100 / self.n_jobs
         bar = "█" * (self.n_completed * self.bar_width // self.n_jobs)
         bar += "-" * (self.bar_width - (self.n_completed * self.bar_width // self.n_jobs))
-        eta = ""
-        if len(self.times) == 5:
-            remaining = self.n_jobs - self.n_completed
-            delta = timedelta(seconds=(self.times[-1] - self.times[0])) / 5
-            eta = f" eta: {str(delta * remaining)}".split(".")[0]
-        complete_bar = f"Progress: |{bar}| {percentage:.2f}%{eta} ({self.n_completed}/{self.n_jobs}) {message}"
-        return ESC + CSI + EL + complete_bar
+        return f"Progress: |{bar}| {percentage:.2f}%{self._eta()} ({self.n_completed}/{self.n_jobs}) {message}"
+
+    def _bar_text(self):
+        return ESC + CSI + EL + self._text()
+
+    def _record(self):
+        # Add a rate sample, or refresh the newest one if the one before it
+        # is too recent, so samples stay spread over the window
+        now = monotonic()
+        if len(self.times) >= 2 and now - self.times[-2][0] < RATE_SAMPLE_INTERVAL:
+            self.times[-1] = (now, self.n_completed)
+        else:
+            self.times.append((now, self.n_completed))
 
     def update_message(self, message: str = ""):
         self.message = message
 
-    def print(self):
-        if not self.completed:
-            bar_text = self._bar_text()
+    def print(self, force: bool = False):
+        if self.completed:
+            return
+        done = self.n_jobs == self.n_completed
+        now = monotonic()
+        if not (force or done or self.last_print is None or now - self.last_print >= self.min_interval):
+            return
+        self.last_print = now
+        self.completed = done
+        if not self.tty:
+            print(self._text(), flush=True)
+            return
+        bar_text = self._bar_text()
+        if self.color:
+            print(
+                ESC + CSI + YELLOW_FG + SGR,
+                "\r", bar_text,
+                ESC + CSI + WHITE_FG + SGR,
+                end="",
+                sep=""
+            )
+        else:
+            print("\r", bar_text, end="", sep="")
+        if done:
             if self.color:
                 print(
-                    ESC + CSI + YELLOW_FG + SGR,
+                    ESC + CSI + GREEN_FG + SGR,
                     "\r", bar_text,
                     ESC + CSI + WHITE_FG + SGR,
-                    end="",
+                    end="\n",
                     sep=""
                 )
             else:
-                print("\r", bar_text, end="", sep="")
-            if self.n_jobs == self.n_completed:
-                self.completed = True
-                if self.color:
-                    print(
-                        ESC + CSI + GREEN_FG + SGR,
-                        "\r", bar_text,
-                        ESC + CSI + WHITE_FG + SGR,
-                        end="\n",
-                        sep=""
-                    )
-                else:
-                    print("\r", bar_text, end="\n", sep="")
+                print("\r", bar_text, end="\n", sep="")
 
     def increment(self):
         if self.n_completed < self.n_jobs:
             self.n_completed += 1
-            self.times.append(time())
-            if len(self.times) > 5:
-                self.times.pop()
+            self._record()
 
     def set_value(self, i: int):
         if i <= self.n_jobs:
             self.n_completed = i
+            self._record()
 
 
 class NestedProgressBar(MutableSequence):
-    def __init__(self, bars: list[ProgressBar] = None, color: bool = True):
+    """
+    Stack of progress bars redrawn together, rate limited like ProgressBar.
+    When stdout isn't a terminal every bar is printed as a plain line,
+    only if something changed since the last time.
+
+    Parameters:
+    bars (list[ProgressBar]): bars to start with
+    color (bool): color the bars, only on a terminal (default: True)
+    min_interval (float): seconds between redraws (default: MIN_INTERVAL
+        on a terminal, PLAIN_INTERVAL otherwise)
+    """
+    def __init__(self, bars: list[ProgressBar] = None, color: bool = True, min_interval: float = None):
         if bars:
             self.bars = bars
         else:
             self.bars = list()
-        self.color = color
+        self.tty = is_tty()
+        self.color = color and self.tty
+        if min_interval is None:
+            min_interval = MIN_INTERVAL if self.tty else PLAIN_INTERVAL
+        self.min_interval = min_interval
+        self.last_print = None
+        self.last_text = None
 
-    def print(self):
+    def print(self, force: bool = False):
+        now = monotonic()
+        if not force and self.last_print is not None and now - self.last_print < self.min_interval:
+            return
+        self.last_print = now
+        if not self.tty:
+            text = "\n".join(bar._text() for bar in self.bars)
+            if text != self.last_text:
+                print(text, flush=True)
+                self.last_text = text
+            return
         for bar in self.bars:
             if self.color:
                 if bar.n_completed == bar.n_jobs:
@@ -134,6 +218,12 @@ class NestedProgressBar(MutableSequence):
         )
 
     def finish(self):
+        # Draw the final state even if the last print was skipped
+        self.print(force=True)
+        if self.tty:
+            self._move_below()
+
+    def _move_below(self):
         print(
             ESC, CSI, len(self.bars), CNL,
             end="",
@@ -153,7 +243,10 @@ class NestedProgressBar(MutableSequence):
         return len(self.bars)
 
     def insert(self, i: int, item: ProgressBar):
-        self.finish()
+        if not self.tty:
+            self.bars.insert(i, item)
+            return
+        self._move_below()
         print()
         self.bars.insert(i, item)
         print(
@@ -0,0 +1,162 @@
+import io
+import os
+import json
+import hashlib
+import tempfile
+import subprocess
+from pathlib import Path
+from cache import CACHE_DIR, file_fingerprint, file_lock
+from intro_cache import ffmpeg_version
+import metrics
+
+# Keyframe every 15 frames, so a seek decodes at most 15 frames
+PROXY_GOP = 15
+
+
+class ProxyCache():
+    """
+    On-disk cache of low resolution proxies of source videos.
+
+    A proxy is a 320x180 h264 copy of the video stream with a keyframe
+    every PROXY_GOP frames and the source's frame timing kept as is, so
+    frame numbers and times line up with the source. It is made the first
+    time a source is asked for and is keyed by the source's path, size and
+    mtime. The least recently used proxies are evicted once the cache grows
+    past max_bytes.
+
+    Parameters:
+    directory (str): directory to store proxies in (default: .cache/proxies)
+    max_bytes (int): size limit of the cache in bytes (default: 50 GiB)
+    width (int): proxy width (default: 320)
+    height (int): proxy height (default: 180)
+    """
+    def __init__(
+            self,
+            directory=CACHE_DIR / "proxies",
+            max_bytes: int = 50 * 1024 ** 3,
+            width: int = 320,
+            height: int = 180
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.width = width
+        self.height = height
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source) -> str:
+        """
+        Returns the cache key of the proxy of source.
+        """
+        params = file_fingerprint(source)
+        params.update(width=self.width, height=self.height, gop=PROXY_GOP,
+                      ffmpeg_version=ffmpeg_version())
+        text = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, source, progress=None) -> Path:
+        """
+        Returns the path of the proxy of source, transcoding it first if it
+        isn't cached. Safe to call for the same source from several
+        processes at once, only one of them transcodes.
+
+        Parameters:
+        source (str): path to source video
+        progress (callable): called with the number of frames transcoded
+            so far while making the proxy
+
+        Returns:
+        Path: path to proxy
+        """
+        path = self.directory / f"{self.key(source)}.mp4"
+        if path.exists():
+            # Mark as recently used
+            os.utime(path)
+            self.hits += 1
+            return path
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with file_lock(path):
+            if path.exists():
+                self.hits += 1
+                return path
+            self.misses += 1
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp.mp4")
+            os.close(fd)
+            try:
+                self.transcode(source, temp_path, progress)
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        self.evict(keep=path)
+        return path
+
+    def transcode(self, source, out_path, progress=None):
+        """
+        Transcodes the video stream of source into a proxy at out_path.
+        """
+        command = [
+            "ffmpeg",
+            "-loglevel", "error",
+            "-progress", "-",
+            "-nostats",
+            "-y",
+            "-i", str(source),
+            "-map", "0:v:0",
+            "-an",
+            "-s", f"{self.width}x{self.height}",
+            "-c:v", "libx264",
+            "-preset", "veryfast",
+            "-crf", "18",
+            "-pix_fmt", "yuv420p",
+            "-g", str(PROXY_GOP),
+            "-keyint_min", str(PROXY_GOP),
+            "-sc_threshold", "0",
+            "-fps_mode", "passthrough",
+            str(out_path)
+        ]
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        lines = []
+        for line in io.TextIOWrapper(proc.stdout, encoding="utf-8"):
+            lines.append(line)
+            if progress is not None and line.startswith("frame="):
+                progress(int(line.strip()[6:]))
+        stderr = proc.stderr.read().decode("utf-8", errors="replace")
+        proc.wait()
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to make a proxy of {source}: {stderr.strip()}")
+        metrics.add_ffmpeg(metrics.parse_progress("".join(lines)))
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used proxies until the cache fits in
+        max_bytes, never removing keep.
+        """
+        proxies = []
+        for path in self.directory.glob("*.mp4"):
+            if path.name.endswith(".tmp.mp4") or path == keep:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            proxies.append((stat.st_mtime, stat.st_size, path))
+        proxies.sort()
+        total = sum(size for _, size, _ in proxies)
+        if keep is not None and Path(keep).exists():
+            total += Path(keep).stat().st_size
+        for _, size, path in proxies:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits * 100 / lookups if lookups else 0
+        return f"Proxy cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
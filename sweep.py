@@ -0,0 +1,226 @@
+import os
+import csv
+import argparse
+from functools import partial
+from itertools import product
+from time import perf_counter
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, Dataset
+from torchvision.transforms import v2
+from torchvision.datasets import ImageFolder
+from model import RESOLUTIONS, DEFAULT_RESOLUTION
+from train import PackedFrameDataset, train, tensor_transforms, data_path, packed_path
+from progress_bar import ProgressBar
+
+RESULTS_FILE = "sweep_results.csv"
+COLUMNS = ("lr", "batch_size", "epochs", "val_accuracy", "val_loss", "train_loss",
+           "epoch_seconds", "samples_per_sec", "total_seconds", "error")
+
+# Dataset of the worker process, set by _init_worker
+_data = None
+
+
+class SharedFrameDataset(Dataset):
+    """
+    Dataset over decoded uint8 frames held in one (N, 3, H, W) tensor,
+    which can live in shared memory so every worker process reads the
+    same copy.
+
+    Parameters:
+    images (torch.Tensor): (N, 3, H, W) uint8 frames
+    labels (torch.Tensor): (N,) int64 labels
+    transform (callable): transform applied to each (3, H, W) uint8 tensor
+    """
+    def __init__(self, images: torch.Tensor, labels: torch.Tensor, transform=tensor_transforms):
+        self.images = images
+        self.labels = labels
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i: int):
+        image = self.images[i]
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, int(self.labels[i])
+
+
+def decode_dataset(
+        packed: bool = False,
+        input_size: tuple[int, int] = RESOLUTIONS[DEFAULT_RESOLUTION],
+        num_workers: int = 4
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Decodes every frame made by make_dataset once into shared memory.
+    Frames are kept as uint8 and normalized when loaded, so the dataset
+    takes 3 * width * height bytes per frame.
+
+    Parameters:
+    packed (bool): read the packed dataset instead of jpegs (default: False)
+    input_size (tuple[int, int]): (width, height) to resize frames to
+    num_workers (int): processes decoding jpegs (default: 4)
+
+    Returns:
+    tuple[torch.Tensor, torch.Tensor]: (N, 3, H, W) uint8 frames and (N,)
+        int64 labels, both in shared memory
+    """
+    width, height = input_size
+    decode = v2.Resize((height, width), antialias=True)
+    if packed:
+        data = PackedFrameDataset(packed_path, transform=decode)
+    else:
+        data = ImageFolder(root=data_path, transform=v2.Compose([v2.PILToTensor(), decode]))
+    images = torch.empty((len(data), 3, height, width), dtype=torch.uint8).share_memory_()
+    labels = torch.empty(len(data), dtype=torch.int64).share_memory_()
+    loader = DataLoader(data, batch_size=256, num_workers=0 if packed else num_workers)
+    bar = ProgressBar(len(loader))
+    bar.update_message("Decoding dataset")
+    i = 0
+    for batch, batch_labels in loader:
+        images[i:i + len(batch)] = batch
+        labels[i:i + len(batch)] = batch_labels
+        i += len(batch)
+        bar.increment()
+        bar.print()
+    print()
+    return images, labels
+
+
+def _init_worker(images: torch.Tensor, labels: torch.Tensor, threads: int):
+    global _data
+    torch.set_num_threads(threads)
+    _data = SharedFrameDataset(images, labels)
+
+
+def run_config(config: dict, input_size: tuple[int, int], seed: int) -> dict:
+    """
+    Trains one configuration in a worker process on the shared dataset.
+
+    Returns:
+    dict: config with the last epoch's accuracy and losses, and the mean
+        epoch time and samples/sec over every epoch
+    """
+    history = []
+    start = perf_counter()
+    train(_data, config["epochs"], config["batch_size"], config["lr"],
+          input_size=input_size, seed=seed, verbose=False, history=history)
+    last = history[-1]
+    return {
+        **config,
+        "val_accuracy": last["val_accuracy"],
+        "val_loss": last["val_loss"],
+        "train_loss": last["train_loss"],
+        "epoch_seconds": sum(h["train_seconds"] for h in history) / len(history),
+        "samples_per_sec": sum(h["samples_per_sec"] for h in history) / len(history),
+        "total_seconds": perf_counter() - start
+    }
+
+
+def try_config(config: dict, input_size: tuple[int, int], seed: int) -> dict:
+    """
+    Runs run_config, returning the config with the error instead of
+    raising if training fails, so one bad configuration doesn't stop the
+    rest of the sweep.
+    """
+    try:
+        return run_config(config, input_size, seed)
+    except Exception as e:
+        return {**config, "error": f"{type(e).__name__}: {e}"}
+
+
+def sweep(
+        configs: list[dict],
+        packed: bool = False,
+        resolution: str = DEFAULT_RESOLUTION,
+        workers: int = 2,
+        threads: int = None,
+        seed: int = 0,
+        results_path: str = RESULTS_FILE
+) -> list[dict]:
+    """
+    Trains every configuration on one shared copy of the dataset, workers
+    at a time. Every configuration is validated on the same split.
+    Results are written to results_path as each configuration finishes, so
+    a sweep that is stopped keeps what it finished. A configuration that
+    fails is written with its error and the sweep carries on.
+
+    Parameters:
+    configs (list[dict]): lr, batch_size and epochs of each run
+    packed (bool): train on the packed dataset instead of jpegs (default: False)
+    resolution (str): key of model.RESOLUTIONS to train at (default: '320x180')
+    workers (int): configurations trained at once (default: 2)
+    threads (int): torch threads of each worker (default: CPUs / workers)
+    seed (int): seed of the train/validation split (default: 0)
+    results_path (str): csv file to write results to (default: sweep_results.csv)
+
+    Returns:
+    list[dict]: results of every configuration, best accuracy first and
+        failed ones last
+    """
+    input_size = RESOLUTIONS[resolution]
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+    images, labels = decode_dataset(packed, input_size)
+    print(f"Training {len(configs)} configurations on {len(labels)} frames, "
+          f"{workers} at a time with {threads} threads each")
+
+    results = []
+    bar = ProgressBar(len(configs))
+    bar.update_message("Sweeping")
+    bar.print()
+    context = mp.get_context("spawn")
+    with open(results_path, "w", newline="") as f, \
+            context.Pool(workers, _init_worker, (images, labels, threads)) as pool:
+        writer = csv.DictWriter(f, COLUMNS)
+        writer.writeheader()
+        run = partial(try_config, input_size=input_size, seed=seed)
+        # In the order they finish, so a slow run doesn't hold back the rest
+        for result in pool.imap_unordered(run, configs):
+            writer.writerow(result)
+            f.flush()
+            results.append(result)
+            bar.increment()
+            bar.print()
+    print()
+    results.sort(key=lambda r: r.get("val_accuracy", -1), reverse=True)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train SparringCNN with every combination of settings in parallel.")
+    parser.add_argument("--lr", type=float, nargs="+", default=[0.001],
+                        help="learning rates to try (default: 0.001)")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[32],
+                        help="batch sizes to try (default: 32)")
+    parser.add_argument("--epochs", type=int, nargs="+", default=[1],
+                        help="numbers of epochs to try (default: 1)")
+    parser.add_argument("--packed", action="store_true",
+                        help=f"train on packed frames in {packed_path} instead of jpegs in {data_path}")
+    parser.add_argument("--resolution", choices=RESOLUTIONS, default=DEFAULT_RESOLUTION,
+                        help=f"width x height to train at (default: {DEFAULT_RESOLUTION})")
+    parser.add_argument("--workers", type=int, default=2,
+                        help="configurations to train at once (default: 2)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch threads per worker (default: CPUs / workers)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the train/validation split (default: 0)")
+    parser.add_argument("--out", default=RESULTS_FILE,
+                        help=f"csv file to write results to (default: {RESULTS_FILE})")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configs = [{"lr": lr, "batch_size": batch_size, "epochs": epochs}
+               for lr, batch_size, epochs in product(args.lr, args.batch_size, args.epochs)]
+    results = sweep(configs, args.packed, args.resolution, args.workers, args.threads,
+                    args.seed, args.out)
+    print(f"{'lr':>10}{'batch':>7}{'epochs':>8}{'val acc':>10}{'epoch s':>10}{'samples/s':>11}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['lr']:>10g}{r['batch_size']:>7}{r['epochs']:>8}  failed: {r['error']}")
+            continue
+        print(f"{r['lr']:>10g}{r['batch_size']:>7}{r['epochs']:>8}{r['val_accuracy']:>10.4f}"
+              f"{r['epoch_seconds']:>10.1f}{r['samples_per_sec']:>11.1f}")
@@ -1,16 +1,24 @@
+import os
+import argparse
+from time import perf_counter
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from model import SparringCNN
-from torch.utils.data import random_split, DataLoader
+from model import SparringCNN, RESOLUTIONS, DEFAULT_RESOLUTION
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import random_split, DataLoader, Dataset, DistributedSampler
 from torchvision.transforms import v2
 from torchvision.datasets import ImageFolder
 from progress_bar import ProgressBar
+from packed_dataset import open_packed, packed_folders
 
 # Set device
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 data_path = "data/"
+packed_path = "data_packed/"
 
 transforms = v2.Compose([
     v2.RandomHorizontalFlip(p=0.5),
@@ -19,67 +27,324 @@ transforms = v2.Compose([
     v2.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])
 ])
 
+# Same as transforms, for uint8 CHW tensors instead of PIL images
+tensor_transforms = v2.Compose([
+    v2.RandomHorizontalFlip(p=0.5),
+    v2.ToDtype(torch.float32, scale=True),
+    v2.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])
+])
+
+
+class PackedFrameDataset(Dataset):
+    """
+    Dataset over packed folders written by packed_dataset.PackedWriter.
+    Frames are memory-mapped and sliced without copying, so nothing is
+    decoded when a sample is loaded.
+
+    Parameters:
+    packed_path (str): folder containing packed folders
+    transform (callable): transform applied to each (3, H, W) uint8 tensor
+    """
+    def __init__(self, packed_path: str = packed_path, transform=tensor_transforms):
+        self.transform = transform
+        self.frames = []
+        labels = []
+        for folder in packed_folders(packed_path):
+            frames, video_labels, _ = open_packed(folder)
+            self.frames.append(frames)
+            labels.append(video_labels)
+        if not self.frames:
+            raise FileNotFoundError(f"No packed folders in {packed_path}")
+        self.labels = np.concatenate(labels).astype(np.int64)
+        self.offsets = np.cumsum([0] + [len(f) for f in self.frames])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, i: int):
+        video = int(np.searchsorted(self.offsets, i, side="right")) - 1
+        frame = self.frames[video][i - self.offsets[video]]
+        image = torch.from_numpy(frame).permute(2, 0, 1)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, int(self.labels[i])
+
+
+def resized(transform: v2.Compose, input_size: tuple[int, int]) -> v2.Compose:
+    """
+    Returns transform with a resize to (width, height) input_size in front.
+    """
+    width, height = input_size
+    return v2.Compose([v2.Resize((height, width), antialias=True), *transform.transforms])
+
+
+def load_dataset(packed: bool = False, input_size: tuple[int, int] = None) -> Dataset:
+    """
+    Loads the frames made by make_dataset, either packed or as jpegs,
+    resized to (width, height) input_size if given.
+    """
+    if packed:
+        transform = tensor_transforms
+        if input_size is not None:
+            transform = resized(transform, input_size)
+        return PackedFrameDataset(packed_path, transform)
+    transform = transforms
+    if input_size is not None:
+        transform = resized(transform, input_size)
+    return ImageFolder(root=data_path, transform=transform)
+
+
+def split_dataset(data: Dataset, seed: int = None) -> tuple[Dataset, Dataset]:
+    """
+    Splits data 80/20 into train and validation sets at random. The split
+    is the same every time for the same seed.
+    """
+    generator = torch.Generator()
+    if seed is not None:
+        generator.manual_seed(seed)
+    return random_split(data, [0.8, 0.2], generator=generator)
+
+
+class SilentBar():
+    """
+    Stands in for ProgressBar on ranks other than 0, which don't print.
+    """
+    def update_message(self, message: str = ""):
+        pass
+
+    def print(self):
+        pass
+
+    def increment(self):
+        pass
+
+
+def init_distributed() -> tuple[int, int]:
+    """
+    Joins the process group started by torchrun with the gloo backend and
+    splits the cores of this host between its ranks.
+
+    Returns:
+    tuple[int, int]: rank of this process and number of processes
+    """
+    dist.init_process_group("gloo")
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+    torch.set_num_threads(max(1, os.cpu_count() // local_world_size))
+    return dist.get_rank(), dist.get_world_size()
+
 
-data = ImageFolder(root=data_path, transform=transforms)
-
-train_size = 0.8
-val_size = 1 - train_size
-train_set, val_set = random_split(data, [train_size, val_size])
-
-batch_size = 32
-train_loader = DataLoader(train_set, batch_size=batch_size, shuffle=True)
-val_loader = DataLoader(val_set, batch_size=batch_size, shuffle=False)
-
-model = SparringCNN()
-
-criterion = nn.CrossEntropyLoss()
-optimizer = optim.Adam(model.parameters(), lr=0.001)
-
-num_epochs = 1
-model = model.to(device)
-
-print("Started Training")
-for epoch in range(num_epochs):
-    model.train()
-    train_loss = 0.0
-    bar = ProgressBar(len(train_loader))
-    bar.update_message("Training")
-    bar.print()
-    for images, labels in train_loader:
-        images, labels = images.to(device), labels.to(device)
-        optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
-        train_loss += loss.item() * images.size(0)
-        bar.increment()
+def all_reduce_sum(*values: float) -> list[float]:
+    """
+    Sums values over every rank, or returns them as they are when not
+    running distributed.
+    """
+    if not dist.is_initialized():
+        return list(values)
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+
+def train(
+        data: Dataset,
+        num_epochs: int = 1,
+        batch_size: int = 32,
+        lr: float = 0.001,
+        num_workers: int = 0,
+        input_size: tuple[int, int] = RESOLUTIONS[DEFAULT_RESOLUTION],
+        seed: int = None,
+        verbose: bool = True,
+        history: list = None
+) -> SparringCNN:
+    """
+    Trains a SparringCNN on a random 80/20 train/validation split of data.
+    input_size must match the (width, height) of the frames in data, and
+    seed fixes the split, see split_dataset.
+
+    verbose=False trains without printing anything. If history is given,
+    a dict of the losses, validation accuracy, training seconds and
+    samples/sec of each epoch is appended to it.
+
+    If init_distributed was called, each rank trains on its own shard of
+    the split on the CPU and gradients are averaged over ranks every step.
+    batch_size is then per rank. Only rank 0 prints.
+
+    Returns:
+    SparringCNN: trained model
+    """
+    distributed = dist.is_initialized()
+    rank = dist.get_rank() if distributed else 0
+    world_size = dist.get_world_size() if distributed else 1
+    main = rank == 0
+    show = main and verbose
+    run_device = torch.device("cpu") if distributed else device
+    if distributed and seed is None:
+        # Every rank has to split the data the same way
+        seed = 0
+
+    train_set, val_set = split_dataset(data, seed)
+
+    train_sampler = val_sampler = None
+    if distributed:
+        train_sampler = DistributedSampler(train_set, shuffle=True, seed=seed)
+        val_sampler = DistributedSampler(val_set, shuffle=False)
+    train_loader = DataLoader(train_set, batch_size=batch_size, shuffle=train_sampler is None,
+                              sampler=train_sampler, num_workers=num_workers)
+    val_loader = DataLoader(val_set, batch_size=batch_size, shuffle=False,
+                            sampler=val_sampler, num_workers=num_workers)
+
+    model = SparringCNN(input_size)
+
+    criterion = nn.CrossEntropyLoss()
+
+    model = model.to(run_device)
+    if distributed:
+        model = DistributedDataParallel(model)
+    optimizer = optim.Adam(model.parameters(), lr=lr)
+
+    if show:
+        print(f"Started Training on {world_size} process{'es' if world_size > 1 else ''}")
+    for epoch in range(num_epochs):
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+        model.train()
+        train_loss = 0.0
+        train_samples = 0
+        bar = ProgressBar(len(train_loader)) if show else SilentBar()
+        bar.update_message("Training")
         bar.print()
-    bar.print()
-    print()
-
-    bar = ProgressBar(len(val_loader))
-    bar.update_message("Validation")
-    bar.print()
-    model.eval()
-    val_loss = 0.0
-    val_corrects = 0
-    with torch.no_grad():
-        for images, labels in val_loader:
-            images, labels = images.to(device), labels.to(device)
+        start = perf_counter()
+        for images, labels in train_loader:
+            images, labels = images.to(run_device), labels.to(run_device)
+            optimizer.zero_grad()
             outputs = model(images)
             loss = criterion(outputs, labels)
-            val_loss += loss.item() * images.size(0)
-            _, preds = torch.max(outputs, 1)
-            val_corrects += torch.sum(preds == labels.data)
+            loss.backward()
+            optimizer.step()
+            train_loss += loss.item() * images.size(0)
+            train_samples += images.size(0)
             bar.increment()
             bar.print()
-    bar.print()
-    print()
+        train_seconds = perf_counter() - start
+        bar.print()
+        if show:
+            print()
+
+        bar = ProgressBar(len(val_loader)) if show else SilentBar()
+        bar.update_message("Validation")
+        bar.print()
+        model.eval()
+        val_loss = 0.0
+        val_corrects = 0
+        val_samples = 0
+        with torch.no_grad():
+            for images, labels in val_loader:
+                images, labels = images.to(run_device), labels.to(run_device)
+                outputs = model(images)
+                loss = criterion(outputs, labels)
+                val_loss += loss.item() * images.size(0)
+                _, preds = torch.max(outputs, 1)
+                val_corrects += int(torch.sum(preds == labels.data))
+                val_samples += images.size(0)
+                bar.increment()
+                bar.print()
+        bar.print()
+        if show:
+            print()
+
+        rates = [train_samples / train_seconds]
+        if distributed:
+            rates = [None] * world_size
+            dist.all_gather_object(rates, train_samples / train_seconds)
+        train_loss, train_samples, val_loss, val_corrects, val_samples = all_reduce_sum(
+            train_loss, train_samples, val_loss, val_corrects, val_samples)
+        if main:
+            train_loss = train_loss / train_samples
+            val_loss = val_loss / val_samples
+            val_accuracy = val_corrects / val_samples
+            if history is not None:
+                history.append({"epoch": epoch + 1, "train_loss": train_loss, "val_loss": val_loss,
+                                "val_accuracy": val_accuracy, "train_seconds": train_seconds,
+                                "samples_per_sec": sum(rates)})
+            if show:
+                print(f"Epoch {epoch + 1}, Train Loss: {train_loss:.4f}, Val Loss: {val_loss:.4f}, Val Accuracy: {val_accuracy:.4f}, "
+                      f"Train Time: {train_seconds:.1f}s")
+                report_throughput(rates)
+    if distributed:
+        model = model.module
+    return model
+
+
+def report_throughput(rates: list[float]):
+    """
+    Prints the training samples/sec of each rank and of all of them together.
+    """
+    if len(rates) > 1:
+        for rank, rate in enumerate(rates):
+            print(f"  Rank {rank}: {rate:.1f} samples/sec")
+    print(f"  Total: {sum(rates):.1f} samples/sec")
+
+
+def benchmark_loading(
+        batch_size: int = 32,
+        n_batches: int = 100,
+        num_workers: int = 0
+) -> dict[str, float]:
+    """
+    Measures samples/sec of loading shuffled batches from the ImageFolder
+    jpegs and from the packed dataset.
+
+    Returns:
+    dict[str, float]: samples/sec of each dataset
+    """
+    results = dict()
+    for name, packed in (("ImageFolder", False), ("PackedFrameDataset", True)):
+        loader = DataLoader(load_dataset(packed), batch_size=batch_size,
+                            shuffle=True, num_workers=num_workers)
+        samples = 0
+        start = perf_counter()
+        for i, (images, _) in enumerate(loader):
+            samples += images.size(0)
+            if i + 1 == n_batches:
+                break
+        results[name] = samples / (perf_counter() - start)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train SparringCNN on frames made by make_dataset.")
+    parser.add_argument("--packed", action="store_true",
+                        help=f"train on packed frames in {packed_path} instead of jpegs in {data_path}")
+    parser.add_argument("--resolution", choices=RESOLUTIONS, default=DEFAULT_RESOLUTION,
+                        help=f"width x height to train at (default: {DEFAULT_RESOLUTION})")
+    parser.add_argument("--distributed", action="store_true",
+                        help="train data parallel over the processes started by torchrun, "
+                             "e.g. torchrun --nproc_per_node=8 train.py --distributed")
+    parser.add_argument("--epochs", type=int, default=1,
+                        help="number of epochs (default: 1)")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="batch size, per process when distributed (default: 32)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the train/validation split (default: 0)")
+    parser.add_argument("--benchmark-loading", action="store_true",
+                        help="compare samples/sec of the jpeg and packed datasets and exit")
+    return parser.parse_args()
 
-    train_loss = train_loss / len(train_loader.dataset)
-    val_loss = val_loss / len(val_loader.dataset)
-    val_accuracy = val_corrects.double() / len(val_loader.dataset)
-    print(f"Epoch {epoch + 1}, Train Loss: {train_loss:.4f}, Val Loss: {val_loss:.4f}, Val Accuracy: {val_accuracy:.4f}")
 
-torch.save(model.state_dict(), "./model.pth")
+if __name__ == "__main__":
+    args = parse_args()
+    if args.benchmark_loading:
+        for name, rate in benchmark_loading().items():
+            print(f"{name}: {rate:.1f} samples/sec")
+    else:
+        input_size = RESOLUTIONS[args.resolution]
+        resize = None if args.resolution == DEFAULT_RESOLUTION else input_size
+        rank = 0
+        if args.distributed:
+            rank, _ = init_distributed()
+        model = train(load_dataset(args.packed, resize), args.epochs, args.batch_size,
+                      input_size=input_size, seed=args.seed)
+        if rank == 0:
+            torch.save(model.to("cpu").state_dict(), "./model.pth")
+        if args.distributed:
+            dist.destroy_process_group()
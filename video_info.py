@@ -1,6 +1,13 @@
 import csv
-import cv2
+import json
+import math
+import subprocess
 from pathlib import Path
+from fractions import Fraction
+from concurrent.futures import ThreadPoolExecutor
+from cache import JsonCache
+
+_probe_cache = None
 
 
 class VideoInfo():
@@ -16,12 +23,34 @@ class VideoInfo():
         self.second_line = second_line
         self.path = path
         self.segments = segments
+        self.probe = None
         if output_file_name is None:
             combined = second_line + "_" + first_line
             self.output_file_name = combined.replace(" ", "_")
         else:
             self.output_file_name = output_file_name
 
+    def to_dict(self) -> dict:
+        """
+        Returns the config row of this video as json serializable data.
+        """
+        return {
+            "first_line": self.first_line,
+            "second_line": self.second_line,
+            "path": str(self.path),
+            "segments": [list(segment) for segment in self.segments],
+            "output_file_name": self.output_file_name
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """
+        Makes a VideoInfo from the output of to_dict.
+        """
+        segments = [tuple(segment) for segment in data["segments"]]
+        return cls(data["first_line"], data["second_line"], Path(data["path"]),
+                   segments, data["output_file_name"])
+
     def __str__(self):
         ret = f"First Line: {self.first_line}\n"
         ret += f"Second Line: {self.second_line}\n"
@@ -31,7 +60,27 @@ class VideoInfo():
         return ret
 
 
-def read_config(config_file_path: str = "config.csv", parent_path: str = None):
+def read_config(
+        config_file_path: str = "config.csv",
+        parent_path: str = None,
+        probe: bool = False,
+        jobs: int = 16
+):
+    """
+    Reads a config csv of first line, second line, path and segment start
+    and stop times.
+
+    Parameters:
+    config_file_path (str): path to config file (default: 'config.csv')
+    parent_path (str): folder paths are relative to (default: cwd)
+    probe (bool): probe every video in parallel, store the result in
+        VideoInfo.probe, check that each video can be read and cut its
+        segments short at the end of it, see clamp_segments (default: False)
+    jobs (int): number of videos to probe at once (default: 16)
+
+    Returns:
+    list[VideoInfo]: one VideoInfo per row
+    """
     # Get parent path
     if parent_path is None:
         parent_path = Path.cwd()
@@ -68,14 +117,175 @@ def read_config(config_file_path: str = "config.csv", parent_path: str = None):
                     segments.append((int(row[i]), int(row[i+1])))
 
             config.append(VideoInfo(first_line, second_line, path, segments))
+
+    if probe:
+        probes = probe_videos([c.path for c in config], jobs)
+        for c in config:
+            c.probe = probes[str(c.path)]
+            if c.probe is None:
+                print(f"Path: [{c.path}] is not a readable video")
+                exit(1)
+            c.segments = clamp_segments(c.path, c.segments, c.probe.duration)
     return config
 
 
+def clamp_segments(path, segments: list[tuple[int]], duration: float) -> list[tuple[int]]:
+    """
+    Cuts segments short at the end of the video. Segment times are whole
+    seconds, so a stop in the last partial second is clamped quietly and
+    anything later with a warning. Segments that don't start inside the
+    video are dropped with a warning.
+
+    Parameters:
+    path (Path): path to the video, for warnings
+    segments (list[tuple[int]]): (start, stop) times of segments
+    duration (float): length of the video in seconds
+
+    Returns:
+    list[tuple[int]]: segments that fit inside the video
+    """
+    clamped = []
+    for start, stop in segments:
+        if not 0 <= start < min(stop, duration):
+            print(f"Path: [{path}] segment ({start}, {stop}) doesn't fit in the video "
+                  f"({duration:.2f}s), skipping it")
+            continue
+        if stop > math.ceil(duration):
+            print(f"Path: [{path}] segment ({start}, {stop}) ends after the video "
+                  f"({duration:.2f}s), cutting it short")
+        clamped.append((start, min(stop, duration)))
+    return clamped
+
+
+class VideoProbe():
+    """
+    Properties of a video read by probe_video.
+    """
+    def __init__(
+            self,
+            fps: float,
+            frame_count: int,
+            duration: float,
+            width: int,
+            height: int,
+            codec: str,
+            has_audio: bool
+    ):
+        self.fps = fps
+        self.frame_count = frame_count
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.codec = codec
+        self.has_audio = has_audio
+
+    def __str__(self):
+        ret = f"FPS: {self.fps}\n"
+        ret += f"Frame Count: {self.frame_count}\n"
+        ret += f"Duration: {self.duration}\n"
+        ret += f"Resolution: {self.width}x{self.height}\n"
+        ret += f"Codec: {self.codec}\n"
+        ret += f"Audio: {self.has_audio}\n"
+        return ret
+
+
+def _read_probe(path) -> dict:
+    """
+    Reads video properties with a single ffprobe call.
+    """
+    command = ["ffprobe",
+               "-v", "error",
+               "-show_entries",
+               "stream=codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,duration"
+               ":format=duration",
+               "-of", "json",
+               str(path)]
+    result = subprocess.run(command, capture_output=True, check=True)
+    info = json.loads(result.stdout)
+    streams = info.get("streams", [])
+    video = next(s for s in streams if s["codec_type"] == "video")
+
+    fps = 0.0
+    for rate in (video.get("avg_frame_rate"), video.get("r_frame_rate")):
+        if rate and not rate.endswith("/0") and Fraction(rate) > 0:
+            fps = float(Fraction(rate))
+            break
+    duration = float(video.get("duration") or info.get("format", {}).get("duration") or 0)
+    if video.get("nb_frames", "N/A") not in ("N/A", "0"):
+        frame_count = int(video["nb_frames"])
+    else:
+        frame_count = round(duration * fps)
+    return {
+        "fps": fps,
+        "frame_count": frame_count,
+        "duration": duration,
+        "width": video["width"],
+        "height": video["height"],
+        "codec": video["codec_name"],
+        "has_audio": any(s["codec_type"] == "audio" for s in streams)
+    }
+
+
+def _get_probe_cache() -> JsonCache:
+    global _probe_cache
+    if _probe_cache is None:
+        _probe_cache = JsonCache("probe")
+    return _probe_cache
+
+
+def probe_video(path) -> VideoProbe:
+    """
+    Returns fps, frame count, duration, resolution, codec and audio presence
+    of a video. Results are cached on disk keyed by path, size and mtime.
+
+    Parameters:
+    path (str): path to video
+
+    Returns:
+    VideoProbe: properties of the video
+    """
+    cache = _get_probe_cache()
+    values = cache.get(path)
+    if values is None:
+        values = _read_probe(path)
+        cache.set(path, values)
+    return VideoProbe(**values)
+
+
+def probe_videos(paths: list, jobs: int = 16) -> dict[str, VideoProbe]:
+    """
+    Probes many videos at once, saving the cache only once at the end.
+
+    Parameters:
+    paths (list): paths to videos
+    jobs (int): number of ffprobe processes to run at once (default: 16)
+
+    Returns:
+    dict[str, VideoProbe]: probe of each path, None if it couldn't be read
+    """
+    cache = _get_probe_cache()
+    values = {str(path): cache.get(path) for path in paths}
+    missing = [path for path in values if values[path] is None]
+
+    def read(path):
+        try:
+            return _read_probe(path)
+        except (subprocess.CalledProcessError, StopIteration, KeyError, ValueError):
+            return None
+
+    with ThreadPoolExecutor(jobs) as pool:
+        for path, probe in zip(missing, pool.map(read, missing)):
+            values[path] = probe
+            if probe is not None:
+                cache.set(path, probe, save=False)
+    if missing:
+        cache.save()
+    return {path: None if v is None else VideoProbe(**v) for path, v in values.items()}
+
+
 def get_fps(path):
-    cap = cv2.VideoCapture(path)
-    return cap.get(cv2.CAP_PROP_FPS)
+    return probe_video(path).fps
 
 
 def get_frame_count(path):
-    cap = cv2.VideoCapture(path)
-    return int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    return probe_video(path).frame_count